@@ -107,6 +107,8 @@ DATABASES = {
     'default': env.db('DATABASE_URL', default='postgres:///gcleaner'),
 }
 DATABASES['default']['ATOMIC_REQUESTS'] = True
+# Refreshed OAuth tokens are committed on a connection of their own, independently of the request transaction.
+DATABASES['tokens'] = dict(DATABASES['default'], ATOMIC_REQUESTS=False, TEST={'MIRROR': 'default'})
 
 
 # GENERAL CONFIGURATION
@@ -279,7 +281,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_jwt.authentication.JSONWebTokenAuthentication',
+        'gcleaner.authentication.backends.JSONWebTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     )
 }
@@ -329,8 +331,63 @@ GOOGLE_AUTH_SETTINGS = {
     ],
     'CREDENTIALS': ROOT_DIR.path('credentials.json'),
     'OAUTH2_TOKEN_ENDPOINT': 'https://oauth2.googleapis.com/token',
+    'DISCOVERY_DOCUMENT': APPS_DIR('emails', 'data', 'gmail-v1.json'),
+    'HTTP_POOL_SIZE': env.int('GMAIL_HTTP_POOL_SIZE', default=10),
+    'HTTP_POOL_ACQUIRE_TIMEOUT': env.int('GMAIL_HTTP_POOL_ACQUIRE_TIMEOUT', default=30),
+    'HTTP_TIMEOUT': env.int('GMAIL_HTTP_TIMEOUT', default=60),
     'MESSAGE_FIELDS': 'id,threadId,labelIds,snippet,internalDate,payload/headers/*',
-    'METADATA_HEADERS': ['Delivered-To', 'Subject', 'From', 'To', 'List-Unsubscribe']
+    'METADATA_HEADERS': ['Delivered-To', 'Subject', 'From', 'To', 'List-Unsubscribe'],
+    # GMail API accepts at most 100 requests per batch, but throttles batches larger than 50.
+    'BATCH_SIZE': env.int('GMAIL_BATCH_SIZE', default=50),
+    'BATCH_CONCURRENCY': env.int('GMAIL_BATCH_CONCURRENCY', default=4),
+    # Failed requests are retried with a jittered exponential backoff within a total deadline (seconds).
+    'RETRY_BASE_DELAY': 1,
+    'RETRY_MAX_DELAY': 8,
+    'RETRY_DEADLINE': env.int('GMAIL_RETRY_DEADLINE', default=15),
+    'UNREAD_COUNT_CACHE_TIMEOUT': 60,
+    'LABELS_CACHE_TIMEOUT': 60 * 60 * 24,
+    # Emails are stored in bulk statements of at most that many rows.
+    'STORE_BATCH_SIZE': 200,
+    'SENDER_ROLLUP_SUBJECTS': 3,
+    # Number of distinct parsed senders shared between the parsed emails of a process.
+    'SENDER_INTERN_CACHE_SIZE': 4096,
+    # Page sizes of the paginated email list, GMail API lists at most 500 emails per page.
+    'LIST_PAGE_SIZE': 100,
+    'LIST_MAX_PAGE_SIZE': 500,
+    # Synchronized emails are served from the database and refreshed in the background once stale (seconds).
+    'STALE_AFTER': env.int('GMAIL_STALE_AFTER', default=60),
+    'REFRESH_WORKERS': env.int('GMAIL_REFRESH_WORKERS', default=4),
+    'REFRESH_LOCK_TIMEOUT': 60 * 5,
+    # Concurrent identical GMail listings and detail fetches of a user share one call (seconds).
+    'SINGLE_FLIGHT_TIMEOUT': 60,
+    'SINGLE_FLIGHT_POLL_INTERVAL': 0.1,
+    # GMail API calls are paced to the quota units GMail allows per user and per project and second.
+    'QUOTA_BUCKETS': 'gcleaner.emails.ratelimit.LocalTokenBuckets',
+    'USER_QUOTA_RATE': env.int('GMAIL_USER_QUOTA_RATE', default=250),
+    'USER_QUOTA_BURST': env.int('GMAIL_USER_QUOTA_BURST', default=250),
+    'PROJECT_QUOTA_RATE': env.int('GMAIL_PROJECT_QUOTA_RATE', default=20000),
+    'PROJECT_QUOTA_BURST': env.int('GMAIL_PROJECT_QUOTA_BURST', default=20000),
+    'QUOTA_MAX_WAIT': 10,
+    # GMail API calls fail fast for a while once most recent calls failed or were slow (seconds).
+    'CIRCUIT_BREAKER_WINDOW': 30,
+    'CIRCUIT_BREAKER_MIN_CALLS': 10,
+    'CIRCUIT_BREAKER_ERROR_RATE': 0.5,
+    'CIRCUIT_BREAKER_SLOW_CALL_DURATION': env.int('GMAIL_SLOW_CALL_DURATION', default=10),
+    'CIRCUIT_BREAKER_OPEN_DURATION': 30,
+    'CIRCUIT_BREAKER_HALF_OPEN_CALLS': 1,
+    # OAuth tokens are stored encrypted with this Fernet key, derived from the secret key by default.
+    'TOKEN_ENCRYPTION_KEY': env('GOOGLE_TOKEN_ENCRYPTION_KEY', default=None),
+    # One request refreshes an expired access token, concurrent ones wait for it (seconds).
+    'TOKEN_REFRESH_LOCK_TIMEOUT': 30,
+    'TOKEN_DATABASE': 'tokens',
+    'TOKEN_REFRESH_WAIT': 10,
+    # GMail API accepts at most 1000 ids per batchModify request.
+    'MODIFY_BATCH_SIZE': 1000,
+    # A batchModify request costs 50 quota units out of the 250 units per user and second.
+    'MODIFY_CONCURRENCY': env.int('GMAIL_MODIFY_CONCURRENCY', default=3),
+    'MODIFY_JOB_WORKERS': env.int('GMAIL_MODIFY_JOB_WORKERS', default=2),
+    # Unfinished jobs that did not progress for that long (seconds) were interrupted.
+    'MODIFY_JOB_TIMEOUT': 60 * 10,
 }
 
 CORS_ORIGIN_WHITELIST = (
@@ -339,3 +396,11 @@ CORS_ORIGIN_WHITELIST = (
     'test.gcleaner.co',
     'app.gcleaner.co',
 )
+
+# Freshness markers of the email list, read by the frontend to poll for a refreshed list.
+CORS_EXPOSE_HEADERS = (
+    'Last-Modified',
+    'X-Refreshing',
+    'X-Stale',
+    'Retry-After',
+)
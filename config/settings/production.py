@@ -12,6 +12,7 @@ import logging
 
 
 from .base import *  # noqa
+from .base import GOOGLE_AUTH_SETTINGS
 
 # SECRET CONFIGURATION
 # ------------------------------------------------------------------------------
@@ -97,6 +98,7 @@ DATABASES = {
         'PORT': env('RDS_PORT'),
     }
 }
+DATABASES['tokens'] = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
 
 
 # CACHING
@@ -119,6 +121,9 @@ CACHES = {
     }
 }
 
+# GMail quota buckets are shared by all the workers
+GOOGLE_AUTH_SETTINGS['QUOTA_BUCKETS'] = 'gcleaner.emails.ratelimit.RedisTokenBuckets'
+
 
 # Sentry Configuration
 SENTRY_DSN = env('DJANGO_SENTRY_DSN')
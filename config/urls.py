@@ -19,7 +19,8 @@ from django.views.generic import RedirectView
 from rest_framework.routers import DefaultRouter
 
 from gcleaner.authentication.jwt import obtain_jwt_token
-from gcleaner.emails.views import EmailListView, EmailModifyView, EmailStatsView, EmailLockView
+from gcleaner.emails.views import EmailListView, EmailModifyView, EmailStatsView, EmailLockView, \
+    ModifyEmailsJobView, EmailCleanView, SenderRollupListView
 
 router = DefaultRouter()
 
@@ -27,8 +28,11 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/', include(router.urls)),
     path('api/v1/messages/', EmailListView.as_view()),
+    path('api/v1/messages/clean/', EmailCleanView.as_view()),
     path('api/v1/messages/lock/', EmailLockView.as_view()),
     path('api/v1/messages/modify/', EmailModifyView.as_view()),
+    path('api/v1/messages/modify/jobs/<int:pk>/', ModifyEmailsJobView.as_view()),
+    path('api/v1/messages/senders/', SenderRollupListView.as_view()),
     path('api/v1/messages/stats/', EmailStatsView.as_view()),
     path('api-token-auth/', obtain_jwt_token),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
@@ -0,0 +1,31 @@
+from rest_framework_jwt.authentication import JSONWebTokenAuthentication as BaseJSONWebTokenAuthentication
+
+
+class JSONWebTokenAuthentication(BaseJSONWebTokenAuthentication):
+    """
+    JWT authentication that keeps the decoded payload as `request.auth`.
+
+    Protected endpoints need the payload again to build the GMail credentials,
+    so it is decoded and verified once per request. Authentication instances
+    are created for every request, hence the payload is request-scoped.
+    """
+
+    def authenticate(self, request):
+        """
+        :return: A tuple of the `User` instance and the decoded JWT payload, or
+                 None if the request has no JWT.
+        """
+        self.payload = None
+
+        result = super().authenticate(request)
+        if result is None:
+            return None
+
+        user, jwt_value = result
+
+        return user, self.payload
+
+    def authenticate_credentials(self, payload):
+        self.payload = payload
+
+        return super().authenticate_credentials(payload)
@@ -1,4 +1,3 @@
-from googleapiclient.discovery import build
 from rest_framework.views import APIView
 from rest_framework import status
 from rest_framework.response import Response
@@ -7,6 +6,8 @@ from rest_framework_jwt.settings import api_settings
 from rest_framework_jwt.utils import jwt_payload_handler, jwt_encode_handler, jwt_response_payload_handler
 
 from gcleaner.authentication.google import obtain_google_oauth_credentials
+from gcleaner.authentication.tokens import store_credentials
+from gcleaner.emails.gmail import build_gmail_service
 from gcleaner.users.models import User
 
 
@@ -25,7 +26,7 @@ class JSONWebTokenAPIView(APIView):
 
         :return: User email address.
         """
-        service = build('gmail', 'v1', credentials=credentials)
+        service = build_gmail_service(credentials)
         profile = service.users().getProfile(userId='me').execute()
 
         return profile.get('emailAddress', None)
@@ -43,13 +44,17 @@ class JSONWebTokenAPIView(APIView):
     def get_jwt_token(self, user, credentials):
         """
         Compute the payload and encode it into a JWT.
+
+        The Google tokens are kept in the server-side token store of the user,
+        so the JWT does not carry them.
+
         :param user: The User instance for which to encode the JWT token.
         :param credentials: User credentials ot use with GMail API.
         :return: The JWT token.
         """
+        store_credentials(user, credentials)
+
         payload = jwt_payload_handler(user)
-        payload['access_token'] = credentials.token
-        payload['refresh_token'] = credentials.refresh_token
 
         return jwt_encode_handler(payload)
 
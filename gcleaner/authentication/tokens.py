@@ -0,0 +1,177 @@
+import base64
+import hashlib
+import time
+
+import google_auth_httplib2
+from cryptography.fernet import Fernet
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from google.oauth2.credentials import Credentials
+
+from gcleaner.emails.transport import PooledHttp, get_http_pool
+from gcleaner.users.models import GoogleToken
+from gcleaner.utils.readers import get_credentials_config_json
+
+
+def get_fernet():
+    """
+    :return: A `cryptography.fernet.Fernet` instance keyed by
+             `GOOGLE_AUTH_SETTINGS['TOKEN_ENCRYPTION_KEY']`, or by a key derived
+             from the Django secret key if it is not set.
+    """
+    key = settings.GOOGLE_AUTH_SETTINGS['TOKEN_ENCRYPTION_KEY']
+
+    if not key:
+        key = base64.urlsafe_b64encode(hashlib.sha256(settings.SECRET_KEY.encode()).digest())
+
+    return Fernet(key)
+
+
+def encrypt_token(token):
+    return get_fernet().encrypt(token.encode()).decode() if token else ''
+
+
+def decrypt_token(token):
+    return get_fernet().decrypt(token.encode()).decode() if token else None
+
+
+def build_credentials(token, refresh_token=None, expiry=None):
+    """
+    Build a `google.oauth2.credentials.Credentials` instance of the GCleaner client.
+
+    :param {str} token: The OAuth access token.
+    :param {str} refresh_token: (Optional) The OAuth refresh token.
+    :param expiry: (Optional) The aware datetime at which the access token expires.
+
+    :return: The Credentials instance.
+    """
+    config = get_credentials_config_json()
+
+    credentials = Credentials(token,
+                              refresh_token=refresh_token,
+                              token_uri=settings.GOOGLE_AUTH_SETTINGS['OAUTH2_TOKEN_ENDPOINT'],
+                              client_id=config.get('client_id'),
+                              client_secret=config.get('client_secret'),
+                              scopes=settings.GOOGLE_AUTH_SETTINGS['SCOPES'])
+    # google-auth compares expiry with naive UTC datetimes.
+    credentials.expiry = timezone.make_naive(expiry, timezone.utc) if expiry else None
+
+    return credentials
+
+
+def store_credentials(user, credentials, using=None):
+    """
+    Save the tokens of the user credentials, encrypted.
+
+    Google only issues a refresh token when the user consents, so the stored
+    refresh token is kept in case the credentials do not have one.
+
+    :param user: The `User` instance.
+    :param credentials: The `google.oauth2.credentials.Credentials` of the user.
+    :param {str} using: (Optional) The alias of the database to save the tokens in.
+    """
+    expiry = timezone.make_aware(credentials.expiry, timezone.utc) if credentials.expiry else None
+
+    defaults = {
+        'access_token': encrypt_token(credentials.token),
+        'expiry': expiry
+    }
+    if credentials.refresh_token:
+        defaults['refresh_token'] = encrypt_token(credentials.refresh_token)
+
+    GoogleToken.objects.db_manager(using).update_or_create(user_id=user.pk, defaults=defaults)
+
+
+def load_credentials(user):
+    """
+    :param user: The `User` instance.
+
+    :return: The stored `google.oauth2.credentials.Credentials` of the user or
+             None if no tokens are stored for the user.
+    """
+    google_token = GoogleToken.objects.filter(user=user).first()
+
+    if google_token is None:
+        return None
+
+    return build_credentials(decrypt_token(google_token.access_token),
+                             refresh_token=decrypt_token(google_token.refresh_token),
+                             expiry=google_token.expiry)
+
+
+def get_refresh_lock_key(user):
+    return 'auth:refresh:{}'.format(user.pk)
+
+
+def refresh_credentials(user, credentials):
+    """
+    Refresh the access token of the user and store it.
+
+    Only one request refreshes the token of a user at a time, concurrent
+    requests of the same user wait for the stored token to be refreshed
+    instead of refreshing it again.
+
+    The refreshed token is committed right away on the `TOKEN_DATABASE`
+    connection, independently of the request transaction, so that it is
+    visible to the waiting requests and is kept even if the request fails.
+
+    :param user: The `User` instance.
+    :param credentials: The expired `google.oauth2.credentials.Credentials` of the user.
+
+    :return: The refreshed `google.oauth2.credentials.Credentials` instance.
+    """
+    lock_key = get_refresh_lock_key(user)
+    locked = cache.add(lock_key, 1, settings.GOOGLE_AUTH_SETTINGS['TOKEN_REFRESH_LOCK_TIMEOUT'])
+
+    if not locked:
+        deadline = time.monotonic() + settings.GOOGLE_AUTH_SETTINGS['TOKEN_REFRESH_WAIT']
+
+        while time.monotonic() < deadline and cache.get(lock_key) is not None:
+            time.sleep(0.1)
+
+        stored_credentials = load_credentials(user)
+        if stored_credentials is not None and stored_credentials.valid:
+            return stored_credentials
+
+    using = settings.GOOGLE_AUTH_SETTINGS['TOKEN_DATABASE']
+
+    try:
+        credentials.refresh(google_auth_httplib2.Request(PooledHttp(get_http_pool())))
+
+        with transaction.atomic(using=using):
+            store_credentials(user, credentials, using=using)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+
+    return credentials
+
+
+def get_user_credentials(user, payload=None):
+    """
+    Retrieve valid credentials of the user, refreshing the access token once it expired.
+
+    JWTs issued before tokens were stored server-side carry the tokens in their
+    payload, these tokens are stored on first use.
+
+    :param user: The `User` instance.
+    :param {dict} payload: (Optional) The decoded JWT payload of the request.
+
+    :return: A `google.oauth2.credentials.Credentials` instance or None if no
+             tokens are known for the user.
+    """
+    credentials = load_credentials(user)
+
+    if credentials is None:
+        if not payload or not payload.get('access_token'):
+            return None
+
+        # The expiry of tokens carried by JWTs is unknown, hence they are refreshed right away.
+        credentials = build_credentials(payload['access_token'], refresh_token=payload.get('refresh_token'))
+
+    if credentials.expiry is None or credentials.expired:
+        credentials = refresh_credentials(user, credentials)
+
+    return credentials
@@ -2,12 +2,21 @@ import json
 import pytest
 from google.oauth2.credentials import Credentials
 
+from gcleaner.emails.breaker import gmail_circuit_breaker
 from gcleaner.emails.constants import LABEL_UNREAD, LABEL_INBOX, LABEL_TRASH
-from gcleaner.emails.models import Label, Email, LatestEmail, LockedEmail
+from gcleaner.emails.models import Label, Email, LatestEmail, LockedEmail, Sender
 from gcleaner.emails.services import EmailService
 from gcleaner.users.models import User
 
 
+@pytest.fixture(autouse=True)
+def circuit_breaker():
+    # The circuit breaker is shared by the whole process, every test starts with a closed circuit.
+    gmail_circuit_breaker.reset()
+    yield gmail_circuit_breaker
+    gmail_circuit_breaker.reset()
+
+
 @pytest.fixture
 def user(db):
     user = User.objects.create(username='me@email.com', email='me@email.com')
@@ -56,13 +65,19 @@ def all_labels(label_inbox, label_unread, label_category_personal, label_custom_
 
 
 @pytest.fixture
-def email(user, label_unread, label_inbox, db):
+def sender(user, db):
+    sender = Sender.objects.create(user=user, email='sender@email.com', name='Sender', domain='email.com')
+    return sender
+
+
+@pytest.fixture
+def email(user, sender, label_unread, label_inbox, db):
     email = Email.objects.create(user=user,
                                  google_id='a123',
                                  thread_id='t123',
                                  subject='Subject',
                                  snippet='Snippet',
-                                 sender='Sender',
+                                 sender=sender,
                                  receiver='Receiver',
                                  delivered_to='Delivered To',
                                  starred=False,
@@ -255,7 +270,7 @@ def locked_email(user, gmail_api_email_1):
 @pytest.fixture
 def gmail_batch_response(gmail_api_get_1_response, gmail_api_get_2_response, gmail_api_get_3_response):
     response = """
---batch_ygSpAcfQXdA_AAfKEo9rkX4\r\nContent-Type: application/http\r\nContent-ID: <response-eb0275a7-6c83-4b6c-9b9e-10c525f64f19 + 1>\r\n\r\nHTTP/1.1 200 OK\r\nETag: "LZWdHVzsAG0UZhwmZBdpM9j7eJQ/_VWh__H0wb3woEXGUB0Gw6gbJEM"\r\nContent-Type: application/json; charset=UTF-8\r\nDate: Fri, 05 Apr 2019 13:27:19 GMT\r\nExpires: Fri, 05 Apr 2019 13:27:19 GMT\r\nCache-Control: private, max-age=0\r\nContent-Length: 1000\r\n\r\n{email1}\r\n\r\n--batch_ygSpAcfQXdA_AAfKEo9rkX4\r\nContent-Type: application/http\r\nContent-ID: <response-eb0275a7-6c83-4b6c-9b9e-10c525f64f19 + 2>\r\n\r\nHTTP/1.1 200 OK\r\nETag: "LZWdHVzsAG0UZhwmZBdpM9j7eJQ/RmebJ7MNtiqLslsyXDqenB6Jbqo"\r\nContent-Type: application/json; charset=UTF-8\r\nDate: Fri, 05 Apr 2019 13:27:19 GMT\r\nExpires: Fri, 05 Apr 2019 13:27:19 GMT\r\nCache-Control: private, max-age=0\r\nContent-Length: 1000\r\n\r\n{email2}\r\n\r\n--batch_ygSpAcfQXdA_AAfKEo9rkX4\r\nContent-Type: application/http\r\nContent-ID: <response-eb0275a7-6c83-4b6c-9b9e-10c525f64f19 + 3>\r\n\r\nHTTP/1.1 200 OK\r\nETag: "LZWdHVzsAG0UZhwmZBdpM9j7eJQ/HF6WWUaqat1LByM3pYk8sNDqRh8"\r\nContent-Type: application/json; charset=UTF-8\r\nDate: Fri, 05 Apr 2019 13:27:19 GMT\r\nExpires: Fri, 05 Apr 2019 13:27:19 GMT\r\nCache-Control: private, max-age=0\r\nContent-Length: 1000\r\n\r\n{email3}
+--batch_ygSpAcfQXdA_AAfKEo9rkX4\r\nContent-Type: application/http\r\nContent-ID: <response-eb0275a7-6c83-4b6c-9b9e-10c525f64f19 + 1599581458cf8986>\r\n\r\nHTTP/1.1 200 OK\r\nETag: "LZWdHVzsAG0UZhwmZBdpM9j7eJQ/_VWh__H0wb3woEXGUB0Gw6gbJEM"\r\nContent-Type: application/json; charset=UTF-8\r\nDate: Fri, 05 Apr 2019 13:27:19 GMT\r\nExpires: Fri, 05 Apr 2019 13:27:19 GMT\r\nCache-Control: private, max-age=0\r\nContent-Length: 1000\r\n\r\n{email1}\r\n\r\n--batch_ygSpAcfQXdA_AAfKEo9rkX4\r\nContent-Type: application/http\r\nContent-ID: <response-eb0275a7-6c83-4b6c-9b9e-10c525f64f19 + 159951b16a5c5591>\r\n\r\nHTTP/1.1 200 OK\r\nETag: "LZWdHVzsAG0UZhwmZBdpM9j7eJQ/RmebJ7MNtiqLslsyXDqenB6Jbqo"\r\nContent-Type: application/json; charset=UTF-8\r\nDate: Fri, 05 Apr 2019 13:27:19 GMT\r\nExpires: Fri, 05 Apr 2019 13:27:19 GMT\r\nCache-Control: private, max-age=0\r\nContent-Length: 1000\r\n\r\n{email2}\r\n\r\n--batch_ygSpAcfQXdA_AAfKEo9rkX4\r\nContent-Type: application/http\r\nContent-ID: <response-eb0275a7-6c83-4b6c-9b9e-10c525f64f19 + 1599518a6f32a3b1>\r\n\r\nHTTP/1.1 200 OK\r\nETag: "LZWdHVzsAG0UZhwmZBdpM9j7eJQ/HF6WWUaqat1LByM3pYk8sNDqRh8"\r\nContent-Type: application/json; charset=UTF-8\r\nDate: Fri, 05 Apr 2019 13:27:19 GMT\r\nExpires: Fri, 05 Apr 2019 13:27:19 GMT\r\nCache-Control: private, max-age=0\r\nContent-Length: 1000\r\n\r\n{email3}
 """.format(email1=json.dumps(gmail_api_get_1_response),
            email2=json.dumps(gmail_api_get_2_response),
            email3=json.dumps(gmail_api_get_3_response))
@@ -266,7 +281,7 @@ def gmail_batch_response(gmail_api_get_1_response, gmail_api_get_2_response, gma
 @pytest.fixture
 def gmail_batch_small_response(gmail_api_get_1_response, gmail_api_get_2_response):
     response = """
---batch_ygSpAcfQXdA_AAfKEo9rkX4\r\nContent-Type: application/http\r\nContent-ID: <response-eb0275a7-6c83-4b6c-9b9e-10c525f64f19 + 1>\r\n\r\nHTTP/1.1 200 OK\r\nETag: "LZWdHVzsAG0UZhwmZBdpM9j7eJQ/_VWh__H0wb3woEXGUB0Gw6gbJEM"\r\nContent-Type: application/json; charset=UTF-8\r\nDate: Fri, 05 Apr 2019 13:27:19 GMT\r\nExpires: Fri, 05 Apr 2019 13:27:19 GMT\r\nCache-Control: private, max-age=0\r\nContent-Length: 1000\r\n\r\n{email1}\r\n\r\n--batch_ygSpAcfQXdA_AAfKEo9rkX4\r\nContent-Type: application/http\r\nContent-ID: <response-eb0275a7-6c83-4b6c-9b9e-10c525f64f19 + 2>\r\n\r\nHTTP/1.1 200 OK\r\nETag: "LZWdHVzsAG0UZhwmZBdpM9j7eJQ/RmebJ7MNtiqLslsyXDqenB6Jbqo"\r\nContent-Type: application/json; charset=UTF-8\r\nDate: Fri, 05 Apr 2019 13:27:19 GMT\r\nExpires: Fri, 05 Apr 2019 13:27:19 GMT\r\nCache-Control: private, max-age=0\r\nContent-Length: 1000\r\n\r\n{email2}
+--batch_ygSpAcfQXdA_AAfKEo9rkX4\r\nContent-Type: application/http\r\nContent-ID: <response-eb0275a7-6c83-4b6c-9b9e-10c525f64f19 + 1599581458cf8986>\r\n\r\nHTTP/1.1 200 OK\r\nETag: "LZWdHVzsAG0UZhwmZBdpM9j7eJQ/_VWh__H0wb3woEXGUB0Gw6gbJEM"\r\nContent-Type: application/json; charset=UTF-8\r\nDate: Fri, 05 Apr 2019 13:27:19 GMT\r\nExpires: Fri, 05 Apr 2019 13:27:19 GMT\r\nCache-Control: private, max-age=0\r\nContent-Length: 1000\r\n\r\n{email1}\r\n\r\n--batch_ygSpAcfQXdA_AAfKEo9rkX4\r\nContent-Type: application/http\r\nContent-ID: <response-eb0275a7-6c83-4b6c-9b9e-10c525f64f19 + 159951b16a5c5591>\r\n\r\nHTTP/1.1 200 OK\r\nETag: "LZWdHVzsAG0UZhwmZBdpM9j7eJQ/RmebJ7MNtiqLslsyXDqenB6Jbqo"\r\nContent-Type: application/json; charset=UTF-8\r\nDate: Fri, 05 Apr 2019 13:27:19 GMT\r\nExpires: Fri, 05 Apr 2019 13:27:19 GMT\r\nCache-Control: private, max-age=0\r\nContent-Length: 1000\r\n\r\n{email2}
 """.format(email1=json.dumps(gmail_api_get_1_response),
            email2=json.dumps(gmail_api_get_2_response))
 
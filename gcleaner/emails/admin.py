@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from gcleaner.emails.models import Email, Label, LockedEmail, ModifiedEmailBatch
+from gcleaner.emails.models import Email, Label, LockedEmail, ModifiedEmailBatch, SyncState, \
+    ModifyEmailsJob, Sender, SenderRollup
 
 
 @admin.register(Email)
@@ -18,6 +19,17 @@ class EmailAdmin(admin.ModelAdmin):
         'list_unsubscribe'
     ]
     filter_horizontal = ['labels']
+    raw_id_fields = ['sender']
+
+
+@admin.register(Sender)
+class SenderAdmin(admin.ModelAdmin):
+    list_display = [
+        'user',
+        'name',
+        'email',
+        'domain'
+    ]
 
 
 @admin.register(Label)
@@ -50,3 +62,38 @@ class ModifiedEmailBatchAdmin(admin.ModelAdmin):
         'action',
         'date'
     ]
+
+
+@admin.register(SyncState)
+class SyncStateAdmin(admin.ModelAdmin):
+    list_display = [
+        'user',
+        'history_id',
+        'synced_at'
+    ]
+
+
+@admin.register(ModifyEmailsJob)
+class ModifyEmailsJobAdmin(admin.ModelAdmin):
+    list_display = [
+        'user',
+        'status',
+        'nr_of_emails',
+        'nr_of_modified_emails',
+        'nr_of_retries',
+        'created_at',
+        'finished_at'
+    ]
+
+
+@admin.register(SenderRollup)
+class SenderRollupAdmin(admin.ModelAdmin):
+    list_display = [
+        'user',
+        'kind',
+        'key',
+        'name',
+        'nr_of_unread_emails',
+        'latest_date',
+        'has_unsubscribe'
+    ]
@@ -0,0 +1,188 @@
+import collections
+import logging
+import socket
+import threading
+import time
+
+import httplib2
+from django.conf import settings
+from googleapiclient import errors
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+CIRCUIT_HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling GMail API while it is considered unavailable.
+    """
+
+    def __init__(self, retry_after):
+        super().__init__('GMail API is unavailable, retry in {:.0f} seconds.'.format(retry_after))
+        self.retry_after = retry_after
+
+
+def is_unavailable_error(exception):
+    """
+    Tell whether an error means that GMail API is unavailable, rather than that the request was invalid.
+
+    :param exception: The exception raised by a GMail API call.
+
+    :return: True for server errors, timeouts and connection errors.
+    """
+    if isinstance(exception, CircuitOpenError):
+        return True
+
+    if isinstance(exception, errors.HttpError):
+        status = getattr(exception.resp, 'status', None)
+        return isinstance(status, int) and status >= 500
+
+    return isinstance(exception, (socket.timeout, ConnectionError, httplib2.ServerNotFoundError))
+
+
+class CircuitBreaker(object):
+    """
+    Fail fast instead of calling GMail API while most of the recent calls failed or were slow.
+
+    The circuit opens once at least `CIRCUIT_BREAKER_MIN_CALLS` calls completed
+    within the last `CIRCUIT_BREAKER_WINDOW` seconds and at least
+    `CIRCUIT_BREAKER_ERROR_RATE` of them failed because GMail was unavailable or
+    took longer than `CIRCUIT_BREAKER_SLOW_CALL_DURATION` seconds. Calls are
+    then refused for `CIRCUIT_BREAKER_OPEN_DURATION` seconds, after which the
+    circuit is half-open: `CIRCUIT_BREAKER_HALF_OPEN_CALLS` probe calls are let
+    through, and close the circuit if they all succeed or open it again
+    otherwise.
+
+    The state is kept by each process, so a worker stops waiting on GMail
+    as soon as it noticed the outage itself.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.reset()
+
+    def reset(self):
+        """
+        Close the circuit and forget the recent calls.
+        """
+        with self._lock:
+            self._close()
+
+    @property
+    def state(self):
+        return self._state
+
+    def available(self):
+        """
+        :return: Whether a call would be let through right now.
+        """
+        config = settings.GOOGLE_AUTH_SETTINGS
+
+        with self._lock:
+            if self._state == CIRCUIT_OPEN:
+                return self.clock() >= self._opened_at + config['CIRCUIT_BREAKER_OPEN_DURATION']
+
+            if self._state == CIRCUIT_HALF_OPEN:
+                return self._probes < config['CIRCUIT_BREAKER_HALF_OPEN_CALLS']
+
+            return True
+
+    def call(self, func, prepare=None):
+        """
+        Call GMail API unless the circuit is open, and record the outcome of the call.
+
+        :param {function} func: The GMail API call, called without arguments.
+        :param {function} prepare: (Optional) Called without arguments once the call is let through,
+                                   before it is timed, e.g. to wait for quota.
+
+        :return: The result of the call.
+        :raises: `CircuitOpenError` in case the circuit is open.
+        """
+        generation = self._before_call()
+        started_at = self.clock()
+
+        try:
+            if prepare is not None:
+                prepare()
+                started_at = self.clock()
+
+            result = func()
+        except Exception as e:
+            self._after_call(generation, started_at, is_unavailable_error(e))
+            raise
+
+        self._after_call(generation, started_at, False)
+
+        return result
+
+    def _before_call(self):
+        config = settings.GOOGLE_AUTH_SETTINGS
+
+        with self._lock:
+            if self._state == CIRCUIT_OPEN:
+                retry_after = self._opened_at + config['CIRCUIT_BREAKER_OPEN_DURATION'] - self.clock()
+                if retry_after > 0:
+                    raise CircuitOpenError(retry_after)
+
+                self._transition(CIRCUIT_HALF_OPEN)
+
+            if self._state == CIRCUIT_HALF_OPEN:
+                if self._probes >= config['CIRCUIT_BREAKER_HALF_OPEN_CALLS']:
+                    raise CircuitOpenError(config['CIRCUIT_BREAKER_OPEN_DURATION'])
+                self._probes += 1
+
+            return self._generation
+
+    def _after_call(self, generation, started_at, failed):
+        config = settings.GOOGLE_AUTH_SETTINGS
+        now = self.clock()
+        failed = failed or now - started_at >= config['CIRCUIT_BREAKER_SLOW_CALL_DURATION']
+
+        with self._lock:
+            # Calls that started before the last transition tell nothing about the current state.
+            if generation != self._generation:
+                return
+
+            if self._state == CIRCUIT_HALF_OPEN:
+                if failed:
+                    self._open(now)
+                else:
+                    self._successful_probes += 1
+                    if self._successful_probes >= config['CIRCUIT_BREAKER_HALF_OPEN_CALLS']:
+                        logger.info('GMail API is available again, closing the circuit')
+                        self._close()
+                return
+
+            self._calls.append((now, failed))
+            while self._calls[0][0] < now - config['CIRCUIT_BREAKER_WINDOW']:
+                self._calls.popleft()
+
+            nr_of_failed_calls = sum(1 for _, call_failed in self._calls if call_failed)
+            if len(self._calls) >= config['CIRCUIT_BREAKER_MIN_CALLS'] and \
+                    nr_of_failed_calls >= len(self._calls) * config['CIRCUIT_BREAKER_ERROR_RATE']:
+                self._open(now)
+
+    def _open(self, now):
+        logger.warning('GMail API is unavailable, opening the circuit')
+        self._transition(CIRCUIT_OPEN)
+        self._opened_at = now
+
+    def _close(self):
+        self._transition(CIRCUIT_CLOSED)
+        self._opened_at = None
+
+    def _transition(self, state):
+        self._state = state
+        self._generation = self._generation + 1
+        self._calls = collections.deque()
+        self._probes = 0
+        self._successful_probes = 0
+
+
+gmail_circuit_breaker = CircuitBreaker()
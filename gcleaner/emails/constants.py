@@ -1,6 +1,23 @@
 LABEL_UNREAD = 'UNREAD'
 LABEL_INBOX = 'INBOX'
 LABEL_TRASH = 'TRASH'
+LABEL_STARRED = 'STARRED'
+LABEL_IMPORTANT = 'IMPORTANT'
+
+# GMail API response statuses worth retrying: rate limits and transient server errors.
+RETRYABLE_STATUSES = [403, 429, 500, 503]
+
+# Mailbox changes applied by incremental synchronization.
+HISTORY_TYPES = ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+
+# Sender rollups
+ROLLUP_SENDER = 'sender'
+ROLLUP_DOMAIN = 'domain'
+
+SENDER_ROLLUP_KINDS = [
+    (ROLLUP_SENDER, 'Sender'),
+    (ROLLUP_DOMAIN, 'Domain')
+]
 
 # Actions
 ACTION_TRASH = 'TRASH'
@@ -15,3 +32,28 @@ MODIFY_EMAIL_ACTIONS = [
     (ACTION_READ, 'Read'),
     (ACTION_TRASH, 'Trash')
 ]
+
+# Modify jobs
+JOB_PENDING = 'PENDING'
+JOB_RUNNING = 'RUNNING'
+JOB_DONE = 'DONE'
+JOB_FAILED = 'FAILED'
+
+MODIFY_JOB_STATUSES = [
+    (JOB_PENDING, 'Pending'),
+    (JOB_RUNNING, 'Running'),
+    (JOB_DONE, 'Done'),
+    (JOB_FAILED, 'Failed')
+]
+
+# GMail API quota units charged per method call.
+# https://developers.google.com/gmail/api/reference/quota
+QUOTA_UNITS = {
+    'messages.get': 5,
+    'messages.list': 5,
+    'messages.batchModify': 50,
+    'users.getProfile': 1,
+    'history.list': 2,
+    'labels.get': 1,
+    'labels.list': 1
+}
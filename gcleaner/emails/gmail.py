@@ -0,0 +1,112 @@
+import json
+import threading
+from urllib.parse import urljoin
+
+from django.conf import settings
+
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import Resource
+from googleapiclient.http import HttpRequest
+from googleapiclient.model import JsonModel
+from googleapiclient.schema import Schemas
+
+from gcleaner.emails.transport import PooledHttp, get_http_pool
+
+
+class GmailClientFactory(object):
+    """
+    Process-wide factory of GMail API v1 service objects.
+
+    `googleapiclient.discovery.build` downloads (or reads from cache) and
+    parses the discovery document every time it is called. As the GMail
+    API description does not change between requests, the factory loads
+    the bundled copy of the discovery document once per process and keeps
+    the parsed document, its schemas and the request model around, so that
+    creating a service for a user only means binding the user credentials
+    to a new `Resource` instance.
+    """
+
+    def __init__(self, discovery_document=None):
+        self.discovery_document = discovery_document
+        self._lock = threading.Lock()
+        self._service_desc = None
+        self._schema = None
+        self._model = None
+        self._base_url = None
+
+    def load(self):
+        """
+        Load and parse the discovery document in case it was not loaded yet.
+
+        :return: The deserialized discovery document.
+        """
+        if self._service_desc is None:
+            with self._lock:
+                if self._service_desc is None:
+                    path = self.discovery_document or settings.GOOGLE_AUTH_SETTINGS['DISCOVERY_DOCUMENT']
+                    with open(path, 'r') as d:
+                        service_desc = json.load(d)
+
+                    self._schema = Schemas(service_desc)
+                    self._model = JsonModel('dataWrapper' in service_desc.get('features', []))
+                    self._base_url = urljoin(service_desc['rootUrl'], service_desc['servicePath'])
+                    self._service_desc = service_desc
+
+        return self._service_desc
+
+    def build(self, credentials=None, http=None, request_builder=HttpRequest):
+        """
+        Create a GMail API service object.
+
+        Either the user credentials or an already authorized http object
+        have to be specified, the same way as for `build()`.
+
+        :param credentials: User credentials to use with GMail API.
+        :param http: (Optional) An `httplib2.Http` like object to make requests with.
+        :param request_builder: (Optional) The class used to build API requests.
+
+        :return: A `googleapiclient.discovery.Resource` instance.
+        """
+        if http is not None and credentials is not None:
+            raise ValueError('Arguments http and credentials are mutually exclusive.')
+
+        service_desc = self.load()
+
+        if http is None:
+            http = self.authorize(credentials)
+
+        return Resource(http=http,
+                        baseUrl=self._base_url,
+                        model=self._model,
+                        requestBuilder=request_builder,
+                        developerKey=None,
+                        resourceDesc=service_desc,
+                        rootDesc=service_desc,
+                        schema=self._schema)
+
+    def authorize(self, credentials):
+        """
+        Build an http object that signs every request with the given credentials.
+
+        The requests themselves go through the process-wide pool of
+        keep-alive connections.
+
+        :param credentials: User credentials to use with GMail API.
+
+        :return: A `google_auth_httplib2.AuthorizedHttp` instance.
+        """
+        return AuthorizedHttp(credentials, http=PooledHttp(get_http_pool()))
+
+
+gmail_client_factory = GmailClientFactory()
+
+
+def build_gmail_service(credentials):
+    """
+    Shortcut to create a GMail API service object using the process-wide factory.
+
+    :param credentials: User credentials to use with GMail API.
+
+    :return: A `googleapiclient.discovery.Resource` instance.
+    """
+    return gmail_client_factory.build(credentials=credentials)
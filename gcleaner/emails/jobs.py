@@ -0,0 +1,108 @@
+import datetime
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from gcleaner.emails.constants import JOB_PENDING, JOB_RUNNING, JOB_FAILED
+from gcleaner.emails.models import ModifyEmailsJob
+from gcleaner.emails.services import EmailService
+
+logger = logging.getLogger(__name__)
+
+_jobs_executor = None
+_jobs_executor_lock = threading.Lock()
+
+
+def get_jobs_executor():
+    """
+    Return the process-wide executor that processes modify jobs, creating it on first use.
+
+    :return: A `ThreadPoolExecutor` instance sized by `GOOGLE_AUTH_SETTINGS['MODIFY_JOB_WORKERS']`.
+    """
+    global _jobs_executor
+
+    if _jobs_executor is None:
+        with _jobs_executor_lock:
+            if _jobs_executor is None:
+                _jobs_executor = ThreadPoolExecutor(
+                    max_workers=settings.GOOGLE_AUTH_SETTINGS['MODIFY_JOB_WORKERS'],
+                    thread_name_prefix='emails-modify-jobs')
+
+    return _jobs_executor
+
+
+def enqueue_modify_job(service, payload):
+    """
+    Persist a modify job and process it in the background.
+
+    The job is submitted once the current transaction is committed, so the
+    worker thread can see it. The credentials of the user only live as long
+    as the request, hence jobs are processed by the workers of the process
+    that received them.
+
+    :param service: The EmailService instance of the user.
+    :param payload: A dict that has the "ids" (or "q"), "addLabelIds" and
+                    "removeLabelIds" props.
+
+    :return: The created `ModifyEmailsJob` instance.
+    """
+    job = ModifyEmailsJob.objects.create(user=service.user,
+                                         payload=json.dumps(payload),
+                                         nr_of_emails=len(payload.get('ids', [])))
+    credentials = service.gmail_service.credentials
+
+    transaction.on_commit(lambda: get_jobs_executor().submit(run_modify_job, job.pk, credentials))
+
+    return job
+
+
+def run_modify_job(job_pk, credentials):
+    """
+    Process a pending modify job, meant to run in a worker thread.
+
+    The job is claimed with a conditional update, so it is processed only
+    once even if it was submitted several times, and its progress is only
+    saved while it is running.
+
+    :param job_pk: The primary key of the `ModifyEmailsJob` instance.
+    :param credentials: The `google.oauth2.credentials.Credentials` of the user.
+    """
+    try:
+        # Jobs may wait in the queue for a while, their heartbeat starts once they run.
+        if not ModifyEmailsJob.objects.filter(pk=job_pk, status=JOB_PENDING)\
+                .update(status=JOB_RUNNING, updated_at=timezone.now()):
+            return
+
+        job = ModifyEmailsJob.objects.select_related('user').get(pk=job_pk)
+
+        EmailService(credentials, job.user).run_modify_job(job)
+    except Exception:
+        logger.exception('Modify job %s failed', job_pk)
+        ModifyEmailsJob.objects.filter(pk=job_pk, status=JOB_RUNNING)\
+            .update(status=JOB_FAILED, finished_at=timezone.now(), updated_at=timezone.now())
+    finally:
+        connections.close_all()
+
+
+def fail_interrupted_jobs(user):
+    """
+    Mark the running jobs of the user that did not progress for a while as failed.
+
+    Jobs are interrupted when the process that was running them stops, in
+    which case nothing else would ever finish them. Running jobs save their
+    progress after every chunk, while pending ones may just be queued behind
+    other jobs.
+
+    :param user: The `User` instance.
+    """
+    now = timezone.now()
+    timeout = datetime.timedelta(seconds=settings.GOOGLE_AUTH_SETTINGS['MODIFY_JOB_TIMEOUT'])
+
+    ModifyEmailsJob.objects\
+        .filter(user=user, status=JOB_RUNNING, updated_at__lt=now - timeout)\
+        .update(status=JOB_FAILED, finished_at=now, updated_at=now)
@@ -0,0 +1,149 @@
+import random
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from gcleaner.emails.constants import LABEL_UNREAD, LABEL_INBOX, LABEL_TRASH, ROLLUP_SENDER
+from gcleaner.emails.models import Email, Label, LockedEmail, Sender, SenderRollup
+from gcleaner.users.models import User
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Seed a large mailbox and print the plans of the queries `EmailService` runs on every request.
+
+    Run it before and after applying the `emails.0015_indexes` migration to
+    compare the plans. The seeded rows are rolled back unless `--keep` is passed.
+    """
+    help = 'Seed a large amount of emails and print the query plans of the hot email queries.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help='Number of seeded users.')
+        parser.add_argument('--emails', type=int, default=2000000, help='Total number of seeded emails.')
+        parser.add_argument('--senders', type=int, default=50, help='Number of senders per user.')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--keep', action='store_true',
+                            help='Keep the seeded rows instead of rolling them back.')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                started_at = time.monotonic()
+                user, nr_of_emails = self.seed(nr_of_users=options['users'],
+                                               nr_of_emails=options['emails'],
+                                               nr_of_senders=options['senders'],
+                                               batch_size=options['batch_size'])
+                duration = time.monotonic() - started_at
+                self.stdout.write('Seeded %s emails in %.1fs' % (nr_of_emails, duration))
+
+                if connection.vendor == 'postgresql':
+                    with connection.cursor() as cursor:
+                        for model in [Email, Email.labels.through, Label, LockedEmail, Sender, SenderRollup]:
+                            cursor.execute('ANALYZE %s' % model._meta.db_table)
+
+                for name, queryset in self.get_queries(user):
+                    self.explain(name, queryset)
+
+                if not options['keep']:
+                    raise Rollback()
+        except Rollback:
+            self.stdout.write('Seeded rows were rolled back')
+
+    def seed(self, nr_of_users, nr_of_emails, nr_of_senders, batch_size):
+        """
+        Seed users with labels, senders, emails and locked emails.
+
+        :return: A tuple with the last seeded `User` instance, whose queries are
+                 explained, and the number of seeded emails.
+        """
+        prefix = uuid.uuid4().hex[:8]
+        emails_per_user = max(nr_of_emails // nr_of_users, 1)
+        now = timezone.now()
+        user = None
+        seeded_emails = 0
+
+        for i in range(nr_of_users):
+            user = User.objects.create(username='benchmark-%s-%s' % (prefix, i))
+            labels = {google_id: Label.objects.create(user=user, google_id=google_id, name=google_id)
+                      for google_id in [LABEL_UNREAD, LABEL_INBOX, LABEL_TRASH]}
+            Sender.objects.bulk_create([
+                Sender(user=user, email='news@sender%s.com' % j, name='Sender %s' % j,
+                       domain='sender%s.com' % j)
+                for j in range(nr_of_senders)
+            ])
+            sender_ids = list(user.senders.values_list('pk', flat=True))
+
+            for start in range(0, emails_per_user, batch_size):
+                seeded_emails += len(Email.objects.bulk_create([
+                    Email(user=user,
+                          sender_id=random.choice(sender_ids),
+                          google_id='%x' % j,
+                          thread_id='%x' % j,
+                          subject='Subject %s' % j,
+                          snippet='Snippet %s' % j,
+                          receiver=user.username,
+                          delivered_to=user.username,
+                          date=now - timedelta(minutes=j))
+                    for j in range(start, min(start + batch_size, emails_per_user))
+                ]))
+
+            # Most emails are in the inbox, a third of them are unread, some are locked.
+            EmailLabel = Email.labels.through
+            links = []
+            for j, email_id in enumerate(user.emails.values_list('pk', flat=True).iterator()):
+                label = labels[LABEL_INBOX if j % 5 else LABEL_TRASH]
+                links.append(EmailLabel(email_id=email_id, label_id=label.pk))
+                if j % 3 == 0:
+                    links.append(EmailLabel(email_id=email_id, label_id=labels[LABEL_UNREAD].pk))
+            EmailLabel.objects.bulk_create(links)
+
+            # Unlocking an email keeps its row, so only a tenth of the rows are locked.
+            LockedEmail.objects.bulk_create([
+                LockedEmail(user=user, google_id='%x' % j, thread_id='%x' % j, locked=j % 200 == 0)
+                for j in range(0, emails_per_user, 20)
+            ])
+
+        return user, seeded_emails
+
+    def get_queries(self, user):
+        """
+        :return: Tuples with a name and the queryset of the queries run by `EmailService`.
+        """
+        google_ids = ['%x' % j for j in range(0, 500, 5)]
+
+        return [
+            ('Known emails by GMail id', user.emails.filter(google_id__in=google_ids)),
+            ('Local unread emails', user.emails
+                .filter(labels__google_id=LABEL_UNREAD)
+                .filter(labels__google_id=LABEL_INBOX)
+                .order_by('-date')[:100]),
+            ('Latest email', user.emails.order_by('-date')[:1]),
+            ('Label by GMail id', Label.objects.filter(user=user, google_id=LABEL_INBOX)),
+            ('Locked email ids', LockedEmail.objects.filter(user=user, locked=True).values_list('google_id')),
+            ('Locked email by GMail id', LockedEmail.objects.filter(user=user, google_id=google_ids[1])),
+            ('Senders by address', user.senders.filter(email__in=['news@sender1.com', 'news@sender2.com'])),
+            ('Sender rollups', SenderRollup.objects
+                .filter(user=user, kind=ROLLUP_SENDER)
+                .order_by('-nr_of_unread_emails', '-latest_date')),
+        ]
+
+    def explain(self, name, queryset):
+        """
+        Print the plan and the duration of a query.
+        """
+        options = {'analyze': True} if connection.vendor == 'postgresql' else {}
+
+        started_at = time.monotonic()
+        list(queryset)
+        duration = time.monotonic() - started_at
+
+        self.stdout.write('\n%s (%.2fms)' % (name, duration * 1000))
+        self.stdout.write(queryset.explain(**options))
@@ -0,0 +1,19 @@
+# Generated by Django 2.2.28 on 2019-06-24 18:40
+
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('emails', '0010_syncstate'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='email',
+            unique_together={('user', 'google_id')},
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2019-06-28 09:14
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('emails', '0011_auto_20190624_1840'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ModifyEmailsJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('RUNNING', 'Running'), ('DONE', 'Done'), ('FAILED', 'Failed')], default='PENDING', max_length=10)),
+                ('payload', models.TextField(help_text='JSON encoded batchModify request body.')),
+                ('nr_of_emails', models.PositiveIntegerField()),
+                ('nr_of_modified_emails', models.PositiveIntegerField(default=0)),
+                ('failed_ids', models.TextField(blank=True, help_text='JSON encoded list of GMail ids.')),
+                ('nr_of_retries', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='modify_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
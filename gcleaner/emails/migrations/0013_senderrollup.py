@@ -0,0 +1,58 @@
+# Generated by Django 2.2.28 on 2019-07-03 16:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_sender_email_and_domain(apps, schema_editor):
+    from gcleaner.emails.parsers import GMailEmailParser
+
+    Email = apps.get_model('emails', 'Email')
+
+    for email in Email.objects.exclude(sender='').only('pk', 'sender').iterator():
+        try:
+            sender = GMailEmailParser.parse_actor(email.sender)
+        except IndexError:
+            continue
+
+        Email.objects.filter(pk=email.pk).update(sender_email=sender['email'], sender_domain=sender['domain'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('emails', '0012_modifyemailsjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='email',
+            name='sender_domain',
+            field=models.CharField(blank=True, max_length=254),
+        ),
+        migrations.AddField(
+            model_name='email',
+            name='sender_email',
+            field=models.CharField(blank=True, max_length=254),
+        ),
+        migrations.CreateModel(
+            name='SenderRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('sender', 'Sender'), ('domain', 'Domain')], max_length=6)),
+                ('key', models.CharField(help_text='The sender email address or domain.', max_length=254)),
+                ('name', models.CharField(blank=True, max_length=254)),
+                ('nr_of_unread_emails', models.PositiveIntegerField()),
+                ('latest_date', models.DateTimeField()),
+                ('has_unsubscribe', models.BooleanField(default=False)),
+                ('sample_subjects', models.TextField(blank=True, help_text='JSON encoded list of the latest subjects.')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sender_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'kind', 'key')},
+            },
+        ),
+        migrations.RunPython(populate_sender_email_and_domain, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 2.2.28 on 2019-07-08 10:14
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_senders(apps, schema_editor):
+    from gcleaner.emails.parsers import GMailEmailParser
+
+    Email = apps.get_model('emails', 'Email')
+    Sender = apps.get_model('emails', 'Sender')
+
+    for user_id, sender_str in Email.objects.values_list('user_id', 'sender').distinct().iterator():
+        try:
+            actor = GMailEmailParser.parse_actor(sender_str)
+        except IndexError:
+            actor = {'name': sender_str, 'email': sender_str, 'domain': ''}
+
+        sender, _ = Sender.objects.get_or_create(user_id=user_id,
+                                                 email=actor['email'][:254],
+                                                 name=actor['name'][:254],
+                                                 defaults={'domain': actor['domain'][:254]})
+        Email.objects.filter(user_id=user_id, sender=sender_str).update(sender_ref=sender)
+
+
+class Migration(migrations.Migration):
+    # Altering the email table in the transaction that updated its rows fails on PostgreSQL with
+    # pending trigger events, hence every operation runs in a transaction of its own.
+    atomic = False
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('emails', '0013_senderrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Sender',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.CharField(max_length=254)),
+                ('name', models.CharField(max_length=254)),
+                ('domain', models.CharField(max_length=254)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='senders', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'email', 'name')},
+            },
+        ),
+        migrations.AddField(
+            model_name='email',
+            name='sender_ref',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='emails.Sender'),
+        ),
+        migrations.RunPython(populate_senders, migrations.RunPython.noop, atomic=True),
+        migrations.RemoveField(
+            model_name='email',
+            name='sender',
+        ),
+        migrations.RemoveField(
+            model_name='email',
+            name='sender_domain',
+        ),
+        migrations.RemoveField(
+            model_name='email',
+            name='sender_email',
+        ),
+        migrations.RenameField(
+            model_name='email',
+            old_name='sender_ref',
+            new_name='sender',
+        ),
+        migrations.AlterField(
+            model_name='email',
+            name='sender',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='emails', to='emails.Sender'),
+        ),
+    ]
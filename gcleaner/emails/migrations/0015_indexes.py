@@ -0,0 +1,37 @@
+# Generated by Django 2.2.28 on 2019-07-10 09:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emails', '0014_sender'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='email',
+            index=models.Index(fields=['user', '-date'], name='emails_email_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='label',
+            index=models.Index(fields=['user', 'google_id'], name='emails_label_user_google_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lockedemail',
+            index=models.Index(fields=['user', 'google_id'], name='emails_locked_user_google_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lockedemail',
+            index=models.Index(condition=models.Q(locked=True), fields=['user', 'google_id'], name='emails_locked_only_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='modifyemailsjob',
+            index=models.Index(fields=['user', 'status'], name='emails_job_user_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='senderrollup',
+            index=models.Index(fields=['user', 'kind', '-nr_of_unread_emails', '-latest_date'], name='emails_rollup_user_count_idx'),
+        ),
+    ]
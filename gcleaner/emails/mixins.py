@@ -1,10 +1,14 @@
+import math
+
 from django.db import connection, transaction
+from django.utils.http import http_date
 
 from google.auth.exceptions import RefreshError
 from rest_framework import status
 from rest_framework.views import exception_handler
 from rest_framework.response import Response
 
+from gcleaner.emails.breaker import CircuitOpenError, is_unavailable_error
 from gcleaner.emails.services import EmailService
 from gcleaner.utils.mixins import APIJWTDecoderMixin
 
@@ -21,7 +25,7 @@ def emails_exception_handler(exc, context):
 
     Additionally to standard rest framework exception handling, it handles
     RefreshError from GMail API that indicates the access token needs to
-    be refreshed.
+    be refreshed, and errors that indicate GMail API is unavailable.
 
     Any unhandled exceptions may return `None`, which will cause a 500 error
     to be raised.
@@ -32,6 +36,17 @@ def emails_exception_handler(exc, context):
         set_rollback()
 
         return Response(data, status=status.HTTP_401_UNAUTHORIZED)
+    elif is_unavailable_error(exc):
+        data = {'detail': 'GMail is unavailable.'}
+        retry_after = exc.retry_after if isinstance(exc, CircuitOpenError) else None
+
+        set_rollback()
+
+        response = Response(data, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        if retry_after:
+            response['Retry-After'] = str(math.ceil(retry_after))
+
+        return response
     else:
         return exception_handler(exc, context)
 
@@ -50,6 +65,26 @@ class EmailMixin(APIJWTDecoderMixin):
 
         return service
 
+    @staticmethod
+    def add_freshness_headers(response, service):
+        """
+        Tell the client how fresh the served emails are.
+
+        `X-Stale` tells whether they were served from the database because
+        GMail API is unavailable.
+
+        :param response: The response serving the emails.
+        :param service: The EmailService instance that retrieved the emails.
+
+        :return: The response.
+        """
+        if service.synced_at:
+            response['Last-Modified'] = http_date(service.synced_at.timestamp())
+        response['X-Refreshing'] = 'true' if service.refreshing else 'false'
+        response['X-Stale'] = 'true' if service.stale else 'false'
+
+        return response
+
     def get_exception_handler(self):
         """
         Return the augmented standard exception handler with GMail API related
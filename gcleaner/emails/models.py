@@ -1,6 +1,7 @@
 from django.db import models
 
-from gcleaner.emails.constants import MODIFY_EMAIL_ACTIONS
+from gcleaner.emails.constants import MODIFY_EMAIL_ACTIONS, MODIFY_JOB_STATUSES, JOB_PENDING, \
+    SENDER_ROLLUP_KINDS
 from gcleaner.users.models import User
 
 
@@ -20,16 +21,55 @@ class Label(models.Model):
     text_color = models.CharField(max_length=10, blank=True)
     background_color = models.CharField(max_length=10, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'google_id'], name='emails_label_user_google_idx')
+        ]
+
     def __str__(self):
         return "<Label %s (%s)>" % (self.name, self.google_id)
 
 
+class Sender(models.Model):
+    """
+    An actor that sent emails to a User.
+
+    Senders are stored once per user and referenced by their emails, since
+    newsletters repeat the same sender on thousands of emails.
+    """
+    # Relations
+    user = models.ForeignKey(User, related_name='senders', on_delete=models.CASCADE)
+
+    # Attributes
+    email = models.CharField(max_length=254)
+    name = models.CharField(max_length=254)
+    domain = models.CharField(max_length=254)
+
+    class Meta:
+        unique_together = ['user', 'email', 'name']
+
+    def __str__(self):
+        return "<Sender %s (%s)>" % (self.name, self.email)
+
+    def to_actor(self):
+        """
+        :return: A dict with "name", "email" and "domain" keys, as returned by
+                 `gcleaner.emails.parsers.GMailEmailParser.parse_actor`.
+        """
+        return {
+            'name': self.name,
+            'email': self.email,
+            'domain': self.domain
+        }
+
+
 class Email(models.Model):
     """
     Basic Email model.
     """
     # Relations
     user = models.ForeignKey(User, related_name='emails', on_delete=models.CASCADE)
+    sender = models.ForeignKey(Sender, related_name='emails', on_delete=models.CASCADE)
 
     # Many to Many relations
     labels = models.ManyToManyField(Label, related_name='emails')
@@ -41,7 +81,6 @@ class Email(models.Model):
     # Attributes
     subject = models.TextField()
     snippet = models.TextField()
-    sender = models.CharField(max_length=254)
     receiver = models.CharField(max_length=254)
     delivered_to = models.CharField(max_length=254)
     starred = models.BooleanField(default=False)
@@ -50,7 +89,10 @@ class Email(models.Model):
     list_unsubscribe = models.TextField(blank=True)
 
     class Meta:
-        unique_together = ['google_id', 'thread_id']
+        unique_together = ['user', 'google_id']
+        indexes = [
+            models.Index(fields=['user', '-date'], name='emails_email_user_date_idx')
+        ]
 
     def __str__(self):
         return "<Email %s>" % self.google_id
@@ -62,12 +104,16 @@ class Email(models.Model):
         :param {dict} obj: The object based on which to create an Email instance.
         :return: The newly created `gcleaner.emails.Email` instance.
         """
+        sender, _ = Sender.objects.get_or_create(user_id=obj['user'],
+                                                 email=obj['sender']['email'],
+                                                 name=obj['sender']['name'],
+                                                 defaults={'domain': obj['sender']['domain']})
         email = cls.objects.create(user_id=obj['user'],
                                    google_id=obj['google_id'],
                                    thread_id=obj['thread_id'],
                                    subject=obj['subject'],
                                    snippet=obj['snippet'],
-                                   sender=obj['sender'],
+                                   sender=sender,
                                    receiver=obj['receiver'],
                                    delivered_to=obj['delivered_to'],
                                    starred=obj.get('starred', False),
@@ -107,6 +153,14 @@ class LockedEmail(models.Model):
     # Attributes
     locked = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'google_id'], name='emails_locked_user_google_idx'),
+            # Only locked emails are ever listed, which are a small part of the rows, by their GMail id alone.
+            models.Index(fields=['user', 'google_id'], condition=models.Q(locked=True),
+                         name='emails_locked_only_idx')
+        ]
+
     def __str__(self):
         return "<Locked Email %s: %s>" % (self.google_id, self.locked)
 
@@ -125,3 +179,82 @@ class ModifiedEmailBatch(models.Model):
 
     def __str__(self):
         return "<ModifiedEmailBatch %s emails %s on %s by %s>" % (self.nr_of_emails, self.action, self.date, self.user)
+
+
+class SyncState(models.Model):
+    """
+    Keeps track of the last synchronization of a User's emails with GMail.
+
+    The stored `history_id` is the GMail mailbox history record up to which
+    the local emails reflect the GMail state, so the next synchronization
+    only needs to apply the changes that happened after it.
+    """
+    # Relations
+    user = models.OneToOneField(User, related_name='sync_state', on_delete=models.CASCADE)
+
+    # Attributes
+    history_id = models.CharField(max_length=32, blank=True)
+    synced_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return "<SyncState %s at %s>" % (self.user, self.history_id)
+
+
+class ModifyEmailsJob(models.Model):
+    """
+    A request to modify labels on user emails, processed in the background.
+
+    The job keeps track of its progress, so the user can be informed about
+    the emails that were modified, the ones that failed and the retries.
+    """
+    # Relations
+    user = models.ForeignKey(User, related_name='modify_jobs', on_delete=models.CASCADE)
+
+    # Attributes
+    status = models.CharField(max_length=10, choices=MODIFY_JOB_STATUSES, default=JOB_PENDING)
+    payload = models.TextField(help_text='JSON encoded batchModify request body.')
+    nr_of_emails = models.PositiveIntegerField()
+    nr_of_modified_emails = models.PositiveIntegerField(default=0)
+    failed_ids = models.TextField(blank=True, help_text='JSON encoded list of GMail ids.')
+    nr_of_retries = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'status'], name='emails_job_user_status_idx')
+        ]
+
+    def __str__(self):
+        return "<ModifyEmailsJob %s of %s emails by %s>" % (self.status, self.nr_of_emails, self.user)
+
+
+class SenderRollup(models.Model):
+    """
+    Unread emails stats of a User, grouped by sender email address or by sender domain.
+
+    Rollups are maintained whenever local emails change, so stats do not
+    have to be computed out of all the emails of the user on every request.
+    """
+    # Relations
+    user = models.ForeignKey(User, related_name='sender_rollups', on_delete=models.CASCADE)
+
+    # Attributes
+    kind = models.CharField(max_length=6, choices=SENDER_ROLLUP_KINDS)
+    key = models.CharField(max_length=254, help_text='The sender email address or domain.')
+    name = models.CharField(max_length=254, blank=True)
+    nr_of_unread_emails = models.PositiveIntegerField()
+    latest_date = models.DateTimeField()
+    has_unsubscribe = models.BooleanField(default=False)
+    sample_subjects = models.TextField(blank=True, help_text='JSON encoded list of the latest subjects.')
+
+    class Meta:
+        unique_together = ['user', 'kind', 'key']
+        indexes = [
+            models.Index(fields=['user', 'kind', '-nr_of_unread_emails', '-latest_date'],
+                         name='emails_rollup_user_count_idx')
+        ]
+
+    def __str__(self):
+        return "<SenderRollup %s %s: %s unread>" % (self.kind, self.key, self.nr_of_unread_emails)
@@ -1,4 +1,5 @@
 import datetime
+from functools import lru_cache
 
 import pytz
 from django.conf import settings
@@ -59,7 +60,7 @@ class GMailEmailParser(object):
                         local_header_name = cls._google_to_local_metadata_props[header['name']]
 
                         if local_header_name in cls._actor_props:
-                            result[local_header_name] = cls.parse_actor(header['value'])
+                            result[local_header_name] = cls.intern_actor(header['value'])
                         else:
                             result[local_header_name] = header['value']
 
@@ -111,3 +112,33 @@ class GMailEmailParser(object):
         result['domain'] = result['email'].split('@')[1]
 
         return result
+
+    @classmethod
+    @lru_cache(maxsize=settings.GOOGLE_AUTH_SETTINGS['SENDER_INTERN_CACHE_SIZE'])
+    def intern_actor(cls, actor_str: str):
+        """
+        Parse an actor string, sharing the parsed dict between all the emails of the same actor.
+
+        Newsletters send thousands of emails with the same "From" header, so
+        parsing them once keeps a single copy of the actor in memory. The
+        returned dict is shared, hence it must not be modified.
+
+        :param actor_str: The string to be parsed.
+
+        :return: A dict "name", "email" and "domain" keys.
+        """
+        return cls.parse_actor(actor_str)
+
+    @classmethod
+    def format_actor(cls, actor: dict):
+        """
+        Format an actor dict, as returned by `parse_actor`, back into an actor string.
+
+        :param actor: A dict with "name" and "email" keys.
+
+        :return: The actor string in one of the formats GMail sends it.
+        """
+        if actor['name'] == actor['email']:
+            return actor['email']
+
+        return '{} <{}>'.format(actor['name'], actor['email'])
@@ -0,0 +1,148 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+class LocalTokenBuckets(object):
+    """
+    Token buckets kept in the memory of the process, meant for development and tests.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, key, units, rate, capacity):
+        """
+        Take units out of a bucket, borrowing the ones it does not have yet.
+
+        :param {str} key: The key of the bucket.
+        :param {int} units: The number of units to take.
+        :param {float} rate: The number of units the bucket regains per second.
+        :param {float} capacity: The maximum number of units the bucket holds.
+
+        :return: The number of seconds until the borrowed units are regained, 0 if none were borrowed.
+        """
+        with self._lock:
+            now = self.clock()
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate) - units
+            self._buckets[key] = (tokens, now)
+
+        return -tokens / rate if tokens < 0 else 0
+
+
+class RedisTokenBuckets(object):
+    """
+    Token buckets shared by all the workers, kept in the Redis server of the default cache.
+
+    Buckets are updated by a Lua script, so that concurrent reservations are
+    atomic, using the clock of the Redis server.
+    """
+
+    SCRIPT = """
+        redis.replicate_commands()
+        local rate = tonumber(ARGV[1])
+        local capacity = tonumber(ARGV[2])
+        local units = tonumber(ARGV[3])
+        local time = redis.call('TIME')
+        local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+        local tokens = tonumber(bucket[1]) or capacity
+        local updated_at = tonumber(bucket[2]) or now
+        tokens = math.min(capacity, tokens + math.max(now - updated_at, 0) * rate) - units
+        redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+        redis.call('EXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate) + 1)
+        if tokens >= 0 then
+            return '0'
+        end
+        return tostring(-tokens / rate)
+    """
+
+    def __init__(self):
+        from django_redis import get_redis_connection
+
+        self.script = get_redis_connection('default').register_script(self.SCRIPT)
+
+    def reserve(self, key, units, rate, capacity):
+        """
+        Same as `LocalTokenBuckets.reserve`.
+        """
+        return float(self.script(keys=['ratelimit:{}'.format(key)], args=[rate, capacity, units]))
+
+
+class QuotaRateLimiter(object):
+    """
+    Smooth the GMail API calls so that they stay within the quota of the user and the project.
+
+    GMail API charges quota units per method call, and throttles the calls of
+    a user above `USER_QUOTA_RATE` units per second and the calls of the project
+    above `PROJECT_QUOTA_RATE` units per second. Every call reserves its units
+    in the token bucket of the user and the one of the project beforehand, and
+    waits until the borrowed units are regained, instead of being throttled
+    and retried.
+    """
+
+    def __init__(self, buckets, sleep=time.sleep):
+        self.buckets = buckets
+        self.sleep = sleep
+
+    def acquire(self, user_id, units):
+        """
+        Charge the quota units of a GMail API call, waiting for them if needed.
+
+        Failing to reach the shared buckets does not prevent the call.
+
+        :param {str} user_id: The id of the user the call is made for, None to only charge the project.
+        :param {int} units: The quota units of the call.
+
+        :return: The number of seconds waited.
+        """
+        config = settings.GOOGLE_AUTH_SETTINGS
+        reservations = [('project', config['PROJECT_QUOTA_RATE'], config['PROJECT_QUOTA_BURST'])]
+        if user_id is not None:
+            reservations.append(('user:{}'.format(user_id),
+                                 config['USER_QUOTA_RATE'],
+                                 config['USER_QUOTA_BURST']))
+
+        delay = 0
+        for key, rate, capacity in reservations:
+            try:
+                delay = max(delay, self.buckets.reserve('gmail:{}'.format(key), units, rate, capacity))
+            except Exception:
+                logger.warning('Could not charge %s GMail quota units to %s', units, key, exc_info=True)
+
+        # Bounded, so that a burst of calls does not stall a request. GMail throttles the excess, if any.
+        delay = min(delay, config['QUOTA_MAX_WAIT'])
+
+        if delay > 0:
+            self.sleep(delay)
+
+        return delay
+
+
+def get_rate_limiter():
+    """
+    Return the process-wide GMail quota rate limiter, creating it on first use.
+
+    :return: A `QuotaRateLimiter` instance using the buckets class of `GOOGLE_AUTH_SETTINGS['QUOTA_BUCKETS']`.
+    """
+    global _rate_limiter
+
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                buckets_class = import_string(settings.GOOGLE_AUTH_SETTINGS['QUOTA_BUCKETS'])
+                _rate_limiter = QuotaRateLimiter(buckets_class())
+
+    return _rate_limiter
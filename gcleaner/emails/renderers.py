@@ -0,0 +1,37 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Renderer for newline delimited JSON, where every line is a JSON document.
+
+    Lists are rendered one item per line, any other data as a single line.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        if not isinstance(data, list):
+            data = [data]
+
+        return b''.join(self.render_line(item) for item in data)
+
+    @staticmethod
+    def render_line(item):
+        """
+        Render a single item as a line of JSON.
+
+        :param item: The data to render.
+
+        :return: The encoded line, newline included.
+        """
+        line = json.dumps(item, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':'))
+
+        return line.encode('utf-8') + b'\n'
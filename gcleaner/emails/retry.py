@@ -0,0 +1,84 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+from django.utils import timezone
+
+
+def get_retry_after(exception):
+    """
+    Extract the delay requested by the `Retry-After` header of a failed response.
+
+    The header can hold either a number of seconds or an HTTP date.
+
+    :param exception: A `googleapiclient.errors.HttpError` instance.
+
+    :return: The number of seconds to wait or None if the header is missing or invalid.
+    """
+    resp = getattr(exception, 'resp', None)
+    value = resp.get('retry-after') if isinstance(resp, dict) else None
+
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+
+    try:
+        return max((parsedate_to_datetime(value) - timezone.now()).total_seconds(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryScheduler(object):
+    """
+    Compute delays between retries of failed GMail API requests.
+
+    Delays grow exponentially with "full jitter" (a random delay between 0
+    and the exponential cap), so that retries from concurrent requests do
+    not hit GMail servers at the same time. A `Retry-After` delay sent by
+    GMail takes precedence when it is longer than the computed one.
+
+    The scheduler enforces a total deadline: once the next retry could not
+    complete before it, no more retries are scheduled.
+    """
+
+    def __init__(self, base_delay, max_delay, deadline, clock=time.monotonic, rand=random.uniform):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.clock = clock
+        self.rand = rand
+
+        self.attempt = 0
+        self.started_at = clock()
+
+    def remaining(self):
+        """
+        :return: Seconds left until the deadline.
+        """
+        return self.deadline - (self.clock() - self.started_at)
+
+    def next_delay(self, retry_after=None):
+        """
+        Schedule the next retry.
+
+        :param retry_after: (Optional) The delay in seconds requested by GMail.
+
+        :return: The number of seconds to wait before retrying or None if the
+                 retry would not fit in the deadline.
+        """
+        cap = min(self.max_delay, self.base_delay * 2 ** self.attempt)
+        delay = self.rand(0, cap)
+
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+
+        if delay >= self.remaining():
+            return None
+
+        self.attempt += 1
+
+        return delay
@@ -1,6 +1,9 @@
+import json
+
 from rest_framework import serializers
 
-from gcleaner.emails.models import Email, Label
+from gcleaner.emails.models import Email, Label, ModifyEmailsJob, SenderRollup
+from gcleaner.emails.parsers import GMailEmailParser
 
 
 class LabelSerializer(serializers.ModelSerializer):
@@ -23,6 +26,7 @@ class EmailSerializer(serializers.ModelSerializer):
     Serialize `gcleaner.messages.models.Email` instances.
     """
     labels = LabelSerializer(many=True)
+    sender = serializers.SerializerMethodField()
 
     class Meta:
         model = Email
@@ -39,3 +43,51 @@ class EmailSerializer(serializers.ModelSerializer):
             'important',
             'date'
         ]
+
+    def get_sender(self, email):
+        return GMailEmailParser.format_actor(email.sender.to_actor())
+
+
+class ModifyEmailsJobSerializer(serializers.ModelSerializer):
+    """
+    Serialize `gcleaner.emails.models.ModifyEmailsJob` instances.
+    """
+    failed_ids = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ModifyEmailsJob
+        fields = [
+            'id',
+            'status',
+            'nr_of_emails',
+            'nr_of_modified_emails',
+            'failed_ids',
+            'nr_of_retries',
+            'created_at',
+            'updated_at',
+            'finished_at'
+        ]
+
+    def get_failed_ids(self, job):
+        return json.loads(job.failed_ids) if job.failed_ids else []
+
+
+class SenderRollupSerializer(serializers.ModelSerializer):
+    """
+    Serialize `gcleaner.emails.models.SenderRollup` instances.
+    """
+    sample_subjects = serializers.SerializerMethodField()
+
+    class Meta:
+        model = SenderRollup
+        fields = [
+            'key',
+            'name',
+            'nr_of_unread_emails',
+            'latest_date',
+            'has_unsubscribe',
+            'sample_subjects'
+        ]
+
+    def get_sample_subjects(self, rollup):
+        return json.loads(rollup.sample_subjects) if rollup.sample_subjects else []
@@ -1,15 +1,70 @@
+import datetime
+import hashlib
+import json
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from time import sleep
 
 from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import Min, Q
+from django.utils import timezone
 
 from googleapiclient import errors
-from googleapiclient.discovery import build
 
+from gcleaner.emails.breaker import CircuitOpenError, gmail_circuit_breaker, is_unavailable_error
 from gcleaner.emails.constants import LABEL_UNREAD, LABEL_INBOX, ACTION_TRASH, ACTION_READ, ACTION_ARCHIVE, \
-    ACTION_UNREAD_TRASHED, ACTION_UNREAD_READ, ACTION_UNREAD_ARCHIVED, LABEL_TRASH
-from gcleaner.emails.models import LatestEmail, Email, Label, LockedEmail, ModifiedEmailBatch
+    ACTION_UNREAD_TRASHED, ACTION_UNREAD_READ, ACTION_UNREAD_ARCHIVED, LABEL_TRASH, RETRYABLE_STATUSES, \
+    HISTORY_TYPES, LABEL_STARRED, LABEL_IMPORTANT, JOB_DONE, JOB_FAILED, JOB_RUNNING, ROLLUP_SENDER, \
+    ROLLUP_DOMAIN, QUOTA_UNITS
+from gcleaner.emails.gmail import build_gmail_service
+from gcleaner.emails.models import LatestEmail, Email, Label, LockedEmail, ModifiedEmailBatch, SyncState, \
+    Sender, SenderRollup, ModifyEmailsJob
 from gcleaner.emails.parsers import GMailEmailParser
+from gcleaner.emails.ratelimit import get_rate_limiter
+from gcleaner.emails.retry import RetryScheduler, get_retry_after
 from gcleaner.emails.serializers import LabelSerializer
+from gcleaner.emails.singleflight import single_flight
+from gcleaner.users.models import User
+
+logger = logging.getLogger(__name__)
+
+# Email fields that are overwritten with GMail data when an email is stored again.
+EMAIL_MIRRORED_FIELDS = ['thread_id', 'subject', 'snippet', 'sender', 'receiver', 'delivered_to', 'starred',
+                         'important', 'date', 'list_unsubscribe']
+
+# GMail does not allow batches with more than 1000 requests in them, hence listings are capped.
+MAX_LISTED_EMAILS = 1000
+
+
+_refresh_executor = None
+_refresh_executor_lock = threading.Lock()
+
+
+def get_refresh_executor():
+    """
+    Return the process-wide executor that refreshes emails in the background, creating it on first use.
+
+    :return: A `ThreadPoolExecutor` instance sized by `GOOGLE_AUTH_SETTINGS['REFRESH_WORKERS']`.
+    """
+    global _refresh_executor
+
+    if _refresh_executor is None:
+        with _refresh_executor_lock:
+            if _refresh_executor is None:
+                _refresh_executor = ThreadPoolExecutor(
+                    max_workers=settings.GOOGLE_AUTH_SETTINGS['REFRESH_WORKERS'],
+                    thread_name_prefix='emails-refresh')
+
+    return _refresh_executor
+
+
+class HistoryExpiredError(Exception):
+    """
+    Raised when GMail API no longer has the mailbox history since a given history id.
+    """
 
 
 class GoogleAPIService(object):
@@ -18,61 +73,156 @@ class GoogleAPIService(object):
 
     It serves as a gateway to do all the necessary operations in order to
     reflect changes done by the user on GMail servers.
+
+    When the service is bound to a user, concurrent identical listings and
+    detail fetches of the user share a single GMail API operation.
+
+    Every GMail API call is charged its quota units beforehand, to pace the
+    calls within the quota of the user and the project, and goes through the
+    circuit breaker, which fails fast while GMail API is unavailable.
     """
 
-    def __init__(self, credentials):
+    def __init__(self, credentials, user_id=None):
         self.credentials = credentials
-        self.service = build('gmail', 'v1', credentials=credentials)
+        self.user_id = user_id
+        self.service = build_gmail_service(credentials)
+
+    def coalesce(self, operation, params, func):
+        """
+        Run a GMail API operation, sharing it with the identical ones in flight for the same user.
+
+        :param {str} operation: The name of the operation.
+        :param params: JSON serializable parameters that identify the operation.
+        :param {function} func: The operation, called without arguments.
+
+        :return: The result of the operation.
+        """
+        if self.user_id is None:
+            return func()
+
+        digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+        return single_flight.do('emails:{}:{}:{}'.format(self.user_id, operation, digest), func)
+
+    def charge(self, method, nr_of_calls=1):
+        """
+        Charge the quota units of GMail API calls, waiting until the quota allows them.
+
+        :param {str} method: The GMail API method, a key of `QUOTA_UNITS`.
+        :param {int} nr_of_calls: (Optional) The number of calls of the method, in case of a batch.
+        """
+        get_rate_limiter().acquire(self.user_id, QUOTA_UNITS[method] * nr_of_calls)
+
+    def execute(self, method, request, nr_of_calls=1):
+        """
+        Execute a GMail API request once its quota units are charged.
+
+        The circuit breaker is checked first, so that calls fail fast without
+        spending quota while GMail API is unavailable.
+
+        :param {str} method: The GMail API method, a key of `QUOTA_UNITS`.
+        :param request: The `HttpRequest` or `BatchHttpRequest` instance to execute.
+        :param {int} nr_of_calls: (Optional) The number of calls of the method, in case of a batch.
+
+        :return: The deserialized response.
+        :raises: `CircuitOpenError` in case GMail API is considered unavailable.
+        """
+        return gmail_circuit_breaker.call(request.execute, prepare=lambda: self.charge(method, nr_of_calls))
 
     def get_labeled_emails(self, labels, d):
         """
         Retrieve a list of emails from GMail API.
 
+        Same as `list_emails`, except that API errors are swallowed and
+        result in an empty list, unless GMail API is unavailable.
+
+        :param {list} labels: A list of label ids that the emails have to have.
+        :param {str} d: (Optional) The earliest date to retrieve emails from.
+
+        :return: The list of emails from GMail API.
+        """
+        try:
+            return self.list_emails(labels, d)
+
+        except errors.HttpError as error:
+            # Outages are left to the callers, which may serve the local emails instead.
+            if is_unavailable_error(error):
+                raise
+
+            logger.warning('Could not list emails: %s', error)
+            return []
+
+    def list_emails(self, labels, d=None):
+        """
+        Retrieve a list of emails from GMail API.
+
         The list is retrieved for a given user and has to contain emails
         that have all the specified labels in `labelIds` keyword argument.
 
-        In order to reduce the load on the GMail API, a max of 1000 emails
-        are going to be retrieved, starting from the date indicated in the
+        In order to reduce the load on the GMail API, a max of `MAX_LISTED_EMAILS`
+        emails are going to be retrieved, starting from the date indicated in the
         query keyword argument `q`.
 
         :param {list} labels: A list of label ids that the emails have to have.
         :param {str} d: (Optional) The earliest date to retrieve emails from.
 
         :return: The list of emails from GMail API.
+        :raises: `googleapiclient.errors.HttpError` in case the API call failed.
         """
+        return self.coalesce('list', [labels, d], lambda: self._list_emails(labels, d))
+
+    def _list_emails(self, labels, d=None):
         list_filters = {
             'userId': 'me',
             'labelIds': labels,
-            'maxResults': 1000
+            'maxResults': MAX_LISTED_EMAILS
         }
 
         if d:
             list_filters['q'] = 'after:{}'.format(d)
 
-        try:
-            response = self.service.users().messages().list(**list_filters).execute()
+        response = self.execute('messages.list', self.service.users().messages().list(**list_filters))
+
+        messages = []
+        if 'messages' in response:
+            messages.extend(response['messages'])
 
-            messages = []
-            if 'messages' in response:
+        while 'nextPageToken' in response:
+            if len(messages) < MAX_LISTED_EMAILS:
+                page_token = response['nextPageToken']
+                list_filters['pageToken'] = page_token
+                response = self.execute('messages.list', self.service.users().messages().list(**list_filters))
                 messages.extend(response['messages'])
+            else:
+                break
 
-            while 'nextPageToken' in response:
-                if len(messages) < 1000:
-                    page_token = response['nextPageToken']
-                    list_filters['pageToken'] = page_token
-                    response = self.service.users().messages().list(**list_filters).execute()
-                    messages.extend(response['messages'])
-                else:
-                    break
-
-            # Return only 1000 messages as GMail does not allow
-            # batches with more than 1000 requests in them.
-            return messages[:1000]
+        return messages[:MAX_LISTED_EMAILS]
 
-        except errors.HttpError as error:
-            # TODO properly handle API errors
-            print('An error occurred: %s' % error)
-            return []
+    def list_emails_page(self, labels, page_size, page_token=None):
+        """
+        Retrieve a single page of email ids from GMail API.
+
+        :param {list} labels: A list of label ids that the emails have to have.
+        :param {int} page_size: The maximum number of ids in the page (at most 500).
+        :param {str} page_token: (Optional) The token of the page, the first page by default.
+
+        :return: A tuple with the list of GMail ids and the token of the next
+                 page, None in case it is the last page.
+        :raises: `googleapiclient.errors.HttpError` in case the API call failed.
+        """
+        list_filters = {
+            'userId': 'me',
+            'labelIds': labels,
+            'maxResults': page_size,
+            'fields': 'messages/id,nextPageToken'
+        }
+
+        if page_token:
+            list_filters['pageToken'] = page_token
+
+        response = self.execute('messages.list', self.service.users().messages().list(**list_filters))
+
+        return [message['id'] for message in response.get('messages', [])], response.get('nextPageToken')
 
     def get_unread_emails_ids(self, d=None):
         """
@@ -84,31 +234,95 @@ class GoogleAPIService(object):
         """
         return self.get_labeled_emails([LABEL_UNREAD, LABEL_INBOX], d)
 
-    def get_emails_details(self, emails, callback):
+    def get_emails_details(self, emails, callback, labels_only=False):
         """
-        Create a batch job to retrieve emails details from GMail API.
+        Retrieve emails details from GMail API using batch requests.
 
         According to GMail API, it is impossible to simply retrieve email
         details in a list, but rather make individual calls for each email.
 
-        In order to simplify things, a "batch" object can be created that
-        will execute a provided callback function against the received data
-        for each emails.
+        In order to simplify things, "batch" objects are created that will
+        execute a provided callback function against the received data for
+        each email, as soon as the batch that contains it has completed.
 
         :param {list} emails: List of objects with email IDs for which to retrieve details.
         :param {function} callback: The callback function to call upon receiving email details.
+        :param {bool} labels_only: (Optional) Retrieve only the email ids and their label ids.
+        """
+        for request_id, response, exception in self.iter_emails_details(emails, labels_only):
+            callback(request_id, response, exception)
+
+    def iter_emails_details(self, emails, labels_only=False):
+        """
+        Retrieve emails details from GMail API in Gmail-sized concurrent batches.
+
+        GMail API caps batches at 100 requests and throttles large ones, so the
+        emails are split into batches of `BATCH_SIZE` requests that are executed
+        by a pool of at most `BATCH_CONCURRENCY` threads.
+
+        Results are yielded in the calling thread as soon as their batch completes,
+        so that consumers (which usually access the database) never run inside
+        the worker threads.
+
+        :param {list} emails: List of objects with email IDs for which to retrieve details.
+        :param {bool} labels_only: (Optional) Retrieve only the email ids and their label ids.
+
+        :return: A generator of `(request_id, response, exception)` tuples, where
+                 `request_id` is the GMail id of the email.
         """
-        batch = self.service.new_batch_http_request(callback=callback)
+        batch_size = settings.GOOGLE_AUTH_SETTINGS['BATCH_SIZE']
+        concurrency = settings.GOOGLE_AUTH_SETTINGS['BATCH_CONCURRENCY']
+        chunks = [emails[offset:offset + batch_size] for offset in range(0, len(emails), batch_size)]
+
+        if len(chunks) <= 1 or concurrency <= 1:
+            for chunk in chunks:
+                yield from self._execute_details_batch(chunk, labels_only)
+            return
+
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(chunks))) as executor:
+            futures = [executor.submit(self._execute_details_batch, chunk, labels_only) for chunk in chunks]
+
+            for future in as_completed(futures):
+                yield from future.result()
+
+    def _execute_details_batch(self, emails, labels_only=False):
+        """
+        Create and execute a single batch job to retrieve emails details.
+
+        :param {list} emails: List of objects with email IDs for which to retrieve details.
+        :param {bool} labels_only: (Optional) Retrieve only the email ids and their label ids.
+
+        :return: A list of `(request_id, response, exception)` tuples.
+        """
+        return self.coalesce('details', [[email['id'] for email in emails], labels_only],
+                             lambda: self._fetch_details_batch(emails, labels_only))
+
+    def _fetch_details_batch(self, emails, labels_only=False):
+        results = []
+
+        def collect(request_id, response, exception):
+            results.append((request_id, response, exception))
+
+        batch = self.service.new_batch_http_request(callback=collect)
+        config = settings.GOOGLE_AUTH_SETTINGS
 
         for email in emails:
-            get_request = self.service.users().messages().get(userId='me',
-                                                              id=email['id'],
-                                                              fields=settings.GOOGLE_AUTH_SETTINGS['MESSAGE_FIELDS'],
-                                                              format='metadata',
-                                                              metadataHeaders=settings.GOOGLE_AUTH_SETTINGS['METADATA_HEADERS'])
-            batch.add(get_request)
+            if labels_only:
+                get_request = self.service.users().messages().get(userId='me',
+                                                                  id=email['id'],
+                                                                  fields='id,labelIds',
+                                                                  format='minimal')
+            else:
+                get_request = self.service.users().messages().get(userId='me',
+                                                                  id=email['id'],
+                                                                  fields=config['MESSAGE_FIELDS'],
+                                                                  format='metadata',
+                                                                  metadataHeaders=config['METADATA_HEADERS'])
+            batch.add(get_request, request_id=email['id'])
 
-        batch.execute()
+        self.execute('messages.get', batch, len(emails))
+
+        return results
 
     def batch_modify_emails(self, payload):
         """
@@ -119,7 +333,8 @@ class GoogleAPIService(object):
                         be modified on GMail servers.
         :return: Errors if any or None
         """
-        response = self.service.users().messages().batchModify(userId='me', body=payload).execute()
+        request = self.service.users().messages().batchModify(userId='me', body=payload)
+        response = self.execute('messages.batchModify', request)
 
         # In case batchModify request was successful, it returns an empty string,
         # otherwise it returns a dict with an 'error' key with error details.
@@ -128,13 +343,239 @@ class GoogleAPIService(object):
         else:
             return response['error']
 
+    def iter_batch_modify_emails(self, payload):
+        """
+        Modify labels on GMail servers for any amount of emails.
+
+        GMail API accepts at most 1000 ids per batchModify request, so the ids
+        are split into chunks of `MODIFY_BATCH_SIZE` ids that are modified by a
+        pool of at most `MODIFY_CONCURRENCY` threads. Every chunk is retried on
+        its own in case it is rate limited or fails temporarily.
+
+        :param payload: A dict that has the "ids", "addLabelIds" and
+                        "removeLabelIds" props.
+
+        :return: A generator of dicts with the "ids" of a chunk, whether they
+                 were "modified" and the number of "retries" it took, yielded
+                 in the calling thread as soon as the chunk completes.
+        """
+        chunk_size = settings.GOOGLE_AUTH_SETTINGS['MODIFY_BATCH_SIZE']
+        chunks = [dict(payload, ids=payload['ids'][offset:offset + chunk_size])
+                  for offset in range(0, len(payload['ids']), chunk_size)]
+
+        if len(chunks) <= 1:
+            for chunk in chunks:
+                yield self._modify_chunk(chunk)
+            return
+
+        yield from self._iter_modified_chunks(chunks)
+
+    def iter_batch_modify_listed_emails(self, q, add_label_ids, remove_label_ids, exclude_ids=()):
+        """
+        Modify labels on GMail servers for all the emails matching a search query.
+
+        Listed pages of ids are piped into batchModify requests as they come,
+        so the listing of the next pages overlaps with the modification of the
+        previous ones and ids never have to leave the server.
+
+        :param {str} q: The GMail search query.
+        :param {list} add_label_ids: The ids of the labels to add.
+        :param {list} remove_label_ids: The ids of the labels to remove.
+        :param exclude_ids: (Optional) The GMail ids of emails to leave untouched.
+
+        :return: A generator of chunk outcomes, see `iter_batch_modify_emails()`.
+        """
+        chunk_size = settings.GOOGLE_AUTH_SETTINGS['MODIFY_BATCH_SIZE']
+
+        def iter_chunks():
+            ids = []
+            for page in self.iter_listed_email_ids(q):
+                ids.extend(google_id for google_id in page if google_id not in exclude_ids)
+                while len(ids) >= chunk_size:
+                    yield {'ids': ids[:chunk_size], 'addLabelIds': add_label_ids,
+                           'removeLabelIds': remove_label_ids}
+                    ids = ids[chunk_size:]
+            if ids:
+                yield {'ids': ids, 'addLabelIds': add_label_ids, 'removeLabelIds': remove_label_ids}
+
+        yield from self._iter_modified_chunks(iter_chunks())
+
+    def iter_listed_email_ids(self, q):
+        """
+        Page through the ids of all the emails matching a search query.
+
+        Only the ids and the page tokens are requested, in the largest pages
+        GMail API allows.
+
+        :param {str} q: The GMail search query.
+
+        :return: A generator of lists of GMail ids, one per page.
+        :raises: `googleapiclient.errors.HttpError` in case an API call failed.
+        """
+        list_filters = {
+            'userId': 'me',
+            'q': q,
+            'maxResults': 500,
+            'fields': 'messages/id,nextPageToken'
+        }
+
+        while True:
+            response = self.execute('messages.list', self.service.users().messages().list(**list_filters))
+
+            yield [message['id'] for message in response.get('messages', [])]
+
+            if 'nextPageToken' not in response:
+                break
+
+            list_filters['pageToken'] = response['nextPageToken']
+
+    def _iter_modified_chunks(self, chunks):
+        """
+        Execute batchModify requests for the given chunks with a bounded concurrency.
+
+        Chunks are consumed lazily: a new one is taken only when one of the
+        `MODIFY_CONCURRENCY` threads is available.
+
+        :param chunks: An iterable of batchModify request bodies.
+
+        :return: A generator of chunk outcomes, in completion order.
+        """
+        concurrency = settings.GOOGLE_AUTH_SETTINGS['MODIFY_CONCURRENCY']
+
+        if concurrency <= 1:
+            for chunk in chunks:
+                yield self._modify_chunk(chunk)
+            return
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            pending = set()
+
+            for chunk in chunks:
+                if len(pending) >= concurrency:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+
+                pending.add(executor.submit(self._modify_chunk, chunk))
+
+            for future in as_completed(pending):
+                yield future.result()
+
+    @staticmethod
+    def build_search_query(q='', sender='', domain=''):
+        """
+        Build a GMail search query out of a free search and sender filters.
+
+        :param {str} q: (Optional) A GMail search expression.
+        :param {str} sender: (Optional) The email address of the sender.
+        :param {str} domain: (Optional) The domain of the sender.
+
+        :return: The search query, empty in case there is no filter.
+        """
+        def clean(value):
+            return ''.join(char for char in value.strip() if char not in '()"')
+
+        terms = []
+        if q and q.strip():
+            terms.append(q.strip())
+        if sender and clean(sender):
+            terms.append('from:({})'.format(clean(sender)))
+        if domain and clean(domain):
+            terms.append('from:(@{})'.format(clean(domain).lstrip('@')))
+
+        return ' '.join(terms)
+
+    def _modify_chunk(self, payload):
+        """
+        Execute a single batchModify request, retrying it with a jittered exponential backoff.
+
+        :param payload: The body of the batchModify request.
+
+        :return: A dict with the "ids" of the request, whether they were
+                 "modified" and the number of "retries".
+        """
+        scheduler = RetryScheduler(base_delay=settings.GOOGLE_AUTH_SETTINGS['RETRY_BASE_DELAY'],
+                                   max_delay=settings.GOOGLE_AUTH_SETTINGS['RETRY_MAX_DELAY'],
+                                   deadline=settings.GOOGLE_AUTH_SETTINGS['RETRY_DEADLINE'])
+
+        while True:
+            try:
+                errs = self.batch_modify_emails(payload)
+            except errors.HttpError as error:
+                delay = None
+                if error.resp.status in RETRYABLE_STATUSES:
+                    delay = scheduler.next_delay(get_retry_after(error))
+
+                if delay is None:
+                    logger.warning('Could not modify %s emails: %s', len(payload['ids']), error)
+                    return {'ids': payload['ids'], 'modified': False, 'retries': scheduler.attempt}
+
+                sleep(delay)
+            except CircuitOpenError as error:
+                logger.warning('Could not modify %s emails: %s', len(payload['ids']), error)
+                return {'ids': payload['ids'], 'modified': False, 'retries': scheduler.attempt}
+            else:
+                return {'ids': payload['ids'], 'modified': not errs, 'retries': scheduler.attempt}
+
+    def get_profile(self):
+        """
+        Retrieve the user profile from GMail API.
+
+        :return: A dict with "emailAddress", "messagesTotal", "threadsTotal"
+                 and "historyId" keys.
+        """
+        return self.execute('users.getProfile', self.service.users().getProfile(userId='me'))
+
+    def list_history(self, start_history_id):
+        """
+        Retrieve the changes that happened in the user mailbox since the given history record.
+
+        :param {str} start_history_id: The history id to start listing changes from.
+
+        :return: A tuple with the list of history records and the current history id.
+        :raises: `HistoryExpiredError` in case GMail no longer has the history
+                 since `start_history_id`.
+        """
+        list_filters = {
+            'userId': 'me',
+            'startHistoryId': start_history_id,
+            'historyTypes': HISTORY_TYPES
+        }
+
+        try:
+            response = self.execute('history.list', self.service.users().history().list(**list_filters))
+            history = response.get('history', [])
+
+            while 'nextPageToken' in response:
+                list_filters['pageToken'] = response['nextPageToken']
+                response = self.execute('history.list', self.service.users().history().list(**list_filters))
+                history.extend(response.get('history', []))
+
+        except errors.HttpError as error:
+            if error.resp.status == 404:
+                raise HistoryExpiredError(
+                    'History since {} is not available anymore.'.format(start_history_id))
+            raise
+
+        return history, response['historyId']
+
+    def get_label(self, label_id):
+        """
+        Retrieve a user label, along with its message and thread counters, from GMail API.
+
+        :param {str} label_id: The GMail id of the label.
+
+        :return: The label dict.
+        """
+        return self.execute('labels.get', self.service.users().labels().get(userId='me', id=label_id))
+
     def list_user_labels(self):
         """
         Retrieve user labels from GMail API.
 
         :return: The list of labels.
         """
-        response = self.service.users().labels().list(userId='me').execute()
+        response = self.execute('labels.list', self.service.users().labels().list(userId='me'))
 
         labels = response.get('labels', [])
 
@@ -149,16 +590,23 @@ class EmailService(object):
     for faster retrieval.
     """
     def __init__(self, credentials, user):
-        self.gmail_service = GoogleAPIService(credentials)
+        self.gmail_service = GoogleAPIService(credentials, user_id=str(user.pk))
         self.email_label_serializer = LabelSerializer
         self.user = user
         self.last_saved_email = self.get_last_saved_email()
         self.emails = []
         self.email_ids = []
         self.failed_requests = {}
-
-        self.exponential_backoff_delay = 1
-        self.max_backoff_delay = 16
+        self.retry_after = None
+        self.gave_up_ids = []
+        self.refreshed_labels = {}
+        self.labels_updated = False
+        self._locked_ids = None
+        self._user_labels = None
+        self._serialized_labels = None
+        self.synced_at = None
+        self.refreshing = False
+        self.stale = False
 
     def get_last_saved_email(self):
         """
@@ -184,7 +632,7 @@ class EmailService(object):
 
         return None
 
-    def retrieve_nr_of_unread_emails(self):
+    def retrieve_nr_of_unread_emails(self, exact=False):
         """
         Retrieve number of unread emails from GMail servers.
 
@@ -195,38 +643,760 @@ class EmailService(object):
         that are on GMail servers, so a loading animation with corresponding
         message can be shown to the user on the frontend.
 
+        By default the number comes from the unread messages counter of the
+        INBOX label, which costs a single API call and is cached for a short
+        while. The exact mode counts the listed unread emails instead, which
+        is capped at 1000 emails.
+
+        While GMail API is unavailable, the local unread emails are counted
+        instead, in case they were synchronized before.
+
+        :param {bool} exact: (Optional) Count the listed unread emails.
+
         :return: A dict with number of emails on GMail.
         """
+        try:
+            return self._retrieve_nr_of_unread_emails(exact)
+        except Exception as error:
+            self.fall_back_to_local_emails(error)
+            return {'gmail': self.get_local_unread_emails_queryset().count()}
+
+    def _retrieve_nr_of_unread_emails(self, exact=False):
         response = {}
 
-        nr_of_gmail_emails = len(self.gmail_service.get_unread_emails_ids())
+        if exact:
+            response['gmail'] = len(self.gmail_service.get_unread_emails_ids())
+            return response
+
+        cache_key = self.get_unread_count_cache_key()
+        nr_of_gmail_emails = cache.get(cache_key)
+
+        if nr_of_gmail_emails is None:
+            nr_of_gmail_emails = self.gmail_service.get_label(LABEL_INBOX).get('messagesUnread', 0)
+            cache.set(cache_key, nr_of_gmail_emails,
+                      settings.GOOGLE_AUTH_SETTINGS['UNREAD_COUNT_CACHE_TIMEOUT'])
 
         response['gmail'] = nr_of_gmail_emails
 
         return response
 
+    def get_unread_count_cache_key(self):
+        """
+        :return: The cache key of the user unread emails counter.
+        """
+        return 'emails:unread-count:{}'.format(self.user.pk)
+
     def retrieve_unread_emails(self):
         """
         Retrieve a list of User's unread emails to be sent as a response.
 
         This method consists of several steps:
-            1. Check for the latest email that exists in the DB for the given user.
-            2. Make an API call to GMail to get any emails *after* the latest email.
-            3. Save new emails in the DB.
-            4. Retrieve and return all unread emails.
-        :return: A list of `gcleaner.emails.models.Email` object instances.
-        """
-        if self.failed_requests:
-            self.email_ids = list(self.failed_requests.values())
-            self.failed_requests = {}
+            1. Check whether the emails of the user were synchronized before.
+            2. If so, return the local unread emails right away and, in case
+               they are stale, refresh them from GMail in the background.
+            3. Otherwise retrieve all unread emails from GMail, save them in
+               the DB and return them.
+        :return: A list of dicts with email details.
+        """
+        sync_state = self.get_sync_state()
+
+        if sync_state.synced_at:
+            self.revalidate_unread_emails(sync_state)
+            return self.get_local_unread_emails()
+
+        return self.sync_all_unread_emails(sync_state)
+
+    def iter_unread_emails(self):
+        """
+        Same as `retrieve_unread_emails`, but yields every email as soon as it is available.
+
+        Emails retrieved from GMail are yielded in the order their batches
+        complete rather than in the order GMail listed them.
+
+        :return: A generator of dicts with email details.
+        """
+        sync_state = self.get_sync_state()
+
+        if sync_state.synced_at:
+            self.revalidate_unread_emails(sync_state)
+            yield from self.get_local_unread_emails()
         else:
-            self.email_ids = self.gmail_service.get_unread_emails_ids()
+            yield from self.iter_all_unread_emails(sync_state)
+
+    def retrieve_unread_emails_page(self, page_size, page_token=None):
+        """
+        Retrieve a page of User's unread emails, in the order GMail lists them.
+
+        Details are retrieved from GMail only for the emails of the page that
+        are not stored locally yet, and stored for the next requests.
+
+        :param {int} page_size: The maximum number of emails in the page.
+        :param {str} page_token: (Optional) The GMail token of the page.
+
+        While GMail API is unavailable, the first page is served from the local
+        emails instead, in case they were synchronized before.
+
+        :return: A tuple with a list of dicts with email details and the GMail
+                 token of the next page, None in case it is the last page.
+        """
+        try:
+            return self._retrieve_unread_emails_page(page_size, page_token)
+        except Exception as error:
+            # GMail page tokens do not point anywhere in the local emails.
+            if page_token:
+                raise
+            self.fall_back_to_local_emails(error)
+            return self.get_local_unread_emails()[:page_size], None
+
+    def _retrieve_unread_emails_page(self, page_size, page_token=None):
+        google_ids, next_page_token = self.gmail_service.list_emails_page([LABEL_UNREAD, LABEL_INBOX],
+                                                                          page_size, page_token)
+
+        known_emails = {email.google_id: email
+                        for email in self.user.emails.filter(google_id__in=google_ids)
+                        .select_related('sender').prefetch_related('labels')}
+        unknown_ids = [{'id': google_id} for google_id in google_ids if google_id not in known_emails]
+
+        for request_id, response, exception in self.gmail_service.iter_emails_details(unknown_ids):
+            self.gmail_service_batch_callback(request_id, response, exception)
+        self._handle_failed_requests()
+
+        self.store_emails(self.emails)
+        self.update_sender_rollups({email_dict['sender']['email'] for email_dict in self.emails},
+                                   {email_dict['sender']['domain'] for email_dict in self.emails})
+
+        new_emails = {email_dict['google_id']: email_dict for email_dict in self.emails}
+        emails = []
+        for google_id in google_ids:
+            if google_id in known_emails:
+                emails.append(self.email_to_dict(known_emails[google_id], google_id in self.locked_ids))
+            elif google_id in new_emails:
+                emails.append(new_emails[google_id])
+
+        return emails, next_page_token
+
+    def get_sync_state(self):
+        """
+        :return: The `SyncState` instance of the user.
+        """
+        sync_state, created = SyncState.objects.get_or_create(user=self.user)
+
+        return sync_state
+
+    def revalidate_unread_emails(self, sync_state):
+        """
+        Refresh the local emails in the background in case they are stale.
+
+        Stale emails are not refreshed while GMail API is unavailable, they
+        are served flagged as stale instead.
+
+        :param sync_state: The `SyncState` instance of the user.
+        """
+        self.synced_at = sync_state.synced_at
+
+        stale_after = datetime.timedelta(seconds=settings.GOOGLE_AUTH_SETTINGS['STALE_AFTER'])
+        if timezone.now() - sync_state.synced_at >= stale_after:
+            if gmail_circuit_breaker.available():
+                self.refresh_unread_emails_in_background()
+            else:
+                self.stale = True
+
+    def fall_back_to_local_emails(self, error):
+        """
+        Serve the local emails, flagged as stale, in place of the ones GMail API failed to provide.
+
+        :param error: The exception raised while calling GMail API.
+
+        :raises: The exception, in case GMail API is not unavailable but
+                 rejected the call, or the emails of the user were never
+                 synchronized.
+        """
+        sync_state = self.get_sync_state()
 
-        self.gmail_service.get_emails_details(self.email_ids, self.gmail_service_batch_callback)
+        if not is_unavailable_error(error) or not sync_state.synced_at:
+            raise error
 
+        logger.warning('Serving local emails of user %s, GMail API is unavailable: %s', self.user.pk, error)
+        self.synced_at = sync_state.synced_at
+        self.stale = True
+
+    def refresh_unread_emails_in_background(self):
+        """
+        Synchronize the emails of the user with GMail in a worker thread.
+
+        A lock in the cache makes sure there is a single refresh per user at a
+        time, concurrent requests rely on the one that is already running.
+        """
+        self.refreshing = True
+
+        lock_timeout = settings.GOOGLE_AUTH_SETTINGS['REFRESH_LOCK_TIMEOUT']
+        if cache.add(self.get_refresh_lock_key(), True, lock_timeout):
+            service = self.__class__(self.gmail_service.credentials, self.user)
+            get_refresh_executor().submit(service.refresh_unread_emails)
+
+    def refresh_unread_emails(self):
+        """
+        Synchronize the emails of the user with GMail, meant to run in a worker thread.
+
+        Releases the refresh lock and the database connections of the thread once done.
+        """
+        try:
+            self.sync_unread_emails()
+        except Exception:
+            logger.exception('Could not refresh unread emails of user %s', self.user.pk)
+        finally:
+            cache.delete(self.get_refresh_lock_key())
+            connections.close_all()
+
+    def get_refresh_lock_key(self):
+        """
+        :return: The cache key of the lock held while the user emails are refreshed.
+        """
+        return 'emails:refresh:{}'.format(self.user.pk)
+
+    def sync_unread_emails(self):
+        """
+        Synchronize the local emails with GMail, incrementally when possible.
+        """
+        sync_state = self.get_sync_state()
+
+        if not self.try_sync_emails_from_history(sync_state):
+            self.sync_all_unread_emails(sync_state)
+
+    def try_sync_emails_from_history(self, sync_state):
+        """
+        Synchronize emails incrementally in case they were synchronized before.
+
+        :param sync_state: The `SyncState` instance of the user.
+
+        :return: Whether the emails were synchronized, otherwise a full
+                 synchronization is needed.
+        """
+        if not sync_state.history_id:
+            return False
+
+        try:
+            self.sync_emails_from_history(sync_state)
+        except HistoryExpiredError:
+            return False
+
+        return True
+
+    def sync_all_unread_emails(self, sync_state):
+        """
+        Retrieve all unread emails from GMail and replace the local emails with them.
+
+        :param sync_state: The `SyncState` instance of the user.
+
+        :return: A list of dicts with email details, in the order GMail listed them.
+        """
+        emails = {email_dict['google_id']: email_dict
+                  for email_dict in self.iter_all_unread_emails(sync_state)}
+
+        return [emails[email['id']] for email in self.email_ids if email['id'] in emails]
+
+    def iter_all_unread_emails(self, sync_state):
+        """
+        Retrieve all unread emails from GMail and replace the local emails with them.
+
+        Only the emails that are not stored locally yet are retrieved with all
+        their details, for the ones that are already stored only the labels
+        are refreshed.
+
+        The emails are yielded as soon as they are available: first the
+        refreshed local emails, then the new ones as their batches complete.
+
+        :param sync_state: The `SyncState` instance of the user.
+
+        :return: A generator of dicts with email details.
+        """
+        # Take the history id before listing emails, so that no change that happens meanwhile is lost.
+        history_id = self.gmail_service.get_profile()['historyId']
+
+        self.email_ids = self.gmail_service.list_emails([LABEL_UNREAD, LABEL_INBOX])
+        listed_ids = [email['id'] for email in self.email_ids]
+
+        known_emails = {email.google_id: email
+                        for email in self.user.emails.filter(google_id__in=listed_ids)
+                        .select_related('sender').prefetch_related('labels')}
+        unknown_ids = [email for email in self.email_ids if email['id'] not in known_emails]
+
+        if known_emails:
+            self.gmail_service.get_emails_details([{'id': google_id} for google_id in known_emails],
+                                                  self.gmail_service_labels_callback,
+                                                  labels_only=True)
+            for google_id in self.refresh_emails_labels(known_emails):
+                yield self.email_to_dict(known_emails[google_id], google_id in self.locked_ids)
+
+        for request_id, response, exception in self.gmail_service.iter_emails_details(unknown_ids):
+            nr_of_emails = len(self.emails)
+            self.gmail_service_batch_callback(request_id, response, exception)
+            yield from self.emails[nr_of_emails:]
+
+        nr_of_emails = len(self.emails)
         self._handle_failed_requests()
+        yield from self.emails[nr_of_emails:]
+
+        # Streamed responses are consumed outside of the request transaction.
+        with transaction.atomic():
+            self.store_emails(self.emails)
+
+            self.prune_unlisted_emails(listed_ids)
+
+            self.update_sender_rollups()
+
+            self.save_sync_state(sync_state, history_id)
+
+    def prune_unlisted_emails(self, listed_ids):
+        """
+        Delete the local emails that are not unread in the inbox anymore, as they are not worth mirroring.
+
+        GMail lists the newest emails first, so in case the listing was capped
+        at `MAX_LISTED_EMAILS`, only the unlisted emails that are newer than
+        the oldest listed one are known to be gone. Older ones are kept.
+
+        :param {list} listed_ids: The GMail ids of the listed unread emails.
+        """
+        unlisted_emails = self.user.emails.exclude(google_id__in=listed_ids)
+
+        if len(listed_ids) >= MAX_LISTED_EMAILS:
+            listed_emails = self.user.emails.filter(google_id__in=listed_ids)
+            oldest_date = listed_emails.aggregate(date=Min('date'))['date']
+            if oldest_date is None:
+                return
+            unlisted_emails = unlisted_emails.filter(date__gt=oldest_date)
+
+        unlisted_emails.delete()
+
+    def gmail_service_labels_callback(self, request_id, response, exception):
+        """
+        The callback to be called for each labels-only batch request.
 
-        return self.emails
+        :param request_id: The GMail id of the requested email.
+        :param {dict} response: A deserialized object with "id" and "labelIds" keys.
+        :param exception: A `googleapiclient.errors.HttpError` instance or None
+        """
+        if exception:
+            self.gmail_service_batch_callback(request_id, response, exception)
+        else:
+            self.refreshed_labels[response['id']] = response.get('labelIds', [])
+
+    def refresh_emails_labels(self, emails):
+        """
+        Reflect the label ids retrieved from GMail on locally stored emails.
+
+        :param emails: A dict of `Email` instances by their GMail id.
+
+        :return: The GMail ids of the refreshed emails.
+        """
+        label_ids = set().union(*self.refreshed_labels.values())
+        user_labels = self.get_user_labels(label_ids)
+
+        for google_id, email_label_ids in self.refreshed_labels.items():
+            email = emails[google_id]
+            labels = [user_labels[label_id] for label_id in email_label_ids if label_id in user_labels]
+
+            if {label.pk for label in email.labels.all()} != {label.pk for label in labels}:
+                email.labels.set(labels)
+
+            starred = LABEL_STARRED in email_label_ids
+            important = LABEL_IMPORTANT in email_label_ids
+            if email.starred != starred or email.important != important:
+                email.starred = starred
+                email.important = important
+                email.save(update_fields=['starred', 'important'])
+
+        refreshed_ids = list(self.refreshed_labels)
+        self.refreshed_labels = {}
+
+        return refreshed_ids
+
+    def sync_emails_from_history(self, sync_state):
+        """
+        Apply the changes that happened in the GMail mailbox since the last synchronization.
+
+        New unread emails in the inbox are retrieved from GMail and saved,
+        label changes are reflected on the local emails and deleted emails
+        are removed.
+
+        :param sync_state: The `SyncState` instance of the user.
+        :raises: `HistoryExpiredError` in case a full synchronization is needed.
+        """
+        history, history_id = self.gmail_service.list_history(sync_state.history_id)
+
+        current_labels = {}
+        added_labels = {}
+        removed_labels = {}
+        deleted_ids = set()
+
+        for record in history:
+            for change in record.get('messagesAdded', []):
+                current_labels[change['message']['id']] = change['message'].get('labelIds', [])
+
+            for change in record.get('labelsAdded', []):
+                google_id = change['message']['id']
+                current_labels[google_id] = change['message'].get('labelIds', [])
+                added_labels.setdefault(google_id, set()).update(change['labelIds'])
+                removed_labels.setdefault(google_id, set()).difference_update(change['labelIds'])
+
+            for change in record.get('labelsRemoved', []):
+                google_id = change['message']['id']
+                current_labels[google_id] = change['message'].get('labelIds', [])
+                removed_labels.setdefault(google_id, set()).update(change['labelIds'])
+                added_labels.setdefault(google_id, set()).difference_update(change['labelIds'])
+
+            for change in record.get('messagesDeleted', []):
+                deleted_ids.add(change['message']['id'])
+
+        sender_emails, sender_domains = self.get_senders(
+            self.user.emails.filter(google_id__in=deleted_ids.union(current_labels)))
+
+        self.user.emails.filter(google_id__in=deleted_ids).delete()
+
+        local_ids = set(self.user.emails.filter(google_id__in=current_labels.keys())
+                        .values_list('google_id', flat=True))
+
+        # Make sure labels created since the last synchronization are known.
+        self.get_user_labels(set().union(*added_labels.values(), *removed_labels.values()))
+        self.change_emails_labels(added_labels, removed_labels)
+
+        # Retrieve details only for emails that became unread in the inbox and are not stored yet.
+        known_ids = local_ids | deleted_ids
+        self.email_ids = [{'id': google_id} for google_id, labels in current_labels.items()
+                          if google_id not in known_ids and {LABEL_UNREAD, LABEL_INBOX}.issubset(labels)]
+
+        if self.email_ids:
+            self.gmail_service.get_emails_details(self.email_ids, self.gmail_service_batch_callback)
+            self._handle_failed_requests()
+            self.store_emails(self.emails)
+
+            sender_emails.update(email_dict['sender']['email'] for email_dict in self.emails)
+            sender_domains.update(email_dict['sender']['domain'] for email_dict in self.emails)
+
+        self.update_sender_rollups(sender_emails, sender_domains)
+
+        self.save_sync_state(sync_state, history_id)
+
+    def save_sync_state(self, sync_state, history_id):
+        """
+        Record that the local emails reflect the GMail mailbox up to the given history id.
+
+        :param sync_state: The `SyncState` instance of the user.
+        :param {str} history_id: The GMail history id.
+        """
+        sync_state.history_id = history_id
+        sync_state.synced_at = timezone.now()
+        sync_state.save()
+
+        self.synced_at = sync_state.synced_at
+
+    @property
+    def locked_ids(self):
+        """
+        The GMail ids of the emails locked by the user, loaded once per service instance.
+        """
+        if self._locked_ids is None:
+            self._locked_ids = set(LockedEmail.objects.filter(user=self.user, locked=True)
+                                   .values_list('google_id', flat=True))
+
+        return self._locked_ids
+
+    @property
+    def user_labels(self):
+        """
+        A dict of the user `Label` instances by their GMail id, loaded once per service instance.
+        """
+        if self._user_labels is None:
+            self._user_labels = {label.google_id: label for label in Label.objects.filter(user=self.user)}
+
+        return self._user_labels
+
+    @property
+    def serialized_labels(self):
+        """
+        A dict of the user serialized labels by their GMail id.
+
+        A user has only a few dozen labels that are referenced by every email,
+        so they are serialized once and shared between requests through the
+        cache, until `update_labels()` invalidates them.
+        """
+        if self._serialized_labels is None:
+            cache_key = self.get_labels_cache_key()
+            serialized_labels = cache.get(cache_key)
+
+            if serialized_labels is None:
+                serializer = self.email_label_serializer(self.user_labels.values(), many=True)
+                serialized_labels = {label['google_id']: dict(label) for label in serializer.data}
+                cache.set(cache_key, serialized_labels, settings.GOOGLE_AUTH_SETTINGS['LABELS_CACHE_TIMEOUT'])
+
+            self._serialized_labels = serialized_labels
+
+        return self._serialized_labels
+
+    def get_labels_cache_key(self):
+        """
+        :return: The cache key of the user serialized labels.
+        """
+        return 'emails:labels:{}'.format(self.user.pk)
+
+    def get_user_labels(self, label_ids):
+        """
+        Retrieve the user labels, updating labels from GMail in case some of
+        the given label ids are not known yet.
+
+        Labels are updated from GMail at most once per service instance, so
+        label ids that GMail does not know about do not cause repeated calls.
+
+        :param label_ids: The GMail ids of the labels.
+
+        :return: A dict of `Label` instances by their GMail id.
+        """
+        if not self.labels_updated and not set(label_ids).issubset(self.user_labels.keys()):
+            self.update_labels()
+
+        return self.user_labels
+
+    def store_emails(self, email_dicts):
+        """
+        Save the given emails in the database, updating the ones that already exist.
+
+        Emails, their senders and their label links are written in bulk, so
+        storing a whole batch of emails costs a constant number of queries.
+        The latest email of the user is advanced within the same transaction.
+
+        :param email_dicts: Dicts with email details, with serialized labels.
+        """
+        if not email_dicts:
+            return
+
+        emails = {}
+        email_label_ids = {}
+        senders = self.get_or_create_senders(email_dict['sender'] for email_dict in email_dicts)
+
+        for email_dict in email_dicts:
+            label_ids = [label['google_id'] for label in email_dict['labels']]
+            email_label_ids[email_dict['google_id']] = label_ids
+            emails[email_dict['google_id']] = Email(
+                user=self.user,
+                google_id=email_dict['google_id'],
+                thread_id=email_dict['thread_id'],
+                subject=email_dict.get('subject', ''),
+                snippet=email_dict.get('snippet', ''),
+                sender=senders[email_dict['sender']['email'], email_dict['sender']['name']],
+                # Headers listing many recipients exceed the columns, which would fail the whole bulk insert.
+                receiver=email_dict.get('receiver', '')[:254],
+                delivered_to=email_dict.get('delivered_to', '')[:254],
+                starred=LABEL_STARRED in label_ids,
+                important=LABEL_IMPORTANT in label_ids,
+                date=email_dict['date'],
+                list_unsubscribe=email_dict.get('list_unsubscribe', ''))
+
+        batch_size = settings.GOOGLE_AUTH_SETTINGS['STORE_BATCH_SIZE']
+
+        stored_emails = self.user.emails.filter(google_id__in=emails.keys())
+
+        with transaction.atomic():
+            existing_ids = dict(stored_emails.values_list('google_id', 'pk'))
+
+            for google_id, pk in existing_ids.items():
+                emails[google_id].pk = pk
+
+            Email.objects.bulk_create([email for google_id, email in emails.items()
+                                       if google_id not in existing_ids],
+                                      batch_size=batch_size, ignore_conflicts=True)
+            Email.objects.bulk_update([emails[google_id] for google_id in existing_ids],
+                                      EMAIL_MIRRORED_FIELDS, batch_size=batch_size)
+
+            email_pks = dict(stored_emails.values_list('google_id', 'pk'))
+
+            EmailLabel = Email.labels.through
+            EmailLabel.objects.filter(email_id__in=email_pks.values()).delete()
+            EmailLabel.objects.bulk_create([
+                EmailLabel(email_id=email_pks[google_id], label_id=self.user_labels[label_id].pk)
+                for google_id, label_ids in email_label_ids.items() if google_id in email_pks
+                for label_id in label_ids if label_id in self.user_labels
+            ], batch_size=batch_size, ignore_conflicts=True)
+
+            self.advance_latest_email(max(emails.values(), key=lambda email: email.date), email_pks)
+
+    def get_or_create_senders(self, actors):
+        """
+        Retrieve the senders of the user, creating in bulk the ones that do not exist yet.
+
+        :param actors: Dicts with "name", "email" and "domain" keys, as parsed from emails.
+
+        :return: A dict of `Sender` instances by the (email, name) tuple of the actors.
+        """
+        actors = {(actor['email'], actor['name']): actor for actor in actors}
+
+        # Long display names would not fit the columns, they are truncated like in migration 0014.
+        keys = {(email, name): (email[:254], name[:254]) for email, name in actors}
+
+        sender_emails = {email for email, name in keys.values()}
+
+        def retrieve_senders():
+            return {(sender.email, sender.name): sender
+                    for sender in self.user.senders.filter(email__in=sender_emails)}
+
+        senders = retrieve_senders()
+        missing_senders = {keys[actor_key]: Sender(user=self.user, email=email, name=name,
+                                                   domain=actors[actor_key]['domain'][:254])
+                           for actor_key, (email, name) in keys.items() if (email, name) not in senders}
+
+        if missing_senders:
+            Sender.objects.bulk_create(list(missing_senders.values()), ignore_conflicts=True)
+            senders = retrieve_senders()
+
+        return {actor_key: senders[key] for actor_key, key in keys.items()}
+
+    def advance_latest_email(self, email, email_pks):
+        """
+        Point the `LatestEmail` of the user to the given email in case it is newer.
+
+        :param email: The newest of the stored `Email` instances.
+        :param email_pks: A dict of the stored email primary keys by their GMail id.
+        """
+        if self.last_saved_email and self.last_saved_email.date >= email.date:
+            return
+
+        email.pk = email_pks[email.google_id]
+        LatestEmail.objects.update_or_create(user=self.user, defaults={'email': email})
+        self.last_saved_email = email
+
+    def get_senders(self, emails):
+        """
+        :param emails: A queryset of the user emails.
+
+        :return: A tuple with the set of sender email addresses and the set of sender domains of the emails.
+        """
+        senders = set(emails.values_list('sender__email', 'sender__domain').distinct())
+
+        return {sender_email for sender_email, sender_domain in senders}, \
+            {sender_domain for sender_email, sender_domain in senders}
+
+    def update_sender_rollups(self, sender_emails=None, sender_domains=None):
+        """
+        Recompute the sender rollups out of the local unread emails in the inbox.
+
+        Only the rollups of the given senders and domains are recomputed, out
+        of their own emails, all of them in case none is given.
+
+        :param sender_emails: (Optional) The email addresses of the senders.
+        :param sender_domains: (Optional) The domains of the senders.
+        """
+        unread_emails = self.user.emails\
+            .filter(labels__google_id=LABEL_UNREAD)\
+            .filter(labels__google_id=LABEL_INBOX)
+
+        updates = []
+        for kind, field, keys in [(ROLLUP_SENDER, 'sender__email', sender_emails),
+                                  (ROLLUP_DOMAIN, 'sender__domain', sender_domains)]:
+            rollups = self.user.sender_rollups.filter(kind=kind)
+            emails = unread_emails.exclude(**{field: ''})
+
+            if keys is not None:
+                keys = set(keys) - {''}
+                if not keys:
+                    continue
+
+                rollups = rollups.filter(key__in=keys)
+                emails = emails.filter(**{field + '__in': keys})
+
+            updates.append((kind, field, rollups, emails))
+
+        if not updates:
+            return
+
+        with transaction.atomic():
+            # Concurrent refreshes of the same user would otherwise insert the same rollups twice.
+            User.objects.select_for_update().get(pk=self.user.pk)
+
+            for kind, field, rollups, emails in updates:
+                rollups.delete()
+
+                rows = emails.order_by('-date')\
+                    .values_list(field, 'sender__name', 'subject', 'date', 'list_unsubscribe')
+                SenderRollup.objects.bulk_create(self.build_sender_rollups(kind, rows))
+
+    def build_sender_rollups(self, kind, rows):
+        """
+        Aggregate emails into sender rollups.
+
+        :param {str} kind: The kind of the rollups, by sender or by domain.
+        :param rows: Tuples with the key, sender name, subject, date and unsubscribe
+                     link of the emails, the most recent emails first.
+
+        :return: A list of unsaved `SenderRollup` instances.
+        """
+        nr_of_subjects = settings.GOOGLE_AUTH_SETTINGS['SENDER_ROLLUP_SUBJECTS']
+        rollups = {}
+        subjects = {}
+
+        for key, name, subject, date, list_unsubscribe in rows:
+            if key not in rollups:
+                rollups[key] = SenderRollup(user=self.user,
+                                            kind=kind,
+                                            key=key,
+                                            name=name if kind == ROLLUP_SENDER else '',
+                                            nr_of_unread_emails=0,
+                                            latest_date=date)
+                subjects[key] = []
+
+            rollups[key].nr_of_unread_emails += 1
+            rollups[key].has_unsubscribe = rollups[key].has_unsubscribe or bool(list_unsubscribe)
+            if len(subjects[key]) < nr_of_subjects:
+                subjects[key].append(subject)
+
+        for key, rollup in rollups.items():
+            rollup.sample_subjects = json.dumps(subjects[key])
+
+        return list(rollups.values())
+
+    def get_local_unread_emails(self):
+        """
+        Retrieve the unread emails in the inbox from the database.
+
+        :return: A list of dicts with email details, in the same format as the
+                 ones built from GMail API responses.
+        """
+        emails = self.get_local_unread_emails_queryset()\
+            .select_related('sender')\
+            .prefetch_related('labels')\
+            .order_by('-date')
+
+        return [self.email_to_dict(email, email.google_id in self.locked_ids) for email in emails]
+
+    def get_local_unread_emails_queryset(self):
+        """
+        :return: The queryset of the unread emails in the inbox of the user.
+        """
+        return self.user.emails\
+            .filter(labels__google_id=LABEL_UNREAD)\
+            .filter(labels__google_id=LABEL_INBOX)
+
+    def email_to_dict(self, email, locked=False):
+        """
+        Build a dict with email details from an Email instance.
+
+        :param email: The `Email` instance.
+        :param {bool} locked: Whether the email was locked by the user.
+
+        :return: The dict with email details.
+        """
+        return {
+            'locked': locked,
+            'google_id': email.google_id,
+            'thread_id': email.thread_id,
+            'labels': [self.serialized_labels[label.google_id] for label in email.labels.all()
+                       if label.google_id in self.serialized_labels],
+            'snippet': email.snippet,
+            'date': email.date,
+            'delivered_to': email.delivered_to,
+            'subject': email.subject,
+            'sender': email.sender.to_actor(),
+            'receiver': email.receiver,
+            'list_unsubscribe': email.list_unsubscribe
+        }
 
     def gmail_service_batch_callback(self, request_id, response, exception):
         """
@@ -235,31 +1405,29 @@ class EmailService(object):
         In case no exception have occurred, save the email in the database,
         otherwise handle the exception.
 
-        :param request_id: A unique identifier for the request in the batch,
-                           generated automatically.
+        :param request_id: The GMail id of the requested email.
         :param {dict} response: A deserialized email object from the API response.
         :param exception: A `googleapiclient.errors.HttpError` instance or None
 
         :return: The created email instance or None
         """
         if exception:
-            if exception.resp.status in [403, 429]:
-                self.failed_requests[request_id] = self.email_ids[int(request_id) - 1]
+            if exception.resp.status in RETRYABLE_STATUSES:
+                self.failed_requests[request_id] = {'id': request_id}
+
+                retry_after = get_retry_after(exception)
+                if retry_after is not None:
+                    self.retry_after = max(retry_after, self.retry_after or 0)
 
         else:
             email_dict = GMailEmailParser.parse(response, self.user)
 
             # Add "locked" attribute in case the email was previously locked in by the user.
-            try:
-                locked_email = LockedEmail.objects.get(user=self.user, google_id=email_dict['google_id'])
-                email_dict['locked'] = locked_email.locked
-            except LockedEmail.DoesNotExist:
-                email_dict['locked'] = False
+            email_dict['locked'] = email_dict['google_id'] in self.locked_ids
 
             # Update labels in case there are new ones
-            user_labels = Label.objects.filter(user=self.user).values_list('google_id', flat=True)
-            if not set(email_dict['labels']).issubset(set(user_labels)):
-                self.update_labels()
+            if not set(email_dict['labels']).issubset(self.serialized_labels.keys()):
+                self.get_user_labels(email_dict['labels'])
 
             self._populate_with_serialized_labels(email_dict)
 
@@ -267,16 +1435,33 @@ class EmailService(object):
 
     def _handle_failed_requests(self):
         """
-        Check if there were failed requests in the batch and retry them with an
-        exponential backoff.
+        Retry the requests that failed in the batch with a jittered exponential backoff.
+
+        Only the failed email ids are requested again. Retries stop as soon as
+        all of them succeeded or the next retry would exceed `RETRY_DEADLINE`,
+        in which case the ids that could not be retrieved are kept in `gave_up_ids`.
         """
-        if not self.failed_requests or self.exponential_backoff_delay > self.max_backoff_delay:
-            return
+        scheduler = RetryScheduler(base_delay=settings.GOOGLE_AUTH_SETTINGS['RETRY_BASE_DELAY'],
+                                   max_delay=settings.GOOGLE_AUTH_SETTINGS['RETRY_MAX_DELAY'],
+                                   deadline=settings.GOOGLE_AUTH_SETTINGS['RETRY_DEADLINE'])
+
+        while self.failed_requests:
+            delay = scheduler.next_delay(self.retry_after)
+            if delay is None:
+                break
+
+            failed_emails = list(self.failed_requests.values())
+            self.failed_requests = {}
+            self.retry_after = None
 
-        sleep(self.exponential_backoff_delay)
-        self.exponential_backoff_delay *= 2
+            sleep(delay)
 
-        self.retrieve_unread_emails()
+            self.gmail_service.get_emails_details(failed_emails, self.gmail_service_batch_callback)
+
+        self.gave_up_ids = list(self.failed_requests)
+        if self.gave_up_ids:
+            logger.warning('Gave up retrieving %s emails for user %s: %s',
+                           len(self.gave_up_ids), self.user.pk, ', '.join(self.gave_up_ids))
 
     def _populate_with_serialized_labels(self, email_dict):
         """
@@ -286,13 +1471,8 @@ class EmailService(object):
 
         :return: The updated email instance.
         """
-        serialized_labels = []
-        for label_id in email_dict['labels']:
-            label = Label.objects.get(user=self.user, google_id=label_id)
-            serializer = self.email_label_serializer(label)
-            serialized_labels.append(serializer.data)
-
-        email_dict['labels'] = serialized_labels
+        email_dict['labels'] = [self.serialized_labels[label_id] for label_id in email_dict['labels']
+                                if label_id in self.serialized_labels]
 
     def assign_labels_to_email(self, email_dict):
         """
@@ -318,16 +1498,28 @@ class EmailService(object):
     def update_labels(self):
         """
         Retrieve a list of User's labels.
+
+        Existing labels are updated, so that changes of names and colors are
+        reflected, and the cached serialized labels are invalidated.
         """
         labels = self.gmail_service.list_user_labels()
 
         for label in labels:
-            Label.objects.get_or_create(user=self.user,
-                                        google_id=label['id'],
-                                        name=label['name'],
-                                        type=label['type'],
-                                        text_color=label.get('color', {}).get('textColor', ''),
-                                        background_color=label.get('color', {}).get('backgroundColor', ''))
+            color = label.get('color', {})
+            Label.objects.update_or_create(user=self.user,
+                                           google_id=label['id'],
+                                           defaults={
+                                               'name': label['name'],
+                                               'type': label['type'],
+                                               'text_color': color.get('textColor', ''),
+                                               'background_color': color.get('backgroundColor', '')
+                                           })
+
+        cache.delete(self.get_labels_cache_key())
+
+        self.labels_updated = True
+        self._user_labels = None
+        self._serialized_labels = None
 
     @staticmethod
     def create_email_from_dict(email_dict):
@@ -340,21 +1532,70 @@ class EmailService(object):
 
     def modify_emails(self, payload):
         """
-        Initiate a call to GMail API to change labels for the given emails.
+        Initiate calls to GMail API to change labels for the given emails.
+
+        Any amount of emails can be modified, see `GoogleAPIService.iter_batch_modify_emails()`.
 
         :param payload: A dict that has the "ids", "addLabelIds" and
                         "removeLabelIds" props, all lists with data to
                         be modified on GMail servers.
+
+        :return: A dict with the "modified_ids" and "failed_ids", in the order
+                 of the given ids, and the total number of "retries".
         """
-        errs = self.gmail_service.batch_modify_emails(payload)
+        modified_ids = set()
+        retries = 0
+
+        for chunk in self.iter_modify_emails(payload):
+            if chunk['modified']:
+                modified_ids.update(chunk['ids'])
+            retries += chunk['retries']
+
+        return {
+            'modified_ids': [google_id for google_id in payload['ids'] if google_id in modified_ids],
+            'failed_ids': [google_id for google_id in payload['ids'] if google_id not in modified_ids],
+            'retries': retries
+        }
+
+    def iter_modify_emails(self, payload):
+        """
+        Change labels for the given emails on GMail servers and reflect them locally, chunk by chunk.
+
+        Instead of "ids", the payload can have a "q" prop with a GMail search
+        query, in which case all the matching emails that are not locked by
+        the user are modified.
 
-        if not errs:
-            emails = self.user.emails.filter(google_id__in=payload['ids'])
-            add_labels = Label.objects.filter(user=self.user, google_id__in=payload['addLabelIds'])
-            remove_labels = Label.objects.filter(user=self.user, google_id__in=payload['removeLabelIds'])
-            for email in emails:
-                email.labels.add(*add_labels)
-                email.labels.remove(*remove_labels)
+        :param payload: A dict that has the "ids" (or "q"), "addLabelIds" and
+                        "removeLabelIds" props.
+
+        :return: A generator of the chunk outcomes of `GoogleAPIService.iter_batch_modify_emails()`.
+        """
+        if 'q' in payload:
+            chunks = self.gmail_service.iter_batch_modify_listed_emails(payload['q'],
+                                                                        payload['addLabelIds'],
+                                                                        payload['removeLabelIds'],
+                                                                        exclude_ids=self.locked_ids)
+        else:
+            chunks = self.gmail_service.iter_batch_modify_emails(payload)
+
+        for chunk in chunks:
+            if chunk['modified']:
+                self.reflect_modified_emails(dict(payload, ids=chunk['ids']))
+
+            yield chunk
+
+    def reflect_modified_emails(self, payload):
+        """
+        Reflect the labels modified on GMail servers on the local emails.
+
+        :param payload: The body of the successful batchModify request.
+        """
+        with transaction.atomic():
+            self.change_emails_labels({google_id: payload['addLabelIds'] for google_id in payload['ids']},
+                                      {google_id: payload['removeLabelIds'] for google_id in payload['ids']})
+            modified_emails = self.user.emails.filter(google_id__in=payload['ids'])
+            sender_emails, sender_domains = self.get_senders(modified_emails)
+            self.update_sender_rollups(sender_emails, sender_domains)
 
             # Create a ModifiedEmailBatch instance to keep track of user activity.
             if LABEL_TRASH in payload['addLabelIds']:
@@ -372,8 +1613,97 @@ class EmailService(object):
             ModifiedEmailBatch.objects.create(user=self.user,
                                               nr_of_emails=len(payload['ids']),
                                               action=action)
-        else:
-            return errs
+
+        cache.delete(self.get_unread_count_cache_key())
+
+    def run_modify_job(self, job):
+        """
+        Modify the emails of a job, saving its progress after every chunk.
+
+        Progress is only saved while the job is still running, so that a job
+        given up on as interrupted stays failed, and is not processed further.
+
+        :param job: The `ModifyEmailsJob` instance, already marked as running.
+        """
+        payload = json.loads(job.payload)
+        failed_ids = []
+
+        def save_job(**fields):
+            fields['updated_at'] = timezone.now()
+            if not ModifyEmailsJob.objects.filter(pk=job.pk, status=JOB_RUNNING).update(**fields):
+                logger.warning('Modify job %s is no longer running, stopping it', job.pk)
+                return False
+
+            for field, value in fields.items():
+                setattr(job, field, value)
+            return True
+
+        for chunk in self.iter_modify_emails(payload):
+            nr_of_emails = job.nr_of_emails
+            nr_of_modified_emails = job.nr_of_modified_emails
+
+            # The amount of emails matching a search query is only known once they are listed.
+            if 'q' in payload:
+                nr_of_emails += len(chunk['ids'])
+
+            if chunk['modified']:
+                nr_of_modified_emails += len(chunk['ids'])
+            else:
+                failed_ids.extend(chunk['ids'])
+
+            if not save_job(nr_of_emails=nr_of_emails,
+                            nr_of_modified_emails=nr_of_modified_emails,
+                            nr_of_retries=job.nr_of_retries + chunk['retries'],
+                            failed_ids=json.dumps(failed_ids)):
+                return
+
+        save_job(status=JOB_FAILED if failed_ids else JOB_DONE, finished_at=timezone.now())
+
+    def change_emails_labels(self, added_labels, removed_labels):
+        """
+        Add and remove labels of locally stored emails.
+
+        Label links are changed with set-based operations on the through
+        table, so the number of queries does not depend on the amount of
+        emails. Only labels that are known locally are taken into account.
+
+        :param added_labels: A dict of GMail label ids to add by email GMail id.
+        :param removed_labels: A dict of GMail label ids to remove by email GMail id.
+        """
+        email_pks = dict(self.user.emails.filter(google_id__in=set(added_labels) | set(removed_labels))
+                         .values_list('google_id', 'pk'))
+
+        def group_by_label(labels):
+            email_pks_by_label = {}
+            for google_id, label_ids in labels.items():
+                if google_id not in email_pks:
+                    continue
+                for label_id in label_ids:
+                    if label_id in self.user_labels:
+                        email_pks_by_label.setdefault(label_id, set()).add(email_pks[google_id])
+            return email_pks_by_label
+
+        added = group_by_label(added_labels)
+        removed = group_by_label(removed_labels)
+
+        EmailLabel = Email.labels.through
+
+        with transaction.atomic():
+            if removed:
+                condition = Q()
+                for label_id, pks in removed.items():
+                    condition |= Q(label_id=self.user_labels[label_id].pk, email_id__in=pks)
+                EmailLabel.objects.filter(condition).delete()
+
+            EmailLabel.objects.bulk_create([EmailLabel(email_id=pk, label_id=self.user_labels[label_id].pk)
+                                            for label_id, pks in added.items() for pk in pks],
+                                           ignore_conflicts=True)
+
+            for label_id, field in [(LABEL_STARRED, 'starred'), (LABEL_IMPORTANT, 'important')]:
+                if label_id in added:
+                    self.user.emails.filter(pk__in=added[label_id]).update(**{field: True})
+                if label_id in removed:
+                    self.user.emails.filter(pk__in=removed[label_id]).update(**{field: False})
 
     def lock_email(self, payload):
         """
@@ -385,3 +1715,5 @@ class EmailService(object):
                                                            thread_id=payload['thread_id'])
         email.locked = payload['locked']
         email.save()
+
+        self._locked_ids = None
@@ -0,0 +1,123 @@
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+_MISSING = object()
+
+
+class _Call(object):
+    """
+    A call in flight and its outcome, shared with the callers waiting for it.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exception = None
+
+    def wait(self):
+        self.done.wait()
+
+        if self.exception is not None:
+            raise self.exception
+
+        return self.result
+
+
+class SingleFlight(object):
+    """
+    Coalesce concurrent calls of the same operation into a single call.
+
+    Within a process, callers of a key that is already in flight wait for
+    the running call and share its result (or its exception). Across
+    processes, the call that holds the lock of the key in the cache runs
+    the operation and publishes its result in the cache for the callers of
+    the other processes, which poll for it. Callers that arrive once a call
+    completed run the operation again, results are not cached.
+
+    In case the call of another process fails or does not complete in time,
+    the waiting callers run the operation themselves.
+    """
+
+    def __init__(self, clock=time.monotonic, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """
+        Run the operation, unless an identical one is already in flight.
+
+        :param {str} key: The key that identifies identical operations.
+        :param {function} func: The operation, called without arguments.
+
+        :return: The result of the operation.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            return call.wait()
+
+        try:
+            call.result = self._do_shared(key, func)
+        except Exception as e:
+            call.exception = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+    def _do_shared(self, key, func):
+        """
+        Run the operation, unless an identical one is already in flight in another process.
+        """
+        timeout = settings.GOOGLE_AUTH_SETTINGS['SINGLE_FLIGHT_TIMEOUT']
+        lock_key = 'singleflight:{}'.format(key)
+        token = uuid.uuid4().hex
+
+        if cache.add(lock_key, token, timeout):
+            try:
+                result = func()
+                cache.set(self.get_result_key(key, token), result, timeout)
+            finally:
+                cache.delete(lock_key)
+
+            return result
+
+        token = cache.get(lock_key)
+        deadline = self.clock() + timeout
+
+        while token is not None and self.clock() < deadline:
+            result = cache.get(self.get_result_key(key, token), _MISSING)
+            if result is not _MISSING:
+                return result
+
+            if cache.get(lock_key) != token:
+                # The call completed meanwhile, its result is published before the lock is released.
+                result = cache.get(self.get_result_key(key, token), _MISSING)
+                if result is not _MISSING:
+                    return result
+                break
+
+            self.sleep(settings.GOOGLE_AUTH_SETTINGS['SINGLE_FLIGHT_POLL_INTERVAL'])
+
+        return func()
+
+    @staticmethod
+    def get_result_key(key, token):
+        return 'singleflight:{}:result:{}'.format(key, token)
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,145 @@
+import queue
+import threading
+from contextlib import contextmanager
+
+import httplib2
+from django.conf import settings
+
+
+class HttpPoolExhausted(Exception):
+    """
+    Raised when no http connection could be acquired from the pool in time.
+    """
+
+
+class HttpPool(object):
+    """
+    A bounded pool of keep-alive `httplib2.Http` instances.
+
+    `httplib2.Http` keeps one open connection per host, but it is not safe
+    to share it between threads (or greenlets). The pool hands out every
+    instance to one request at a time, so connections to googleapis.com
+    are reused across requests instead of paying for a new TLS handshake
+    each time, while the pool size bounds the amount of simultaneously
+    open connections to a host.
+
+    The underlying queue is patched by gevent when the workers run under
+    gevent, so acquiring a connection only blocks the current greenlet.
+    """
+
+    def __init__(self, size, timeout=None, acquire_timeout=None):
+        self.size = size
+        self.timeout = timeout
+        self.acquire_timeout = acquire_timeout
+
+        # LIFO order hands out the most recently used (hence warm) connection first.
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def _create(self):
+        return httplib2.Http(timeout=self.timeout)
+
+    def acquire(self):
+        """
+        Take an `httplib2.Http` instance out of the pool.
+
+        A new instance is created in case there is no idle one and the pool
+        did not reach its size yet, otherwise wait for one to be released.
+
+        :return: An `httplib2.Http` instance.
+        """
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return self._create()
+
+        try:
+            return self._idle.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            raise HttpPoolExhausted('No http connection available after %s seconds.' % self.acquire_timeout)
+
+    def release(self, http):
+        """
+        Put a previously acquired `httplib2.Http` instance back in the pool.
+
+        :param http: The instance returned by `acquire()`.
+        """
+        self._idle.put_nowait(http)
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager that acquires an http instance and releases it on exit.
+
+        Connections that failed mid-request are closed, so the next user
+        of the instance reconnects instead of reusing a broken socket.
+        """
+        http = self.acquire()
+        try:
+            yield http
+        except Exception:
+            http.close()
+            raise
+        finally:
+            self.release(http)
+
+
+class PooledHttp(object):
+    """
+    An `httplib2.Http` like object that sends every request through a pooled instance.
+
+    It is meant to be wrapped by `google_auth_httplib2.AuthorizedHttp`, so each
+    user gets its own credentials while sharing the process-wide connections.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.follow_redirects = True
+        self.redirect_codes = httplib2.REDIRECT_CODES
+        self.connections = {}
+
+    @property
+    def timeout(self):
+        return self.pool.timeout
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=httplib2.DEFAULT_MAX_REDIRECTS, connection_type=None):
+        with self.pool.connection() as http:
+            return http.request(uri, method=method, body=body, headers=headers,
+                                redirections=redirections, connection_type=connection_type)
+
+    def close(self):
+        # The connections belong to the pool and outlive any single user of them.
+        pass
+
+
+_http_pool = None
+_http_pool_lock = threading.Lock()
+
+
+def get_http_pool():
+    """
+    Return the process-wide http pool, creating it on first use.
+
+    The pool is created lazily so that every (forked) worker process
+    gets its own connections.
+
+    :return: A `HttpPool` instance configured from `GOOGLE_AUTH_SETTINGS`.
+    """
+    global _http_pool
+
+    if _http_pool is None:
+        with _http_pool_lock:
+            if _http_pool is None:
+                config = settings.GOOGLE_AUTH_SETTINGS
+                _http_pool = HttpPool(size=config['HTTP_POOL_SIZE'],
+                                      timeout=config['HTTP_TIMEOUT'],
+                                      acquire_timeout=config['HTTP_POOL_ACQUIRE_TIMEOUT'])
+
+    return _http_pool
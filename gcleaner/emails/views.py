@@ -1,25 +1,154 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from itertools import chain
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from googleapiclient import errors
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.views import APIView
 
+from gcleaner.emails.jobs import enqueue_modify_job, fail_interrupted_jobs
 from gcleaner.emails.mixins import EmailMixin
+from gcleaner.emails.constants import ROLLUP_SENDER, SENDER_ROLLUP_KINDS
+from gcleaner.emails.models import ModifyEmailsJob
+from gcleaner.emails.renderers import NDJSONRenderer
+from gcleaner.emails.serializers import ModifyEmailsJobSerializer, SenderRollupSerializer
+from gcleaner.emails.services import GoogleAPIService
 
 
 class EmailListView(EmailMixin, APIView):
     """
     API view to list user emails.
+
+    Requests that accept `application/x-ndjson` get a streamed response with
+    one email per line, sent as soon as the email is retrieved.
+
+    Emails are served from the database once synchronized, the `Last-Modified`
+    header tells when they were synchronized and `X-Refreshing` whether a
+    refresh from GMail is in progress, so the list can be requested again
+    once it completes. While GMail is unavailable, the synchronized emails
+    are served with an `X-Stale: true` header.
+
+    Pass `?page_size=<n>` to get the emails page by page instead, following
+    the `next` link of every page, which holds an opaque cursor.
     """
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [NDJSONRenderer]
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
 
     def get(self, request):
         service = self.get_service()
 
+        query_params = request.query_params
+        if self.page_size_query_param in query_params or self.cursor_query_param in query_params:
+            return self.get_page(request, service)
+
+        if request.accepted_renderer.format == NDJSONRenderer.format:
+            return self.stream_emails(service)
+
         emails = service.retrieve_unread_emails()
 
-        return Response(data=emails)
+        return self.add_freshness_headers(Response(data=emails), service)
+
+    def get_page(self, request, service):
+        """
+        Build a response with a page of emails and the link to the next one.
+
+        :param request: The request.
+        :param service: The EmailService instance.
+
+        :return: A `Response` instance.
+        :raises: `ValidationError` in case the cursor is malformed or GMail rejects its page token.
+        """
+        page_size = self.get_page_size(request)
+        page_token = self.decode_cursor(request.query_params.get(self.cursor_query_param))
+
+        try:
+            emails, next_page_token = service.retrieve_unread_emails_page(page_size, page_token)
+        except errors.HttpError as error:
+            # GMail rejects page tokens of tampered cursors.
+            if page_token and error.resp.status == 400:
+                raise ValidationError({self.cursor_query_param: ['Invalid cursor.']})
+            raise
+
+        next_link = None
+        if next_page_token:
+            next_link = replace_query_param(request.build_absolute_uri(), self.cursor_query_param,
+                                            self.encode_cursor(next_page_token))
+
+        return self.add_freshness_headers(Response(data={'next': next_link, 'results': emails}), service)
+
+    def get_page_size(self, request):
+        """
+        :return: The requested page size, bounded by `LIST_MAX_PAGE_SIZE`.
+        """
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return settings.GOOGLE_AUTH_SETTINGS['LIST_PAGE_SIZE']
+
+        return min(max(page_size, 1), settings.GOOGLE_AUTH_SETTINGS['LIST_MAX_PAGE_SIZE'])
+
+    @staticmethod
+    def encode_cursor(page_token):
+        """
+        :return: The opaque cursor pointing to the given GMail page.
+        """
+        return urlsafe_b64encode(page_token.encode('utf-8')).decode('ascii')
+
+    @classmethod
+    def decode_cursor(cls, cursor):
+        """
+        :return: The GMail page token the cursor points to, None for the first page.
+        :raises: `ValidationError` in case the cursor is malformed.
+        """
+        if not cursor:
+            return None
+
+        try:
+            return urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        except (ValueError, UnicodeError):
+            raise ValidationError({cls.cursor_query_param: ['Invalid cursor.']})
+
+    def stream_emails(self, service):
+        """
+        Build a response that streams emails as newline delimited JSON.
+
+        The first email is retrieved before the response is returned, so that
+        errors such as revoked tokens still result in a proper API error.
+
+        :param service: The EmailService instance.
+
+        :return: A `StreamingHttpResponse` instance.
+        """
+        emails = service.iter_unread_emails()
+        first_email = next(emails, None)
+
+        if first_email is not None:
+            emails = chain([first_email], emails)
+
+        lines = (NDJSONRenderer.render_line(email) for email in emails)
+
+        response = StreamingHttpResponse(lines, content_type=NDJSONRenderer.media_type)
+
+        return self.add_freshness_headers(response, service)
 
 
 class EmailModifyView(EmailMixin, APIView):
     """
     API view to modify labels on user emails.
+
+    Responds with the ids of the emails that were modified, the ones that
+    could not be modified even after retries are left out.
+
+    Pass `?async=true` to modify the emails in the background instead, in
+    which case the created job is returned and its progress can be followed
+    through `ModifyEmailsJobView`.
     """
     http_method_names = ['put', 'options']
 
@@ -32,29 +161,112 @@ class EmailModifyView(EmailMixin, APIView):
             'removeLabelIds': request.data.get('removeLabelIds', [])
         }
 
-        errors = service.modify_emails(batch_body)
+        if request.query_params.get('async', '').lower() in ['1', 'true']:
+            job = enqueue_modify_job(service, batch_body)
+
+            return Response(data=ModifyEmailsJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+        result = service.modify_emails(batch_body)
+
+        return Response(data=result['modified_ids'])
 
-        if errors:
-            pass
-            # TODO handle errors
 
-        return Response(data=batch_body['ids'])
+class EmailCleanView(EmailMixin, APIView):
+    """
+    API view to modify labels on all the user emails matching a search.
+
+    The search is either a GMail search expression (`q`), the email address
+    of a `sender` or the `domain` of senders, or a combination of them. The
+    matching emails are listed and modified in the background, except the
+    ones locked by the user, and the created job is returned.
+    """
+    http_method_names = ['post', 'options']
+
+    def post(self, request):
+        query = GoogleAPIService.build_search_query(q=request.data.get('q', ''),
+                                                    sender=request.data.get('sender', ''),
+                                                    domain=request.data.get('domain', ''))
+
+        if not query:
+            data = {'detail': 'A search query, a sender or a domain is required.'}
+
+            return Response(data=data, status=status.HTTP_400_BAD_REQUEST)
+
+        batch_body = {
+            'q': query,
+            'addLabelIds': request.data.get('addLabelIds', []),
+            'removeLabelIds': request.data.get('removeLabelIds', [])
+        }
+
+        if not batch_body['addLabelIds'] and not batch_body['removeLabelIds']:
+            data = {'detail': 'Labels to add or to remove are required.'}
+
+            return Response(data=data, status=status.HTTP_400_BAD_REQUEST)
+
+        service = self.get_service()
+
+        job = enqueue_modify_job(service, batch_body)
+
+        return Response(data=ModifyEmailsJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
+class ModifyEmailsJobView(APIView):
+    """
+    API view to follow the progress of a modify job of the user.
+    """
+    def get(self, request, pk):
+        fail_interrupted_jobs(request.user)
+
+        job = get_object_or_404(ModifyEmailsJob, pk=pk, user=request.user)
+
+        return Response(data=ModifyEmailsJobSerializer(job).data)
+
+
+class SenderRollupListView(APIView):
+    """
+    API view to list the senders of the unread emails of the user, the most prolific first.
+
+    Pass `?group=domain` to group the unread emails by sender domain instead
+    of sender email address. Stats are read from the local rollups, which
+    are kept up to date whenever emails are synced or modified.
+    """
+    def get(self, request):
+        kind = request.query_params.get('group', ROLLUP_SENDER)
+
+        if kind not in dict(SENDER_ROLLUP_KINDS):
+            data = {'detail': 'Invalid group, expected one of: %s.' % ', '.join(dict(SENDER_ROLLUP_KINDS))}
+
+            return Response(data=data, status=status.HTTP_400_BAD_REQUEST)
+
+        rollups = request.user.sender_rollups\
+            .filter(kind=kind)\
+            .order_by('-nr_of_unread_emails', '-latest_date')
+
+        return Response(data=SenderRollupSerializer(rollups, many=True).data)
 
 
 class EmailStatsView(EmailMixin, APIView):
     """
     API view to get email stats for the user.
+
+    Pass `?exact=true` to count the listed unread emails instead of
+    relying on GMail label counters.
+
+    While GMail is unavailable, the synchronized unread emails are counted
+    and the response has an `X-Stale: true` header.
     """
     def get(self, request):
         service = self.get_service()
 
-        nr_of_emails = service.retrieve_nr_of_unread_emails()
+        exact = request.query_params.get('exact', '').lower() in ['1', 'true']
+
+        nr_of_emails = service.retrieve_nr_of_unread_emails(exact=exact)
 
         data = {
             'unread': nr_of_emails['gmail']
         }
 
-        return Response(data=data)
+        return self.add_freshness_headers(Response(data=data), service)
 
 
 class EmailLockView(EmailMixin, APIView):
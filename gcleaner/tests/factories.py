@@ -22,6 +22,18 @@ class UserFactory(factory.django.DjangoModelFactory):
     is_staff = False
 
 
+class SenderFactory(factory.django.DjangoModelFactory):
+
+    class Meta:
+        model = 'emails.Sender'
+
+    user = factory.SubFactory(UserFactory)
+
+    email = factory.Sequence(lambda n: 'sender%s@email.com' % n)
+    name = factory.Sequence(lambda n: 'Sender %s' % n)
+    domain = 'email.com'
+
+
 class EmailFactory(factory.django.DjangoModelFactory):
 
     class Meta:
@@ -33,7 +45,7 @@ class EmailFactory(factory.django.DjangoModelFactory):
     thread_id = factory.Sequence(lambda n: 'thread_id_%d' % n)
     subject = factory.Sequence(lambda n: 'Subject %s' % n)
     snippet = factory.Sequence(lambda n: 'Snippet %s' % n)
-    sender = factory.Sequence(lambda n: 'Sender %s' % n)
+    sender = factory.SubFactory(SenderFactory, user=factory.SelfAttribute('..user'))
     receiver = factory.Sequence(lambda n: 'Receiver %s' % n)
     delivered_to = factory.Sequence(lambda n: 'Delivered to %s' % n)
     starred = False
@@ -1,9 +1,14 @@
 import mock
 from django.conf import settings
+from google.oauth2.credentials import Credentials
 from rest_framework import status
+from rest_framework.test import APIRequestFactory
+from rest_framework_jwt.utils import jwt_payload_handler, jwt_encode_handler
 
+from gcleaner.authentication.backends import JSONWebTokenAuthentication
 from gcleaner.authentication.google import Flow, obtain_google_oauth_credentials
 from gcleaner.authentication.jwt import JSONWebTokenAPIView
+from gcleaner.authentication.tokens import load_credentials
 
 AUTHORIZATION_CODE = 'auth-code'
 CREDENTIALS = {'foo': 'bar'}
@@ -46,15 +51,26 @@ def test_get_jwt_token_method(encode_mock, payload_mock, user, google_credential
     # assertions
     assert jwt_token == 1
     payload_mock.assert_called_once_with(user)
-    encode_mock.assert_called_once_with({
-        'user': user.pk,
-        'access_token': google_credentials.token,
-        'refresh_token': google_credentials.refresh_token
-    })
+    encode_mock.assert_called_once_with({'user': user.pk})
+    assert load_credentials(user).token == google_credentials.token
+    assert load_credentials(user).refresh_token == google_credentials.refresh_token
+
+
+def test_get_jwt_token_keeps_the_refresh_token_when_logging_in_again(user):
+    # test setup and mocking
+    view = JSONWebTokenAPIView()
+    view.get_jwt_token(user, Credentials('access_token', refresh_token='refresh_token'))
+
+    # method call
+    view.get_jwt_token(user, Credentials('new_access_token'))
+
+    # assertions
+    assert load_credentials(user).token == 'new_access_token'
+    assert load_credentials(user).refresh_token == 'refresh_token'
 
 
 @mock.patch('gcleaner.authentication.jwt.jwt_response_payload_handler')
-@mock.patch('gcleaner.authentication.jwt.build')
+@mock.patch('gcleaner.authentication.jwt.build_gmail_service')
 @mock.patch('gcleaner.authentication.jwt.obtain_google_oauth_credentials')
 def test_jwt_api_view_post(google_oauth_credentials_mock, build_mock, response_payload_mock, mocker, google_credentials, user):
     view = JSONWebTokenAPIView()
@@ -74,7 +90,7 @@ def test_jwt_api_view_post(google_oauth_credentials_mock, build_mock, response_p
     response = view.post(request)
 
     # assertions
-    build_mock.assert_called_once_with('gmail', 'v1', credentials=google_credentials)
+    build_mock.assert_called_once_with(google_credentials)
     service_mock.users.return_value.getProfile.assert_called_once_with(userId='me')
     view.get_jwt_token.assert_called_once_with(user, google_credentials)
     response_payload_mock.assert_called_once_with(jwt_token, user, request)
@@ -97,3 +113,19 @@ def test_jwt_user_did_not_allow_proper_scopes_to_modify_emails_returns_message(g
     # assertions
     assert response.status_code == status.HTTP_400_BAD_REQUEST
     assert response.data == {'message': 'It seems you did not give GCleaner permission to modify emails. Please try again.'}
+
+
+def test_jwt_authentication_keeps_decoded_payload_as_request_auth(user):
+    payload = jwt_payload_handler(user)
+    payload['access_token'] = 'access_token'
+    request = APIRequestFactory().get('/', HTTP_AUTHORIZATION='JWT {}'.format(jwt_encode_handler(payload)))
+
+    # method calls
+    authenticated_user, auth = JSONWebTokenAuthentication().authenticate(request)
+    no_auth = JSONWebTokenAuthentication().authenticate(APIRequestFactory().get('/'))
+
+    # assertions
+    assert authenticated_user == user
+    assert auth['access_token'] == 'access_token'
+    assert auth['username'] == user.username
+    assert no_auth is None
@@ -0,0 +1,191 @@
+import socket
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from gcleaner.emails.breaker import CircuitBreaker, CircuitOpenError, is_unavailable_error, CIRCUIT_CLOSED, \
+    CIRCUIT_OPEN
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def breaker_settings(settings):
+    settings.GOOGLE_AUTH_SETTINGS = dict(settings.GOOGLE_AUTH_SETTINGS,
+                                         CIRCUIT_BREAKER_WINDOW=30,
+                                         CIRCUIT_BREAKER_MIN_CALLS=4,
+                                         CIRCUIT_BREAKER_ERROR_RATE=0.5,
+                                         CIRCUIT_BREAKER_SLOW_CALL_DURATION=10,
+                                         CIRCUIT_BREAKER_OPEN_DURATION=30,
+                                         CIRCUIT_BREAKER_HALF_OPEN_CALLS=1)
+    return settings
+
+
+def server_error():
+    raise HttpError(httplib2.Response({'status': 503}), b'')
+
+
+def client_error():
+    raise HttpError(httplib2.Response({'status': 404}), b'')
+
+
+def call(breaker, func):
+    try:
+        return breaker.call(func)
+    except (HttpError, CircuitOpenError):
+        return None
+
+
+@pytest.mark.parametrize('exception, unavailable', [
+    (HttpError(httplib2.Response({'status': 500}), b''), True),
+    (HttpError(httplib2.Response({'status': 429}), b''), False),
+    (HttpError(httplib2.Response({'status': 404}), b''), False),
+    (socket.timeout(), True),
+    (ConnectionResetError(), True),
+    (CircuitOpenError(10), True),
+    (ValueError(), False),
+])
+def test_is_unavailable_error(exception, unavailable):
+    assert is_unavailable_error(exception) is unavailable
+
+
+def test_circuit_breaker_opens_once_most_recent_calls_failed(breaker_settings):
+    breaker = CircuitBreaker(clock=FakeClock())
+
+    # method calls
+    for func in [lambda: 'ok', server_error, lambda: 'ok']:
+        call(breaker, func)
+    state_before = breaker.state
+    call(breaker, server_error)
+
+    # assertions
+    assert state_before == CIRCUIT_CLOSED
+    assert breaker.state == CIRCUIT_OPEN
+    assert breaker.available() is False
+    with pytest.raises(CircuitOpenError) as exc_info:
+        breaker.call(lambda: 'ok')
+    assert exc_info.value.retry_after == 30
+
+
+def test_circuit_breaker_ignores_rejected_calls_and_old_failures(breaker_settings):
+    clock = FakeClock()
+    breaker = CircuitBreaker(clock=clock)
+    call(breaker, server_error)
+    call(breaker, server_error)
+    clock.now = 60
+
+    # method calls
+    for func in [client_error, client_error, server_error, lambda: 'ok']:
+        call(breaker, func)
+
+    # assertions
+    assert breaker.state == CIRCUIT_CLOSED
+
+
+def test_circuit_breaker_counts_slow_calls_as_failures(breaker_settings):
+    clock = FakeClock()
+    breaker = CircuitBreaker(clock=clock)
+
+    def slow_call():
+        clock.now += 10
+        return 'ok'
+
+    # method calls
+    results = [breaker.call(slow_call) for _ in range(4)]
+
+    # assertions
+    assert results == ['ok'] * 4
+    assert breaker.state == CIRCUIT_OPEN
+
+
+def test_circuit_breaker_closes_once_the_probe_succeeds(mocker, breaker_settings):
+    clock = FakeClock()
+    breaker = CircuitBreaker(clock=clock)
+    for _ in range(4):
+        call(breaker, server_error)
+    clock.now = 30
+    probe = mocker.Mock(return_value='ok')
+
+    # method calls
+    available = breaker.available()
+    result = breaker.call(probe)
+
+    # assertions
+    assert available is True
+    assert result == 'ok'
+    assert breaker.state == CIRCUIT_CLOSED
+
+
+def test_circuit_breaker_lets_a_single_probe_through(breaker_settings):
+    clock = FakeClock()
+    breaker = CircuitBreaker(clock=clock)
+    for _ in range(4):
+        call(breaker, server_error)
+    clock.now = 30
+    results = []
+
+    def probe():
+        results.append(call(breaker, lambda: 'concurrent'))
+        return 'probe'
+
+    # method call
+    result = breaker.call(probe)
+
+    # assertions
+    assert result == 'probe'
+    assert results == [None]
+    assert breaker.state == CIRCUIT_CLOSED
+
+
+def test_circuit_breaker_opens_again_once_the_probe_fails(breaker_settings):
+    clock = FakeClock()
+    breaker = CircuitBreaker(clock=clock)
+    for _ in range(4):
+        call(breaker, server_error)
+    clock.now = 30
+
+    # method call
+    call(breaker, server_error)
+
+    # assertions
+    assert breaker.state == CIRCUIT_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: 'ok')
+    clock.now = 60
+    assert breaker.available() is True
+
+
+def test_circuit_breaker_does_not_prepare_refused_calls(mocker, breaker_settings):
+    breaker = CircuitBreaker(clock=FakeClock())
+    for _ in range(4):
+        call(breaker, server_error)
+    prepare = mocker.Mock()
+
+    # method call
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: 'ok', prepare=prepare)
+
+    # assertions
+    prepare.assert_not_called()
+
+
+def test_circuit_breaker_does_not_time_the_preparation_of_calls(breaker_settings):
+    clock = FakeClock()
+    breaker = CircuitBreaker(clock=clock)
+
+    def prepare():
+        clock.now += 10
+
+    # method calls
+    results = [breaker.call(lambda: 'ok', prepare=prepare) for _ in range(4)]
+
+    # assertions
+    assert results == ['ok'] * 4
+    assert breaker.state == CIRCUIT_CLOSED
@@ -0,0 +1,21 @@
+from io import StringIO
+
+from django.core.management import call_command
+
+from gcleaner.emails.models import Email
+from gcleaner.users.models import User
+
+
+def test_benchmark_email_queries_explains_hot_queries_and_rolls_back_seeded_rows(db):
+    out = StringIO()
+
+    # command call
+    call_command('benchmark_email_queries', users=3, emails=40, senders=3, batch_size=15, stdout=out)
+
+    # assertions
+    output = out.getvalue()
+    assert 'Seeded 39 emails' in output
+    assert 'Local unread emails' in output
+    assert 'emails_email_user_date_idx' in output
+    assert not Email.objects.exists()
+    assert not User.objects.exists()
@@ -0,0 +1,53 @@
+import json
+
+import pytest
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import Resource
+
+from gcleaner.emails.gmail import GmailClientFactory, gmail_client_factory, build_gmail_service
+from gcleaner.emails.transport import PooledHttp, get_http_pool
+
+
+def test_gmail_client_factory_loads_discovery_document_only_once(mocker, google_credentials):
+    factory = GmailClientFactory()
+    json_load = mocker.patch('gcleaner.emails.gmail.json.load', wraps=json.load)
+
+    # method call
+    service_1 = factory.build(credentials=google_credentials)
+    service_2 = factory.build(credentials=google_credentials)
+
+    # assertions
+    assert json_load.call_count == 1
+    assert isinstance(service_1, Resource)
+    assert isinstance(service_2, Resource)
+    assert service_1 is not service_2
+
+
+def test_gmail_client_factory_binds_credentials_to_the_service(google_credentials):
+    service = gmail_client_factory.build(credentials=google_credentials)
+
+    assert isinstance(service._http, AuthorizedHttp)
+    assert service._http.credentials is google_credentials
+    assert service._baseUrl == 'https://www.googleapis.com/gmail/v1/users/'
+
+
+def test_gmail_client_factory_does_not_accept_both_credentials_and_http(mocker, google_credentials):
+    with pytest.raises(ValueError):
+        gmail_client_factory.build(credentials=google_credentials, http=mocker.Mock())
+
+
+def test_build_gmail_service_uses_the_process_wide_factory(mocker, google_credentials):
+    mocker.patch.object(gmail_client_factory, 'build')
+
+    # function call
+    build_gmail_service(google_credentials)
+
+    # assertions
+    gmail_client_factory.build.assert_called_once_with(credentials=google_credentials)
+
+
+def test_gmail_client_factory_authorizes_requests_over_pooled_connections(google_credentials):
+    service = gmail_client_factory.build(credentials=google_credentials)
+
+    assert isinstance(service._http.http, PooledHttp)
+    assert service._http.http.pool is get_http_pool()
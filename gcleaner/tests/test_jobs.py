@@ -0,0 +1,88 @@
+import datetime
+import json
+
+from django.utils import timezone
+
+from gcleaner.emails.constants import LABEL_INBOX, LABEL_TRASH, JOB_PENDING, JOB_RUNNING, JOB_DONE, JOB_FAILED
+from gcleaner.emails.jobs import enqueue_modify_job, run_modify_job, fail_interrupted_jobs
+from gcleaner.emails.models import ModifyEmailsJob
+from gcleaner.emails.services import EmailService
+
+PAYLOAD = {
+    'ids': ['a', 'b', 'c'],
+    'addLabelIds': [LABEL_TRASH],
+    'removeLabelIds': [LABEL_INBOX]
+}
+
+
+def test_enqueue_modify_job_submits_the_job_once_the_transaction_is_committed(mocker, user,
+                                                                              google_credentials):
+    # test setup and mocking
+    on_commit = mocker.patch('gcleaner.emails.jobs.transaction.on_commit')
+    submit = mocker.patch('gcleaner.emails.jobs.get_jobs_executor').return_value.submit
+    service = EmailService(credentials=google_credentials, user=user)
+
+    # method calls
+    job = enqueue_modify_job(service, PAYLOAD)
+    submit.assert_not_called()
+    on_commit.call_args[0][0]()
+
+    # assertions
+    assert job.status == JOB_PENDING
+    assert job.nr_of_emails == 3
+    assert json.loads(job.payload) == PAYLOAD
+    submit.assert_called_once_with(run_modify_job, job.pk, google_credentials)
+
+
+def test_run_modify_job_processes_a_pending_job_only_once(mocker, user, google_credentials):
+    # test setup and mocking
+    run = mocker.patch.object(EmailService, 'run_modify_job')
+    mocker.patch('gcleaner.emails.jobs.connections')
+    job = ModifyEmailsJob.objects.create(user=user, payload=json.dumps(PAYLOAD), nr_of_emails=3)
+
+    # method calls
+    run_modify_job(job.pk, google_credentials)
+    run_modify_job(job.pk, google_credentials)
+
+    # assertions
+    run.assert_called_once()
+    assert run.call_args[0][0].pk == job.pk
+    assert ModifyEmailsJob.objects.get(pk=job.pk).status == JOB_RUNNING
+
+
+def test_run_modify_job_marks_the_job_as_failed_on_unexpected_errors(mocker, user, google_credentials):
+    # test setup and mocking
+    mocker.patch.object(EmailService, 'run_modify_job', side_effect=ValueError())
+    connections = mocker.patch('gcleaner.emails.jobs.connections')
+    job = ModifyEmailsJob.objects.create(user=user, payload=json.dumps(PAYLOAD), nr_of_emails=3)
+
+    # method call
+    run_modify_job(job.pk, google_credentials)
+
+    # assertions
+    job.refresh_from_db()
+    assert job.status == JOB_FAILED
+    assert job.finished_at is not None
+    connections.close_all.assert_called_once_with()
+
+
+def test_fail_interrupted_jobs_only_fails_unfinished_jobs_that_stopped_progressing(settings, user):
+    # test setup and mocking
+    timeout = settings.GOOGLE_AUTH_SETTINGS['MODIFY_JOB_TIMEOUT']
+    stopped_at = timezone.now() - datetime.timedelta(seconds=timeout + 1)
+    interrupted_job = ModifyEmailsJob.objects.create(user=user, payload='{}', nr_of_emails=3,
+                                                     status=JOB_RUNNING)
+    done_job = ModifyEmailsJob.objects.create(user=user, payload='{}', nr_of_emails=3, status=JOB_DONE)
+    queued_job = ModifyEmailsJob.objects.create(user=user, payload='{}', nr_of_emails=3, status=JOB_PENDING)
+    running_job = ModifyEmailsJob.objects.create(user=user, payload='{}', nr_of_emails=3, status=JOB_RUNNING)
+    ModifyEmailsJob.objects.filter(pk__in=[interrupted_job.pk, done_job.pk, queued_job.pk])\
+        .update(updated_at=stopped_at)
+
+    # function call
+    fail_interrupted_jobs(user)
+
+    # assertions
+    assert ModifyEmailsJob.objects.get(pk=interrupted_job.pk).status == JOB_FAILED
+    assert ModifyEmailsJob.objects.get(pk=done_job.pk).status == JOB_DONE
+    assert ModifyEmailsJob.objects.get(pk=queued_job.pk).status == JOB_PENDING
+    assert ModifyEmailsJob.objects.get(pk=running_job.pk).status == JOB_RUNNING
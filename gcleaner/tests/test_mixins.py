@@ -6,6 +6,7 @@ from rest_framework.response import Response
 from rest_framework.test import APIRequestFactory
 from rest_framework_jwt.utils import jwt_payload_handler, jwt_encode_handler
 
+from gcleaner.emails.breaker import CircuitOpenError
 from gcleaner.emails.mixins import EmailMixin, emails_exception_handler
 from gcleaner.emails.services import EmailService
 from gcleaner.users.models import User
@@ -89,3 +90,46 @@ def test_exception_handler_handles_google_token_expired_error():
     assert isinstance(response, Response)
     assert response.data == {'detail': 'Token revoked.'}
     assert response.status_code == 401
+
+
+def test_api_jwt_decoder_mixin_reuses_payload_decoded_by_authentication(mocker):
+    rf = APIRequestFactory()
+    request = rf.get('/', HTTP_AUTHORIZATION='JWT {}'.format(JWT_TOKEN))
+    request.auth = PAYLOAD
+    decode = mocker.patch('gcleaner.utils.mixins.jwt_decode_handler')
+    instance = APIJWTDecoderMixin()
+
+    # method call
+    credentials = instance.get_google_credentials(request)
+
+    # assertions
+    decode.assert_not_called()
+    assert credentials.token == ACCESS_TOKEN
+    assert credentials.refresh_token == REFRESH_TOKEN
+
+
+def test_api_jwt_decoder_mixin_reads_credentials_of_authenticated_user_from_token_store(mocker, user):
+    rf = APIRequestFactory()
+    request = rf.get('/', HTTP_AUTHORIZATION='JWT {}'.format(JWT_TOKEN))
+    request.auth = jwt_payload_handler(user)
+    request.user = user
+    get_user_credentials = mocker.patch('gcleaner.utils.mixins.get_user_credentials')
+    instance = APIJWTDecoderMixin()
+
+    # method call
+    credentials = instance.get_google_credentials(request)
+
+    # assertions
+    get_user_credentials.assert_called_once_with(user, request.auth)
+    assert credentials == get_user_credentials.return_value
+
+
+def test_emails_exception_handler_handles_gmail_outages():
+    # function call
+    response = emails_exception_handler(CircuitOpenError(12.5), {})
+
+    # assertions
+    assert isinstance(response, Response)
+    assert response.data == {'detail': 'GMail is unavailable.'}
+    assert response.status_code == 503
+    assert response['Retry-After'] == '13'
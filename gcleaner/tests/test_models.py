@@ -1,7 +1,7 @@
 import datetime
 
 from gcleaner.emails.constants import LABEL_INBOX
-from gcleaner.emails.models import Email, Label
+from gcleaner.emails.models import Email, Label, Sender
 from gcleaner.users.models import User
 
 
@@ -20,7 +20,7 @@ def test_email_model_from_dict(user, label_inbox, label_unread):
         'thread_id': 't123',
         'subject': 'Subject',
         'snippet': 'Snippet',
-        'sender': 'Sender',
+        'sender': {'name': 'Sender', 'email': 'sender@email.com', 'domain': 'email.com'},
         'receiver': 'Receiver',
         'delivered_to': 'Delivered To',
         'starred': True,
@@ -35,7 +35,7 @@ def test_email_model_from_dict(user, label_inbox, label_unread):
     assert email.thread_id == 't123'
     assert email.subject == 'Subject'
     assert email.snippet == 'Snippet'
-    assert email.sender == 'Sender'
+    assert email.sender.to_actor() == {'name': 'Sender', 'email': 'sender@email.com', 'domain': 'email.com'}
     assert email.receiver == 'Receiver'
     assert email.delivered_to == 'Delivered To'
     assert email.starred is True
@@ -62,7 +62,7 @@ def test_email_model_from_dict_with_missing_boolean_props(user, label_inbox, lab
         'thread_id': 't123',
         'subject': 'Subject',
         'snippet': 'Snippet',
-        'sender': 'Sender',
+        'sender': {'name': 'Sender', 'email': 'sender@email.com', 'domain': 'email.com'},
         'receiver': 'Receiver',
         'delivered_to': 'Delivered To',
         'date': datetime.datetime(2019, 3, 19, 10, 31, 21, tzinfo=datetime.timezone.utc),
@@ -75,7 +75,7 @@ def test_email_model_from_dict_with_missing_boolean_props(user, label_inbox, lab
     assert email.thread_id == 't123'
     assert email.subject == 'Subject'
     assert email.snippet == 'Snippet'
-    assert email.sender == 'Sender'
+    assert email.sender.to_actor() == {'name': 'Sender', 'email': 'sender@email.com', 'domain': 'email.com'}
     assert email.receiver == 'Receiver'
     assert email.delivered_to == 'Delivered To'
     assert email.starred is False
@@ -94,6 +94,24 @@ def test_email_model_from_dict_with_missing_boolean_props(user, label_inbox, lab
     ]
 
 
+def test_email_model_from_dict_reuses_existing_sender(user, sender, label_inbox):
+    email = Email.from_dict({
+        'user': user.pk,
+        'labels': [label_inbox.google_id],
+        'google_id': 'a123',
+        'thread_id': 't123',
+        'subject': 'Subject',
+        'snippet': 'Snippet',
+        'sender': sender.to_actor(),
+        'receiver': 'Receiver',
+        'delivered_to': 'Delivered To',
+        'date': datetime.datetime(2019, 3, 19, 10, 31, 21, tzinfo=datetime.timezone.utc)
+    })
+
+    assert email.sender == sender
+    assert Sender.objects.filter(user=user).count() == 1
+
+
 def test_label_creation_of_system_type(user):
     label = Label.objects.create(user=user,
                                  google_id=LABEL_INBOX,
@@ -168,3 +168,17 @@ def test_parser_correctly_parse_email_sender_actor_when_it_has_quotation_marks_a
 
     # assertions
     assert parsed == expected
+
+
+def test_parser_formats_actor_back_into_actor_string():
+    assert GMailEmailParser.format_actor({'name': 'Google', 'email': 'no-reply@google.com'}) == \
+        'Google <no-reply@google.com>'
+    assert GMailEmailParser.format_actor({'name': 'me@email.com', 'email': 'me@email.com'}) == 'me@email.com'
+
+
+def test_parser_shares_parsed_sender_actor_between_emails_of_the_same_sender(user, gmail_api_get_1_response):
+    email_1 = GMailEmailParser.parse(gmail_api_get_1_response, user)
+    email_2 = GMailEmailParser.parse(dict(gmail_api_get_1_response, id='b1'), user)
+
+    assert email_1['sender'] is email_2['sender']
+    assert email_1['sender'] == GMailEmailParser.parse_actor(GMailEmailParser.format_actor(email_1['sender']))
@@ -0,0 +1,163 @@
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from gcleaner.emails.breaker import CircuitOpenError
+from gcleaner.emails.ratelimit import LocalTokenBuckets, QuotaRateLimiter
+from gcleaner.emails.services import GoogleAPIService
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def quota_settings(settings):
+    settings.GOOGLE_AUTH_SETTINGS = dict(settings.GOOGLE_AUTH_SETTINGS,
+                                         USER_QUOTA_RATE=250,
+                                         USER_QUOTA_BURST=250,
+                                         PROJECT_QUOTA_RATE=1000,
+                                         PROJECT_QUOTA_BURST=1000,
+                                         QUOTA_MAX_WAIT=10)
+    return settings
+
+
+def test_local_token_buckets_borrow_the_missing_units():
+    clock = FakeClock()
+    buckets = LocalTokenBuckets(clock=clock)
+
+    # method calls
+    within_burst = buckets.reserve('user:1', 200, rate=250, capacity=250)
+    borrowed = buckets.reserve('user:1', 100, rate=250, capacity=250)
+    clock.now = 1
+    regained = buckets.reserve('user:1', 50, rate=250, capacity=250)
+
+    # assertions
+    assert within_burst == 0
+    assert borrowed == pytest.approx(50 / 250)
+    assert regained == 0
+
+
+def test_local_token_buckets_do_not_exceed_their_capacity():
+    clock = FakeClock()
+    buckets = LocalTokenBuckets(clock=clock)
+    buckets.reserve('user:1', 50, rate=250, capacity=250)
+    clock.now = 60
+
+    # method calls
+    delay = buckets.reserve('user:1', 300, rate=250, capacity=250)
+
+    # assertions
+    assert delay == pytest.approx(50 / 250)
+
+
+def test_local_token_buckets_are_independent():
+    buckets = LocalTokenBuckets(clock=FakeClock())
+    buckets.reserve('user:1', 250, rate=250, capacity=250)
+
+    # method call
+    delay = buckets.reserve('user:2', 250, rate=250, capacity=250)
+
+    # assertions
+    assert delay == 0
+
+
+def test_quota_rate_limiter_waits_for_the_user_quota(mocker, quota_settings):
+    sleep = mocker.Mock()
+    limiter = QuotaRateLimiter(LocalTokenBuckets(clock=FakeClock()), sleep=sleep)
+
+    # method calls
+    limiter.acquire('1', 250)
+    delay = limiter.acquire('1', 50)
+
+    # assertions
+    assert delay == pytest.approx(50 / 250)
+    sleep.assert_called_once_with(delay)
+
+
+def test_quota_rate_limiter_charges_only_the_project_without_user(mocker, quota_settings):
+    buckets = mocker.Mock(reserve=mocker.Mock(return_value=0))
+    sleep = mocker.Mock()
+    limiter = QuotaRateLimiter(buckets, sleep=sleep)
+
+    # method call
+    limiter.acquire(None, 5)
+
+    # assertions
+    buckets.reserve.assert_called_once_with('gmail:project', 5, 1000, 1000)
+    sleep.assert_not_called()
+
+
+def test_quota_rate_limiter_bounds_the_wait(mocker, quota_settings):
+    buckets = mocker.Mock(reserve=mocker.Mock(return_value=60))
+    sleep = mocker.Mock()
+    limiter = QuotaRateLimiter(buckets, sleep=sleep)
+
+    # method call
+    delay = limiter.acquire('1', 50)
+
+    # assertions
+    assert delay == 10
+    sleep.assert_called_once_with(10)
+
+
+def test_quota_rate_limiter_lets_calls_through_when_buckets_fail(mocker, quota_settings):
+    buckets = mocker.Mock(reserve=mocker.Mock(side_effect=ConnectionError()))
+    sleep = mocker.Mock()
+    limiter = QuotaRateLimiter(buckets, sleep=sleep)
+
+    # method call
+    delay = limiter.acquire('1', 50)
+
+    # assertions
+    assert delay == 0
+    sleep.assert_not_called()
+
+
+def test_google_api_service_charges_the_units_of_each_batched_request(mocker, google_credentials):
+    acquire = mocker.patch('gcleaner.emails.services.get_rate_limiter').return_value.acquire
+    google_api_service = GoogleAPIService(google_credentials, user_id='1')
+    mocker.patch.object(google_api_service, 'service')
+
+    # method call
+    google_api_service._fetch_details_batch([{'id': 'a123'}, {'id': 'b123'}, {'id': 'c123'}])
+
+    # assertions
+    acquire.assert_called_once_with('1', 15)
+
+
+def test_google_api_service_charges_batch_modify_requests(mocker, google_credentials):
+    acquire = mocker.patch('gcleaner.emails.services.get_rate_limiter').return_value.acquire
+    google_api_service = GoogleAPIService(google_credentials, user_id='1')
+    mocker.patch.object(google_api_service, 'service')
+
+    # method call
+    google_api_service.batch_modify_emails({'ids': ['a123'], 'addLabelIds': [], 'removeLabelIds': ['UNREAD']})
+
+    # assertions
+    acquire.assert_called_once_with('1', 50)
+
+
+def test_google_api_service_does_not_charge_while_the_circuit_is_open(mocker, settings, circuit_breaker,
+                                                                      google_credentials):
+    settings.GOOGLE_AUTH_SETTINGS = dict(settings.GOOGLE_AUTH_SETTINGS, CIRCUIT_BREAKER_MIN_CALLS=1)
+    with pytest.raises(HttpError):
+        circuit_breaker.call(mocker.Mock(side_effect=HttpError(httplib2.Response({'status': 503}), b'')))
+    acquire = mocker.patch('gcleaner.emails.services.get_rate_limiter').return_value.acquire
+    google_api_service = GoogleAPIService(google_credentials, user_id='1')
+    mocker.patch.object(google_api_service, 'service')
+
+    body = {'ids': ['a123'], 'addLabelIds': [], 'removeLabelIds': ['UNREAD']}
+
+    # method call
+    with pytest.raises(CircuitOpenError):
+        google_api_service.batch_modify_emails(body)
+
+    # assertions
+    acquire.assert_not_called()
+    google_api_service.service.users.return_value.messages.return_value.batchModify.return_value.execute \
+        .assert_not_called()
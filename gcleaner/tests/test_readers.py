@@ -0,0 +1,25 @@
+import json
+import os
+
+from gcleaner.utils import readers
+from gcleaner.utils.readers import get_credentials_config_json
+
+
+def test_get_credentials_config_json_reads_file_again_only_once_it_changes(mocker, settings, tmp_path):
+    # test setup and mocking
+    path = tmp_path / 'credentials.json'
+    path.write_text(json.dumps({'web': {'client_id': 'a'}}))
+    settings.GOOGLE_AUTH_SETTINGS = dict(settings.GOOGLE_AUTH_SETTINGS, CREDENTIALS=str(path))
+    json_load = mocker.patch.object(readers.json, 'load', wraps=json.load)
+
+    # function calls
+    config_1 = get_credentials_config_json()
+    config_2 = get_credentials_config_json()
+    path.write_text(json.dumps({'web': {'client_id': 'b'}}))
+    os.utime(str(path), ns=(0, os.stat(str(path)).st_mtime_ns + 1))
+    config_3 = get_credentials_config_json()
+
+    # assertions
+    assert config_1 == config_2 == {'client_id': 'a'}
+    assert config_3 == {'client_id': 'b'}
+    assert json_load.call_count == 2
@@ -0,0 +1,48 @@
+import datetime
+from email.utils import format_datetime
+
+import httplib2
+from django.utils import timezone
+from googleapiclient.errors import HttpError
+
+from gcleaner.emails.retry import RetryScheduler, get_retry_after
+
+
+def test_retry_scheduler_delays_grow_exponentially_up_to_max_delay():
+    scheduler = RetryScheduler(base_delay=1, max_delay=4, deadline=100, rand=lambda low, high: high)
+
+    delays = [scheduler.next_delay() for _ in range(4)]
+
+    assert delays == [1, 2, 4, 4]
+    assert scheduler.attempt == 4
+
+
+def test_retry_scheduler_prefers_longer_retry_after_delay():
+    scheduler = RetryScheduler(base_delay=1, max_delay=4, deadline=100, rand=lambda low, high: high)
+
+    assert scheduler.next_delay(retry_after=10) == 10
+    assert scheduler.next_delay(retry_after=1) == 2
+
+
+def test_retry_scheduler_stops_scheduling_once_the_deadline_would_be_exceeded():
+    now = [0]
+    scheduler = RetryScheduler(base_delay=1, max_delay=4, deadline=5, clock=lambda: now[0],
+                               rand=lambda low, high: high)
+
+    assert scheduler.next_delay() == 1
+    now[0] = 4.5
+    assert scheduler.next_delay() is None
+    assert scheduler.attempt == 1
+
+
+def test_get_retry_after_parses_seconds_and_http_dates():
+    in_a_minute = timezone.now() + datetime.timedelta(seconds=60)
+
+    seconds = get_retry_after(HttpError(httplib2.Response({'status': 429, 'retry-after': '7'}), b''))
+    date = get_retry_after(HttpError(httplib2.Response({'status': 429,
+                                                        'retry-after': format_datetime(in_a_minute)}), b''))
+    missing = get_retry_after(HttpError(httplib2.Response({'status': 429}), b''))
+
+    assert seconds == 7
+    assert 50 < date <= 60
+    assert missing is None
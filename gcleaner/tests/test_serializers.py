@@ -25,7 +25,7 @@ def test_email_serializer(email, label_unread, label_inbox):
         'thread_id': 't123',
         'subject': 'Subject',
         'snippet': 'Snippet',
-        'sender': 'Sender',
+        'sender': 'Sender <sender@email.com>',
         'receiver': 'Receiver',
         'delivered_to': 'Delivered To',
         'starred': False,
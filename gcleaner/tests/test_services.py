@@ -2,8 +2,11 @@ import datetime
 import json
 import os
 
+import httplib2
 import mock
 from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
 
 import pytest
 from google.oauth2.credentials import Credentials
@@ -12,11 +15,14 @@ from googleapiclient.errors import HttpError
 from googleapiclient.http import HttpMockSequence, HttpMock, RequestMockBuilder
 from mock import call
 
-from gcleaner.emails.constants import LABEL_UNREAD, LABEL_INBOX, LABEL_TRASH, ACTION_TRASH
-from gcleaner.emails.models import Label, LockedEmail, ModifiedEmailBatch
+from gcleaner.emails.breaker import CircuitOpenError
+from gcleaner.emails.constants import LABEL_UNREAD, LABEL_INBOX, LABEL_TRASH, ACTION_TRASH, JOB_RUNNING, \
+    JOB_FAILED, JOB_DONE, ROLLUP_SENDER, ROLLUP_DOMAIN
+from gcleaner.emails.models import Label, LockedEmail, ModifiedEmailBatch, SyncState, Email, LatestEmail, \
+    ModifyEmailsJob, Sender
 from gcleaner.emails.parsers import GMailEmailParser
 from gcleaner.emails.serializers import LabelSerializer
-from gcleaner.emails.services import GoogleAPIService, EmailService
+from gcleaner.emails.services import GoogleAPIService, EmailService, HistoryExpiredError
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
 
@@ -108,7 +114,7 @@ def test_google_resource_create_and_run_a_batch_api_call(mocker, google_credenti
     google_api_service.get_emails_details(emails, callback_stub)
 
     # assertions
-    google_api_service.service.new_batch_http_request.assert_called_once_with(callback=callback_stub)
+    google_api_service.service.new_batch_http_request.assert_called_once()
     calls = [
         call(userId='me',
              id='a1',
@@ -127,12 +133,57 @@ def test_google_resource_create_and_run_a_batch_api_call(mocker, google_credenti
         .get.assert_has_calls(calls)
 
     batch.add.assert_has_calls([
-        call(get_request_1),
-        call(get_request_2)
+        call(get_request_1, request_id='a1'),
+        call(get_request_2, request_id='a2')
     ])
     batch.execute.assert_called_once()
 
 
+class FakeBatch(object):
+    """
+    Minimal stand-in for `BatchHttpRequest` that answers every request with its id.
+    """
+    def __init__(self, callback):
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        for request_id, request in self.requests:
+            self.callback(request_id, {'id': request}, None)
+
+
+@pytest.mark.parametrize('concurrency', [1, 3])
+def test_google_resource_splits_emails_details_into_batches(mocker, settings, google_credentials,
+                                                            concurrency):
+    settings.GOOGLE_AUTH_SETTINGS = dict(settings.GOOGLE_AUTH_SETTINGS, BATCH_SIZE=2,
+                                         BATCH_CONCURRENCY=concurrency)
+    emails = [{'id': 'a1'}, {'id': 'a2'}, {'id': 'a3'}, {'id': 'a4'}, {'id': 'a5'}]
+    batches = []
+
+    def new_batch_http_request(callback):
+        batches.append(FakeBatch(callback))
+        return batches[-1]
+
+    callback_stub = mocker.stub(name='batch_callback')
+    google_api_service = GoogleAPIService(google_credentials)
+    google_api_service.service = mocker.Mock()
+    google_api_service.service.new_batch_http_request.side_effect = new_batch_http_request
+    google_api_service.service.users.return_value.messages.return_value.get.side_effect = \
+        lambda **kwargs: kwargs['id']
+
+    # method call
+    google_api_service.get_emails_details(emails, callback_stub)
+
+    # assertions
+    assert sorted(len(batch.requests) for batch in batches) == [1, 2, 2]
+    assert callback_stub.call_count == 5
+    callback_stub.assert_has_calls([call(email['id'], {'id': email['id']}, None) for email in emails],
+                                   any_order=True)
+
+
 def test_google_api_service_batch_modify_request(mocker, google_credentials, user):
     google_api_service = GoogleAPIService(credentials=google_credentials)
     google_api_service.service = mocker.Mock()
@@ -185,8 +236,8 @@ def test_email_service_initialization_when_no_latest_email_exists(user, google_c
     assert service.emails == []
     assert service.email_ids == []
     assert service.failed_requests == {}
-    assert service.exponential_backoff_delay == 1
-    assert service.max_backoff_delay == 16
+    assert service.retry_after is None
+    assert service.gave_up_ids == []
 
 
 def test_email_service_initialization_when_latest_email_exists(user, google_credentials, latest_email):
@@ -199,8 +250,8 @@ def test_email_service_initialization_when_latest_email_exists(user, google_cred
     assert service.emails == []
     assert service.email_ids == []
     assert service.failed_requests == {}
-    assert service.exponential_backoff_delay == 1
-    assert service.max_backoff_delay == 16
+    assert service.retry_after is None
+    assert service.gave_up_ids == []
 
 
 def test_email_service_get_date_to_retrieve_emails_returns_none_if_no_latest_email(user, google_credentials):
@@ -225,7 +276,7 @@ def test_email_service_retrieve_number_of_emails_a_user_has(mocker, user, google
     service.gmail_service.get_unread_emails_ids.return_value = gmail_api_list_response
 
     # method call
-    response = service.retrieve_nr_of_unread_emails()
+    response = service.retrieve_nr_of_unread_emails(exact=True)
 
     # assertions
     assert response['gmail'] == 3
@@ -233,6 +284,24 @@ def test_email_service_retrieve_number_of_emails_a_user_has(mocker, user, google
     service.gmail_service.get_unread_emails_ids.assert_called_once_with()
 
 
+def test_email_service_retrieve_number_of_emails_from_cached_label_counters(mocker, user, google_credentials):
+    cache.clear()
+    service = EmailService(credentials=google_credentials, user=user)
+    service.gmail_service = mocker.Mock()
+    service.gmail_service.get_label.return_value = {'id': LABEL_INBOX, 'messagesUnread': 2345,
+                                                    'threadsUnread': 2000}
+
+    # method calls
+    response = service.retrieve_nr_of_unread_emails()
+    cached_response = service.retrieve_nr_of_unread_emails()
+
+    # assertions
+    assert response == {'gmail': 2345}
+    assert cached_response == {'gmail': 2345}
+    service.gmail_service.get_label.assert_called_once_with(LABEL_INBOX)
+    service.gmail_service.get_unread_emails_ids.assert_not_called()
+
+
 @pytest.mark.skip(reason='Currently saving emails from GMail API is disabled on the backend')
 def test_email_service_retrieve_number_of_emails_a_user_has_when_there_are_existing_db_emails(mocker, latest_email, google_credentials, gmail_api_list_response):
     service = EmailService(credentials=google_credentials, user=latest_email.user)
@@ -254,6 +323,7 @@ def test_email_service_retrieve_user_emails_for_the_first_time(mocker, user, all
     service._handle_failed_requests = mocker.Mock()
     http = HttpMockSequence([
         ({'status': 200}, open(os.path.join(DATA_DIR, 'gmail.json'), 'rb').read()),
+        ({'status': 200}, json.dumps({'historyId': '1234'})),
         ({'status': 200}, json.dumps({'messages': gmail_api_list_response})),
         ({'status': 200, 'content-type': 'multipart/mixed; boundary=batch_ygSpAcfQXdA_AAfKEo9rkX4'}, gmail_batch_response),
     ])
@@ -268,8 +338,9 @@ def test_email_service_retrieve_user_emails_for_the_first_time(mocker, user, all
     emails = service.retrieve_unread_emails()
 
     # post call assertions
-    assert user.emails.all().count() == 0
-    assert hasattr(user, 'latest_email') is False
+    assert user.emails.all().count() == 3
+    assert user.sync_state.history_id == '1234'
+    assert user.latest_email.email.date == max(email['date'] for email in expected_emails)
     assert emails == expected_emails
     service._handle_failed_requests.assert_called_once_with()
 
@@ -280,6 +351,7 @@ def test_email_service_retrieve_user_emails_with_existing_locked_emails(mocker,
     service._handle_failed_requests = mocker.Mock()
     http = HttpMockSequence([
         ({'status': 200}, open(os.path.join(DATA_DIR, 'gmail.json'), 'rb').read()),
+        ({'status': 200}, json.dumps({'historyId': '1234'})),
         ({'status': 200}, json.dumps({'messages': gmail_api_list_response})),
         ({'status': 200, 'content-type': 'multipart/mixed; boundary=batch_ygSpAcfQXdA_AAfKEo9rkX4'}, gmail_batch_response),
     ])
@@ -296,71 +368,81 @@ def test_email_service_retrieve_user_emails_with_existing_locked_emails(mocker,
     emails = service.retrieve_unread_emails()
 
     # post call assertions
-    assert user.emails.all().count() == 0
-    assert hasattr(user, 'latest_email') is False
+    assert user.emails.all().count() == 3
+    assert user.sync_state.history_id == '1234'
+    assert user.latest_email.email.date == max(email['date'] for email in expected_emails)
     assert emails == expected_emails
     service._handle_failed_requests.assert_called_once_with()
 
 
-def test_email_service_retrieves_email_details_for_previously_failed_batch_requests(mocker, google_credentials, user):
+@mock.patch('gcleaner.emails.services.sleep')
+def test_email_service_handle_failed_requests_returns_if_no_failed_requests(sleep_mock, mocker, google_credentials, user):
     # test setup and mocking
     service = EmailService(credentials=google_credentials, user=user)
-    service.failed_requests = {'1': {'id': 'a'}}
     service.gmail_service = mocker.Mock()
 
     # method call
-    service.retrieve_unread_emails()
+    service._handle_failed_requests()
 
     # assertions
-    assert service.failed_requests == {}
-    service.gmail_service.get_emails_details.assert_called_once_with([{'id': 'a'}], service.gmail_service_batch_callback)
+    sleep_mock.assert_not_called()
+    service.gmail_service.get_emails_details.assert_not_called()
+    assert service.gave_up_ids == []
 
 
 @mock.patch('gcleaner.emails.services.sleep')
-def test_email_service_handle_failed_requests_returns_if_no_failed_requests(sleep_mock, mocker, google_credentials, user):
+def test_email_service_handle_failed_requests_retries_only_failed_emails(sleep_mock, mocker,
+                                                                         google_credentials, user):
     # test setup and mocking
     service = EmailService(credentials=google_credentials, user=user)
-    service.retrieve_unread_emails = mocker.Mock()
+    service.gmail_service = mocker.Mock()
+    service.failed_requests = {
+        'a': {'id': 'a'}
+    }
 
     # method call
     service._handle_failed_requests()
 
     # assertions
-    sleep_mock.assert_not_called()
-    service.retrieve_unread_emails.assert_not_called()
+    sleep_mock.assert_called_once()
+    service.gmail_service.get_emails_details.assert_called_once_with([{'id': 'a'}], service.gmail_service_batch_callback)
+    assert service.failed_requests == {}
+    assert service.gave_up_ids == []
 
 
 @mock.patch('gcleaner.emails.services.sleep')
-def test_email_service_handle_failed_requests_returns_if_backoff_delay_exceeded_max_value(sleep_mock, mocker, google_credentials, user):
+def test_email_service_handle_failed_requests_respects_retry_after(sleep_mock, mocker, settings,
+                                                                   google_credentials, user):
     # test setup and mocking
     service = EmailService(credentials=google_credentials, user=user)
-    service.retrieve_unread_emails = mocker.Mock()
-    service.max_backoff_delay = 32
+    service.gmail_service = mocker.Mock()
+    service.failed_requests = {'a': {'id': 'a'}}
+    service.retry_after = 5
 
     # method call
     service._handle_failed_requests()
 
     # assertions
-    sleep_mock.assert_not_called()
-    service.retrieve_unread_emails.assert_not_called()
+    assert sleep_mock.call_args[0][0] >= 5
 
 
 @mock.patch('gcleaner.emails.services.sleep')
-def test_email_service_handle_failed_requests_retrieve_email_details(sleep_mock, mocker, google_credentials, user):
+def test_email_service_handle_failed_requests_gives_up_after_deadline(sleep_mock, mocker, settings,
+                                                                      google_credentials, user):
     # test setup and mocking
+    settings.GOOGLE_AUTH_SETTINGS = dict(settings.GOOGLE_AUTH_SETTINGS, RETRY_DEADLINE=3)
     service = EmailService(credentials=google_credentials, user=user)
-    service.retrieve_unread_emails = mocker.Mock()
-    service.failed_requests = {
-        '1': {'id': 'a'}
-    }
+    service.gmail_service = mocker.Mock()
+    service.failed_requests = {'a': {'id': 'a'}, 'b': {'id': 'b'}}
+    service.retry_after = 10
 
     # method call
     service._handle_failed_requests()
 
     # assertions
-    assert service.exponential_backoff_delay == 2
-    sleep_mock.asser_called_once_with(1)
-    service.retrieve_unread_emails.assert_called_once_with()
+    sleep_mock.assert_not_called()
+    service.gmail_service.get_emails_details.assert_not_called()
+    assert service.gave_up_ids == ['a', 'b']
 
 
 @pytest.mark.skip(reason='Currently saving emails from GMail API is disabled on the backend')
@@ -394,15 +476,15 @@ def test_email_service_batch_callback_populate_failed_requests_on_429_error(mock
     service = EmailService(credentials=google_credentials, user=user)
     service.email_ids = [{'id': 'a'}]
     service._populate_with_serialized_labels = mocker.Mock()
-    exception = mocker.Mock()
-    exception.resp.status = 429
+    exception = HttpError(httplib2.Response({'status': 429, 'retry-after': '3'}), b'')
 
     # method call
-    service.gmail_service_batch_callback('1', None, exception)
+    service.gmail_service_batch_callback('a', None, exception)
 
     # assertions
     assert len(service.emails) == 0
-    assert service.failed_requests == {'1': {'id': 'a'}}
+    assert service.failed_requests == {'a': {'id': 'a'}}
+    assert service.retry_after == 3
     assert not service._populate_with_serialized_labels.called
 
 
@@ -415,11 +497,12 @@ def test_email_service_batch_callback_populate_failed_requests_on_403_error(mock
     exception.resp.status = 403
 
     # method call
-    service.gmail_service_batch_callback('1', None, exception)
+    service.gmail_service_batch_callback('a', None, exception)
 
     # assertions
     assert len(service.emails) == 0
-    assert service.failed_requests == {'1': {'id': 'a'}}
+    assert service.failed_requests == {'a': {'id': 'a'}}
+    assert service.retry_after is None
     assert not service._populate_with_serialized_labels.called
 
 
@@ -480,6 +563,7 @@ def test_email_service_automatically_updates_labels_from_api(user, all_labels, g
     ]
     http = HttpMockSequence([
         ({'status': 200}, open(os.path.join(DATA_DIR, 'gmail.json'), 'rb').read()),
+        ({'status': 200}, json.dumps({'historyId': '1234'})),
         ({'status': 200}, json.dumps({'messages': gmail_api_list_response})),
         ({'status': 200, 'content-type': 'multipart/mixed; boundary=batch_ygSpAcfQXdA_AAfKEo9rkX4'}, gmail_batch_response),
         ({'status': 200}, json.dumps({'labels': labels}))
@@ -539,8 +623,7 @@ def test_email_service_assign_labels_to_email(email, user, all_labels, google_cr
 def test_email_service_modify_emails(mocker, user, all_labels, google_credentials):
     # test setup and mocking
     service = EmailService(credentials=google_credentials, user=user)
-    service.gmail_service = mocker.Mock()
-    service.gmail_service.batch_modify_emails.return_value = None
+    mocker.patch.object(service.gmail_service, 'batch_modify_emails', return_value=None)
     payload = {
         'ids': ['a', 'b', 'c'],
         'addLabelIds': [LABEL_TRASH],
@@ -638,3 +721,839 @@ def test_email_service_lock_email_update_existing_locked_email(user, google_cred
     # assertions
     assert LockedEmail.objects.count() == 1
     assert locked_email.locked is False
+
+
+def test_google_api_service_list_history_raises_history_expired_on_404(mocker, google_credentials):
+    google_api_service = GoogleAPIService(google_credentials)
+    google_api_service.service = mocker.Mock()
+    history_list = google_api_service.service.users.return_value.history.return_value.list
+    history_list.return_value.execute.side_effect = HttpError(httplib2.Response({'status': 404}), b'')
+
+    with pytest.raises(HistoryExpiredError):
+        google_api_service.list_history('1234')
+
+
+def test_google_api_service_list_history_pages_through_history(mocker, google_credentials):
+    google_api_service = GoogleAPIService(google_credentials)
+    google_api_service.service = mocker.Mock()
+    history_list = google_api_service.service.users.return_value.history.return_value.list
+    history_list.return_value.execute.side_effect = [
+        {'history': [{'id': '1235'}], 'nextPageToken': 'page', 'historyId': '1240'},
+        {'history': [{'id': '1236'}], 'historyId': '1240'},
+    ]
+
+    # method call
+    history, history_id = google_api_service.list_history('1234')
+
+    # assertions
+    assert history == [{'id': '1235'}, {'id': '1236'}]
+    assert history_id == '1240'
+
+
+def test_email_service_applies_history_changes_since_last_sync(mocker, user, all_labels, sender, email,
+                                                               google_credentials, gmail_api_get_1_response):
+    # test setup and mocking
+    SyncState.objects.create(user=user, history_id='1234')
+    deleted_email = Email.objects.create(user=user, google_id='d123', thread_id='d123', subject='',
+                                         snippet='', sender=sender, receiver='', delivered_to='',
+                                         date=email.date)
+    service = EmailService(credentials=google_credentials, user=user)
+    service.gmail_service = mocker.Mock()
+    service.gmail_service.list_history.return_value = ([
+        {'messagesAdded': [{'message': {'id': gmail_api_get_1_response['id'],
+                                        'labelIds': [LABEL_UNREAD, LABEL_INBOX]}}]},
+        {'labelsRemoved': [{'message': {'id': email.google_id, 'labelIds': [LABEL_INBOX]},
+                            'labelIds': [LABEL_UNREAD]}]},
+        {'labelsAdded': [{'message': {'id': email.google_id, 'labelIds': [LABEL_INBOX, LABEL_TRASH]},
+                          'labelIds': [LABEL_TRASH]}]},
+        {'messagesDeleted': [{'message': {'id': deleted_email.google_id}}]},
+    ], '1240')
+    service.gmail_service.get_emails_details.side_effect = \
+        lambda emails, callback: callback(gmail_api_get_1_response['id'], gmail_api_get_1_response, None)
+
+    # method calls
+    service.sync_unread_emails()
+    emails = service.get_local_unread_emails()
+
+    # assertions
+    service.gmail_service.list_history.assert_called_once_with('1234')
+    service.gmail_service.get_emails_details.assert_called_once_with([{'id': gmail_api_get_1_response['id']}],
+                                                                     service.gmail_service_batch_callback)
+    assert [e['google_id'] for e in emails] == [gmail_api_get_1_response['id']]
+    assert emails[0]['sender'] == {'name': 'Google',
+                                   'email': 'no-reply@accounts.google.com',
+                                   'domain': 'accounts.google.com'}
+    assert set(email.labels.values_list('google_id', flat=True)) == {LABEL_INBOX, LABEL_TRASH}
+    assert not user.emails.filter(google_id=deleted_email.google_id).exists()
+    assert SyncState.objects.get(user=user).history_id == '1240'
+
+
+def test_email_service_falls_back_to_full_sync_when_history_expired(mocker, user, google_credentials):
+    # test setup and mocking
+    SyncState.objects.create(user=user, history_id='1234')
+    service = EmailService(credentials=google_credentials, user=user)
+    service.gmail_service = mocker.Mock()
+    service.gmail_service.list_history.side_effect = HistoryExpiredError()
+    service.sync_all_unread_emails = mocker.Mock(return_value=[])
+
+    # method call
+    service.sync_unread_emails()
+
+    # assertions
+    service.sync_all_unread_emails.assert_called_once_with(user.sync_state)
+
+
+def test_email_service_full_sync_only_refreshes_labels_of_already_stored_emails(mocker, user, all_labels,
+                                                                                email, google_credentials,
+                                                                                gmail_api_get_1_response):
+    # test setup and mocking
+    service = EmailService(credentials=google_credentials, user=user)
+    service.gmail_service = mocker.Mock()
+    service.gmail_service.get_profile.return_value = {'historyId': '1234'}
+    service.gmail_service.list_emails.return_value = [{'id': gmail_api_get_1_response['id']},
+                                                      {'id': email.google_id}]
+
+    def get_emails_details(emails, callback, labels_only=False):
+        callback(email.google_id,
+                 {'id': email.google_id, 'labelIds': [LABEL_UNREAD, LABEL_INBOX, 'Label_35']}, None)
+
+    service.gmail_service.get_emails_details.side_effect = get_emails_details
+    service.gmail_service.iter_emails_details.return_value = [
+        (gmail_api_get_1_response['id'], gmail_api_get_1_response, None)
+    ]
+
+    # method call
+    emails = service.retrieve_unread_emails()
+
+    # assertions
+    service.gmail_service.get_emails_details.assert_called_once_with([{'id': email.google_id}],
+                                                                     service.gmail_service_labels_callback,
+                                                                     labels_only=True)
+    service.gmail_service.iter_emails_details.assert_called_once_with(
+        [{'id': gmail_api_get_1_response['id']}])
+    assert [e['google_id'] for e in emails] == [gmail_api_get_1_response['id'], email.google_id]
+    assert set(email.labels.values_list('google_id', flat=True)) == {LABEL_UNREAD, LABEL_INBOX, 'Label_35'}
+    assert user.emails.count() == 2
+
+
+def test_google_resource_retrieves_only_label_ids_in_labels_only_mode(mocker, google_credentials):
+    google_api_service = GoogleAPIService(google_credentials)
+    google_api_service.service = mocker.Mock()
+
+    # method call
+    google_api_service.get_emails_details([{'id': 'a1'}], mocker.stub(), labels_only=True)
+
+    # assertions
+    google_api_service.service.users.return_value.messages.return_value.get.assert_called_once_with(
+        userId='me', id='a1', fields='id,labelIds', format='minimal')
+
+
+def test_email_service_batch_callback_does_not_query_the_database_once_preloaded(django_assert_num_queries,
+                                                                                 google_credentials, user,
+                                                                                 all_labels, locked_email,
+                                                                                 gmail_api_get_1_response,
+                                                                                 gmail_api_get_2_response,
+                                                                                 gmail_api_get_3_response):
+    # test setup and mocking
+    service = EmailService(credentials=google_credentials, user=user)
+    service.locked_ids
+    service.serialized_labels
+
+    # method call
+    with django_assert_num_queries(0):
+        for response in [gmail_api_get_1_response, gmail_api_get_2_response, gmail_api_get_3_response]:
+            service.gmail_service_batch_callback(response['id'], response, None)
+
+    # assertions
+    assert len(service.emails) == 3
+    assert [email['locked'] for email in service.emails] == [True, False, False]
+
+
+def test_email_service_updates_labels_at_most_once_per_retrieval(mocker, google_credentials, user, all_labels,
+                                                                 gmail_api_get_1_response):
+    # test setup and mocking
+    service = EmailService(credentials=google_credentials, user=user)
+    service.gmail_service = mocker.Mock()
+    service.gmail_service.list_user_labels.return_value = []
+    gmail_api_get_1_response['labelIds'].append('Label_unknown')
+
+    # method calls
+    service.gmail_service_batch_callback('a', gmail_api_get_1_response, None)
+    service.gmail_service_batch_callback('b', dict(gmail_api_get_1_response, id='b'), None)
+
+    # assertions
+    service.gmail_service.list_user_labels.assert_called_once_with()
+    assert len(service.emails) == 2
+
+
+def test_email_service_shares_serialized_labels_between_instances_through_the_cache(django_assert_num_queries,
+                                                                                    google_credentials, user,
+                                                                                    all_labels):
+    EmailService(credentials=google_credentials, user=user).serialized_labels
+
+    # method call
+    service = EmailService(credentials=google_credentials, user=user)
+    with django_assert_num_queries(0):
+        serialized_labels = service.serialized_labels
+
+    # assertions
+    assert serialized_labels['Label_35'] == {
+        'google_id': 'Label_35',
+        'name': 'Custom Label',
+        'type': 'user',
+        'text_color': '#222',
+        'background_color': '#ddd'
+    }
+
+
+def test_email_service_update_labels_invalidates_serialized_labels(mocker, google_credentials, user,
+                                                                   all_labels):
+    service = EmailService(credentials=google_credentials, user=user)
+    service.serialized_labels
+    service.gmail_service = mocker.Mock()
+    service.gmail_service.list_user_labels.return_value = [
+        {'id': 'Label_35', 'name': 'Renamed Label', 'type': 'user',
+         'color': {'textColor': '#000', 'backgroundColor': '#fff'}}
+    ]
+
+    # method call
+    service.update_labels()
+
+    # assertions
+    other_service = EmailService(credentials=google_credentials, user=user)
+    assert service.serialized_labels['Label_35']['name'] == 'Renamed Label'
+    assert other_service.serialized_labels['Label_35']['name'] == 'Renamed Label'
+    assert user.labels.filter(google_id='Label_35').count() == 1
+
+
+def test_email_service_store_emails_upserts_emails_and_labels_in_bulk(django_assert_num_queries,
+                                                                      google_credentials, user, all_labels,
+                                                                      email, gmail_api_get_1_response,
+                                                                      gmail_api_get_2_response,
+                                                                      gmail_api_get_3_response):
+    # test setup and mocking
+    service = EmailService(credentials=google_credentials, user=user)
+    service.user_labels
+    email_dicts = []
+    for response in [gmail_api_get_1_response, gmail_api_get_2_response, gmail_api_get_3_response]:
+        email_dict = GMailEmailParser.parse(response, user)
+        service._populate_with_serialized_labels(email_dict)
+        email_dicts.append(email_dict)
+    email_dicts[0]['google_id'] = email.google_id
+
+    # method call
+    with django_assert_num_queries(17):
+        service.store_emails(email_dicts)
+
+    # assertions
+    email.refresh_from_db()
+    assert user.emails.count() == 3
+    assert email.subject == email_dicts[0]['subject']
+    assert set(email.labels.values_list('google_id', flat=True)) == \
+        {LABEL_UNREAD, LABEL_INBOX, 'CATEGORY_PERSONAL'}
+
+
+def test_email_service_store_emails_writes_bounded_bulk_statements(mocker, settings, google_credentials, user,
+                                                                   all_labels, email,
+                                                                   gmail_api_get_1_response,
+                                                                   gmail_api_get_2_response,
+                                                                   gmail_api_get_3_response):
+    # test setup and mocking
+    settings.GOOGLE_AUTH_SETTINGS = dict(settings.GOOGLE_AUTH_SETTINGS, STORE_BATCH_SIZE=1)
+    bulk_update = mocker.spy(Email.objects, 'bulk_update')
+    service = EmailService(credentials=google_credentials, user=user)
+    email_dicts = []
+    for response in [gmail_api_get_1_response, gmail_api_get_2_response, gmail_api_get_3_response]:
+        email_dict = GMailEmailParser.parse(response, user)
+        service._populate_with_serialized_labels(email_dict)
+        email_dicts.append(email_dict)
+    email_dicts[0]['google_id'] = email.google_id
+
+    # method call
+    service.store_emails(email_dicts)
+
+    # assertions
+    assert bulk_update.call_args[1]['batch_size'] == 1
+    assert user.emails.count() == 3
+    assert set(email.labels.values_list('google_id', flat=True)) == \
+        {LABEL_UNREAD, LABEL_INBOX, 'CATEGORY_PERSONAL'}
+
+
+def test_email_service_store_emails_truncates_long_recipient_headers(google_credentials, user, all_labels,
+                                                                     gmail_api_get_1_response):
+    # test setup and mocking
+    service = EmailService(credentials=google_credentials, user=user)
+    email_dict = GMailEmailParser.parse(gmail_api_get_1_response, user)
+    service._populate_with_serialized_labels(email_dict)
+    email_dict['receiver'] = ', '.join('Recipient Number {0} <recipient.{0}@example.com>'.format(i)
+                                       for i in range(12))
+
+    # method call
+    service.store_emails([email_dict])
+
+    # assertions
+    email = user.emails.get(google_id=email_dict['google_id'])
+    assert len(email_dict['receiver']) > 254
+    assert email.receiver == email_dict['receiver'][:254]
+
+def test_email_service_store_emails_references_each_sender_once(google_credentials, user, all_labels, sender,
+                                                                gmail_api_get_1_response,
+                                                                gmail_api_get_2_response):
+    # test setup and mocking
+    service = EmailService(credentials=google_credentials, user=user)
+    email_dicts = []
+    for google_id, response in [('b1', gmail_api_get_1_response), ('b2', gmail_api_get_1_response),
+                                ('b3', gmail_api_get_2_response)]:
+        email_dict = GMailEmailParser.parse(dict(response, id=google_id), user)
+        service._populate_with_serialized_labels(email_dict)
+        email_dicts.append(email_dict)
+
+    # method call
+    service.store_emails(email_dicts)
+
+    # assertions
+    emails = {email.google_id: email for email in user.emails.select_related('sender')}
+    assert user.senders.count() == 3
+    assert emails['b1'].sender_id == emails['b2'].sender_id
+    assert emails['b1'].sender.to_actor() == email_dicts[0]['sender']
+    assert emails['b3'].sender.to_actor() == email_dicts[2]['sender']
+
+
+def test_email_service_store_emails_truncates_long_sender_names(google_credentials, user, all_labels,
+                                                                gmail_api_get_1_response):
+    # test setup and mocking
+    service = EmailService(credentials=google_credentials, user=user)
+    email_dicts = []
+    for google_id in ['b1', 'b2']:
+        email_dict = GMailEmailParser.parse(dict(gmail_api_get_1_response, id=google_id), user)
+        service._populate_with_serialized_labels(email_dict)
+        email_dict['sender'] = dict(email_dict['sender'], name='Newsletter ' * 30)
+        email_dicts.append(email_dict)
+
+    # method calls
+    service.store_emails(email_dicts[:1])
+    service.store_emails(email_dicts[1:])
+
+    # assertions
+    sender = user.senders.get()
+    assert len(email_dicts[0]['sender']['name']) > 254
+    assert sender.name == email_dicts[0]['sender']['name'][:254]
+    assert set(user.emails.values_list('sender_id', flat=True)) == {sender.pk}
+
+def test_email_service_store_emails_only_advances_latest_email_to_newer_emails(google_credentials,
+                                                                               latest_email, all_labels,
+                                                                               gmail_api_get_1_response):
+    # test setup and mocking
+    latest_email.email.refresh_from_db()
+    service = EmailService(credentials=google_credentials, user=latest_email.user)
+    older_email = GMailEmailParser.parse(gmail_api_get_1_response, latest_email.user)
+    older_email['date'] = latest_email.email.date - datetime.timedelta(days=1)
+    service._populate_with_serialized_labels(older_email)
+    newer_email = dict(older_email, google_id='b1', date=latest_email.email.date + datetime.timedelta(days=1))
+
+    # method calls
+    service.store_emails([older_email])
+    older_latest_email = LatestEmail.objects.get(user=latest_email.user).email
+    service.store_emails([newer_email])
+
+    # assertions
+    assert older_latest_email == latest_email.email
+    assert LatestEmail.objects.get(user=latest_email.user).email.google_id == 'b1'
+    assert service.get_date_to_retrieve_new_emails() == newer_email['date'].strftime('%Y-%m-%d')
+
+
+def test_email_service_serves_recently_synced_emails_from_the_database(mocker, user, email,
+                                                                       google_credentials):
+    # test setup and mocking
+    SyncState.objects.create(user=user, history_id='1234', synced_at=timezone.now())
+    service = EmailService(credentials=google_credentials, user=user)
+    service.gmail_service = mocker.Mock()
+    submit = mocker.patch('gcleaner.emails.services.get_refresh_executor').return_value.submit
+
+    # method call
+    emails = service.retrieve_unread_emails()
+
+    # assertions
+    assert [e['google_id'] for e in emails] == [email.google_id]
+    assert service.synced_at == user.sync_state.synced_at
+    assert service.refreshing is False
+    assert service.gmail_service.mock_calls == []
+    submit.assert_not_called()
+
+
+def test_email_service_refreshes_stale_emails_once_in_the_background(mocker, settings, user, email,
+                                                                     google_credentials):
+    # test setup and mocking
+    synced_at = timezone.now() - datetime.timedelta(seconds=settings.GOOGLE_AUTH_SETTINGS['STALE_AFTER'])
+    SyncState.objects.create(user=user, history_id='1234', synced_at=synced_at)
+    submit = mocker.patch('gcleaner.emails.services.get_refresh_executor').return_value.submit
+    service = EmailService(credentials=google_credentials, user=user)
+    other_service = EmailService(credentials=google_credentials, user=user)
+
+    # method calls
+    emails = service.retrieve_unread_emails()
+    other_emails = list(other_service.iter_unread_emails())
+
+    # assertions
+    assert [e['google_id'] for e in emails] == [email.google_id]
+    assert other_emails == emails
+    assert service.refreshing is True
+    assert other_service.refreshing is True
+    submit.assert_called_once()
+    assert submit.call_args[0][0].__self__ is not service
+
+
+def test_email_service_refresh_releases_the_lock_when_it_fails(mocker, user, google_credentials):
+    # test setup and mocking
+    service = EmailService(credentials=google_credentials, user=user)
+    service.sync_unread_emails = mocker.Mock(side_effect=HttpError(httplib2.Response({'status': 500}), b''))
+    connections = mocker.patch('gcleaner.emails.services.connections')
+    cache.add(service.get_refresh_lock_key(), True)
+
+    # method call
+    service.refresh_unread_emails()
+
+    # assertions
+    service.sync_unread_emails.assert_called_once_with()
+    connections.close_all.assert_called_once_with()
+    assert cache.get(service.get_refresh_lock_key()) is None
+
+
+@pytest.mark.parametrize('nr_of_emails', [1, 300])
+def test_email_service_modify_emails_runs_a_constant_number_of_queries(django_assert_num_queries, mocker,
+                                                                       nr_of_emails, user, all_labels, sender,
+                                                                       google_credentials):
+    # test setup and mocking
+    service = EmailService(credentials=google_credentials, user=user)
+    mocker.patch.object(service.gmail_service, 'batch_modify_emails', return_value=None)
+    service.user_labels
+    Email.objects.bulk_create([
+        Email(user=user, google_id='e%s' % i, thread_id='e%s' % i, subject='', snippet='', sender=sender,
+              receiver='', delivered_to='', date=timezone.now())
+        for i in range(nr_of_emails)
+    ])
+    EmailLabel = Email.labels.through
+    EmailLabel.objects.bulk_create([EmailLabel(email_id=pk, label_id=all_labels[0].pk)
+                                    for pk in user.emails.values_list('pk', flat=True)])
+    payload = {
+        'ids': ['e%s' % i for i in range(nr_of_emails)],
+        'addLabelIds': [LABEL_TRASH],
+        'removeLabelIds': [LABEL_INBOX]
+    }
+
+    # method call
+    with django_assert_num_queries(16):
+        service.modify_emails(payload)
+
+    # assertions
+    assert user.emails.filter(labels__google_id=LABEL_TRASH).count() == nr_of_emails
+    assert user.emails.filter(labels__google_id=LABEL_INBOX).count() == 0
+
+
+def test_email_service_update_sender_rollups_groups_unread_emails_by_sender_and_domain(user, all_labels,
+                                                                                       google_credentials):
+    # test setup and mocking
+    now = timezone.now()
+    news = Sender.objects.create(user=user, email='news@shop.com', name='Shop', domain='shop.com')
+    deals = Sender.objects.create(user=user, email='deals@shop.com', name='Shop', domain='shop.com')
+    senders = [(news, 'https://shop.com/unsubscribe'), (deals, ''), (news, '')]
+    for i, (sender, list_unsubscribe) in enumerate(senders):
+        email = Email.objects.create(user=user, google_id='e%s' % i, thread_id='e%s' % i,
+                                     subject='Subject %s' % i, snippet='', sender=sender, receiver='',
+                                     delivered_to='', list_unsubscribe=list_unsubscribe,
+                                     date=now - datetime.timedelta(hours=i))
+        email.labels.add(all_labels[0], all_labels[1])
+    service = EmailService(credentials=google_credentials, user=user)
+
+    # method call
+    service.update_sender_rollups()
+
+    # assertions
+    news = user.sender_rollups.get(kind=ROLLUP_SENDER, key='news@shop.com')
+    domain = user.sender_rollups.get(kind=ROLLUP_DOMAIN, key='shop.com')
+    assert user.sender_rollups.count() == 3
+    assert news.name == 'Shop'
+    assert news.nr_of_unread_emails == 2
+    assert news.latest_date == now
+    assert news.has_unsubscribe is True
+    assert json.loads(news.sample_subjects) == ['Subject 0', 'Subject 2']
+    assert domain.nr_of_unread_emails == 3
+    assert json.loads(domain.sample_subjects) == ['Subject 0', 'Subject 1', 'Subject 2']
+
+
+def test_email_service_modify_emails_updates_the_rollups_of_the_modified_senders(mocker, user, all_labels,
+                                                                                 email, google_credentials):
+    # test setup and mocking
+    service = EmailService(credentials=google_credentials, user=user)
+    mocker.patch.object(service.gmail_service, 'batch_modify_emails', return_value=None)
+    service.update_sender_rollups()
+    payload = {
+        'ids': [email.google_id],
+        'addLabelIds': [LABEL_TRASH],
+        'removeLabelIds': [LABEL_INBOX]
+    }
+
+    # method call
+    rollups_before = user.sender_rollups.count()
+    service.modify_emails(payload)
+
+    # assertions
+    assert rollups_before == 2
+    assert not user.sender_rollups.exists()
+
+
+def test_email_service_change_emails_labels_reflects_starred_and_important_flags(user, all_labels, email,
+                                                                                 google_credentials):
+    # test setup and mocking
+    Label.objects.create(user=user, google_id='STARRED', name='STARRED', type='system')
+    Label.objects.create(user=user, google_id='IMPORTANT', name='IMPORTANT', type='system')
+    Email.objects.filter(pk=email.pk).update(important=True)
+    service = EmailService(credentials=google_credentials, user=user)
+
+    # method call
+    service.change_emails_labels({email.google_id: ['STARRED']},
+                                 {email.google_id: ['IMPORTANT', LABEL_UNREAD]})
+
+    # assertions
+    email.refresh_from_db()
+    assert email.starred is True
+    assert email.important is False
+    assert set(email.labels.values_list('google_id', flat=True)) == {LABEL_INBOX, 'STARRED'}
+
+
+@mock.patch('gcleaner.emails.services.sleep')
+def test_email_service_run_modify_job_modifies_emails_in_chunks(sleep_mock, mocker, settings, user,
+                                                                all_labels, google_credentials):
+    # test setup and mocking
+    settings.GOOGLE_AUTH_SETTINGS = dict(settings.GOOGLE_AUTH_SETTINGS, MODIFY_BATCH_SIZE=2,
+                                         MODIFY_CONCURRENCY=1)
+    service = EmailService(credentials=google_credentials, user=user)
+    mocker.patch.object(service.gmail_service, 'batch_modify_emails', side_effect=[
+        HttpError(httplib2.Response({'status': 429}), b''),
+        None,
+        HttpError(httplib2.Response({'status': 400}), b''),
+        None
+    ])
+    payload = {'ids': ['a', 'b', 'c', 'd', 'e'], 'addLabelIds': [LABEL_TRASH],
+               'removeLabelIds': [LABEL_INBOX]}
+    job = ModifyEmailsJob.objects.create(user=user, payload=json.dumps(payload), nr_of_emails=5,
+                                         status=JOB_RUNNING)
+
+    # method call
+    service.run_modify_job(job)
+
+    # assertions
+    job.refresh_from_db()
+    assert service.gmail_service.batch_modify_emails.call_args_list == [
+        call(dict(payload, ids=['a', 'b'])),
+        call(dict(payload, ids=['a', 'b'])),
+        call(dict(payload, ids=['c', 'd'])),
+        call(dict(payload, ids=['e']))
+    ]
+    assert job.status == JOB_FAILED
+    assert job.nr_of_modified_emails == 3
+    assert json.loads(job.failed_ids) == ['c', 'd']
+    assert job.nr_of_retries == 1
+    assert job.finished_at is not None
+    assert ModifiedEmailBatch.objects.filter(user=user).count() == 2
+    sleep_mock.assert_called_once()
+
+
+@pytest.mark.parametrize('concurrency', [1, 3])
+def test_google_api_service_modifies_any_amount_of_emails_in_chunks(mocker, settings, concurrency,
+                                                                    google_credentials):
+    # test setup and mocking
+    settings.GOOGLE_AUTH_SETTINGS = dict(settings.GOOGLE_AUTH_SETTINGS, MODIFY_CONCURRENCY=concurrency)
+    google_api_service = GoogleAPIService(credentials=google_credentials)
+    mocker.patch.object(google_api_service, 'batch_modify_emails', return_value=None)
+    payload = {'ids': ['e%s' % i for i in range(2500)], 'addLabelIds': [LABEL_TRASH], 'removeLabelIds': []}
+
+    # method call
+    chunks = list(google_api_service.iter_batch_modify_emails(payload))
+
+    # assertions
+    assert sorted(len(chunk['ids']) for chunk in chunks) == [500, 1000, 1000]
+    assert all(chunk['modified'] and chunk['retries'] == 0 for chunk in chunks)
+    assert google_api_service.batch_modify_emails.call_count == 3
+    modified_ids = sum([c[0][0]['ids'] for c in google_api_service.batch_modify_emails.call_args_list], [])
+    assert sorted(modified_ids) == sorted(payload['ids'])
+
+
+def test_email_service_modify_emails_aggregates_chunk_outcomes(mocker, user, google_credentials):
+    # test setup and mocking
+    service = EmailService(credentials=google_credentials, user=user)
+    service.reflect_modified_emails = mocker.Mock()
+    mocker.patch.object(service.gmail_service, 'iter_batch_modify_emails', return_value=[
+        {'ids': ['c', 'd'], 'modified': True, 'retries': 2},
+        {'ids': ['a', 'b'], 'modified': False, 'retries': 3},
+        {'ids': ['e'], 'modified': True, 'retries': 0}
+    ])
+    payload = {'ids': ['a', 'b', 'c', 'd', 'e'], 'addLabelIds': [LABEL_TRASH],
+               'removeLabelIds': [LABEL_INBOX]}
+
+    # method call
+    result = service.modify_emails(payload)
+
+    # assertions
+    assert result == {'modified_ids': ['c', 'd', 'e'], 'failed_ids': ['a', 'b'], 'retries': 5}
+    assert service.reflect_modified_emails.call_args_list == [
+        call(dict(payload, ids=['c', 'd'])),
+        call(dict(payload, ids=['e']))
+    ]
+
+
+def test_google_api_service_pages_through_listed_email_ids(mocker, google_credentials):
+    # test setup and mocking
+    google_api_service = GoogleAPIService(credentials=google_credentials)
+    google_api_service.service = mocker.Mock()
+    list_mock = google_api_service.service.users.return_value.messages.return_value.list
+    list_mock.return_value.execute.side_effect = [
+        {'messages': [{'id': 'a'}, {'id': 'b'}], 'nextPageToken': 'p2'},
+        {'messages': [{'id': 'c'}]}
+    ]
+
+    # method call
+    pages = list(google_api_service.iter_listed_email_ids('from:(@spam.com)'))
+
+    # assertions
+    assert pages == [['a', 'b'], ['c']]
+    assert list_mock.call_args_list == [
+        call(userId='me', q='from:(@spam.com)', maxResults=500, fields='messages/id,nextPageToken'),
+        call(userId='me', q='from:(@spam.com)', maxResults=500, fields='messages/id,nextPageToken',
+             pageToken='p2')
+    ]
+
+
+@pytest.mark.parametrize('concurrency', [1, 3])
+def test_google_api_service_pipes_listed_emails_into_batch_modify_chunks(mocker, settings, concurrency,
+                                                                         google_credentials):
+    # test setup and mocking
+    settings.GOOGLE_AUTH_SETTINGS = dict(settings.GOOGLE_AUTH_SETTINGS, MODIFY_BATCH_SIZE=3,
+                                         MODIFY_CONCURRENCY=concurrency)
+    google_api_service = GoogleAPIService(credentials=google_credentials)
+    mocker.patch.object(google_api_service, 'iter_listed_email_ids',
+                        return_value=iter([['a', 'b'], ['c', 'd', 'e'], ['f', 'g']]))
+    mocker.patch.object(google_api_service, 'batch_modify_emails', return_value=None)
+
+    # method call
+    chunks = list(google_api_service.iter_batch_modify_listed_emails('in:inbox', [LABEL_TRASH], [LABEL_INBOX],
+                                                                     exclude_ids={'c'}))
+
+    # assertions
+    google_api_service.iter_listed_email_ids.assert_called_once_with('in:inbox')
+    assert sorted(chunk['ids'] for chunk in chunks) == [['a', 'b', 'd'], ['e', 'f', 'g']]
+    assert all(chunk['modified'] for chunk in chunks)
+    google_api_service.batch_modify_emails.assert_any_call({'ids': ['a', 'b', 'd'],
+                                                            'addLabelIds': [LABEL_TRASH],
+                                                            'removeLabelIds': [LABEL_INBOX]})
+
+
+@pytest.mark.parametrize('filters, query', [
+    ({}, ''),
+    ({'q': '  '}, ''),
+    ({'q': 'is:unread older_than:1y'}, 'is:unread older_than:1y'),
+    ({'sender': 'news@shop.com'}, 'from:(news@shop.com)'),
+    ({'domain': '@shop.com'}, 'from:(@shop.com)'),
+    ({'q': 'in:inbox', 'domain': 'shop.com) OR (in:sent'}, 'in:inbox from:(@shop.com OR in:sent)'),
+])
+def test_google_api_service_builds_search_queries(filters, query):
+    assert GoogleAPIService.build_search_query(**filters) == query
+
+
+def test_email_service_run_modify_job_stops_once_the_job_was_failed_as_interrupted(mocker, settings, user,
+                                                                                   all_labels,
+                                                                                   google_credentials):
+    # test setup and mocking
+    settings.GOOGLE_AUTH_SETTINGS = dict(settings.GOOGLE_AUTH_SETTINGS, MODIFY_BATCH_SIZE=2,
+                                         MODIFY_CONCURRENCY=1)
+    service = EmailService(credentials=google_credentials, user=user)
+    payload = {'ids': ['a', 'b', 'c', 'd', 'e'], 'addLabelIds': [LABEL_TRASH],
+               'removeLabelIds': [LABEL_INBOX]}
+    job = ModifyEmailsJob.objects.create(user=user, payload=json.dumps(payload), nr_of_emails=5,
+                                         status=JOB_RUNNING)
+
+    def fail_job(body):
+        ModifyEmailsJob.objects.filter(pk=job.pk).update(status=JOB_FAILED)
+
+    mocker.patch.object(service.gmail_service, 'batch_modify_emails', side_effect=fail_job)
+
+    # method call
+    service.run_modify_job(job)
+
+    # assertions
+    job.refresh_from_db()
+    assert job.status == JOB_FAILED
+    assert job.nr_of_modified_emails == 0
+    assert job.finished_at is None
+
+def test_email_service_run_modify_job_modifies_emails_matching_a_query_except_locked_ones(mocker, user,
+                                                                                          all_labels,
+                                                                                          locked_email,
+                                                                                          google_credentials):
+    # test setup and mocking
+    service = EmailService(credentials=google_credentials, user=user)
+    mocker.patch.object(service.gmail_service, 'iter_batch_modify_listed_emails', return_value=[
+        {'ids': ['a', 'b'], 'modified': True, 'retries': 0},
+        {'ids': ['c'], 'modified': True, 'retries': 1}
+    ])
+    payload = {'q': 'from:(@shop.com)', 'addLabelIds': [LABEL_TRASH], 'removeLabelIds': [LABEL_INBOX]}
+    job = ModifyEmailsJob.objects.create(user=user, payload=json.dumps(payload), nr_of_emails=0,
+                                         status=JOB_RUNNING)
+
+    # method call
+    service.run_modify_job(job)
+
+    # assertions
+    job.refresh_from_db()
+    service.gmail_service.iter_batch_modify_listed_emails.assert_called_once_with(
+        'from:(@shop.com)', [LABEL_TRASH], [LABEL_INBOX], exclude_ids={locked_email.google_id})
+    assert job.nr_of_emails == 3
+    assert job.nr_of_modified_emails == 3
+    assert job.nr_of_retries == 1
+    assert job.status == JOB_DONE
+
+
+def test_google_api_service_lists_a_page_of_email_ids(mocker, google_credentials):
+    # test setup and mocking
+    google_api_service = GoogleAPIService(credentials=google_credentials)
+    google_api_service.service = mocker.Mock()
+    list_mock = google_api_service.service.users.return_value.messages.return_value.list
+    list_mock.return_value.execute.return_value = {'messages': [{'id': 'a'}, {'id': 'b'}],
+                                                   'nextPageToken': 'p3'}
+
+    # method call
+    page = google_api_service.list_emails_page([LABEL_UNREAD, LABEL_INBOX], 2, 'p2')
+
+    # assertions
+    assert page == (['a', 'b'], 'p3')
+    list_mock.assert_called_once_with(userId='me', labelIds=[LABEL_UNREAD, LABEL_INBOX], maxResults=2,
+                                      fields='messages/id,nextPageToken', pageToken='p2')
+
+
+def test_email_service_retrieves_details_only_for_unknown_emails_of_the_page(mocker, user, all_labels, email,
+                                                                             google_credentials,
+                                                                             gmail_api_get_1_response):
+    # test setup and mocking
+    service = EmailService(credentials=google_credentials, user=user)
+    service.gmail_service = mocker.Mock()
+    google_id = gmail_api_get_1_response['id']
+    service.gmail_service.list_emails_page.return_value = ([google_id, email.google_id], None)
+    service.gmail_service.iter_emails_details.return_value = [(google_id, gmail_api_get_1_response, None)]
+
+    # method call
+    emails, next_page_token = service.retrieve_unread_emails_page(2, 'p2')
+
+    # assertions
+    service.gmail_service.list_emails_page.assert_called_once_with([LABEL_UNREAD, LABEL_INBOX], 2, 'p2')
+    service.gmail_service.iter_emails_details.assert_called_once_with([{'id': google_id}])
+    assert [e['google_id'] for e in emails] == [google_id, email.google_id]
+    assert next_page_token is None
+    assert user.emails.filter(google_id=google_id).exists()
+
+
+def test_email_service_serves_stale_emails_while_gmail_is_unavailable(mocker, settings, user, email,
+                                                                      google_credentials, circuit_breaker):
+    # test setup and mocking
+    synced_at = timezone.now() - datetime.timedelta(seconds=settings.GOOGLE_AUTH_SETTINGS['STALE_AFTER'])
+    SyncState.objects.create(user=user, history_id='1234', synced_at=synced_at)
+    mocker.patch.object(circuit_breaker, 'available', return_value=False)
+    submit = mocker.patch('gcleaner.emails.services.get_refresh_executor').return_value.submit
+    service = EmailService(credentials=google_credentials, user=user)
+
+    # method call
+    emails = service.retrieve_unread_emails()
+
+    # assertions
+    assert [e['google_id'] for e in emails] == [email.google_id]
+    assert service.stale is True
+    assert service.refreshing is False
+    submit.assert_not_called()
+
+
+def test_email_service_counts_local_emails_while_gmail_is_unavailable(mocker, user, email,
+                                                                      google_credentials):
+    # test setup and mocking
+    cache.clear()
+    SyncState.objects.create(user=user, history_id='1234', synced_at=timezone.now())
+    service = EmailService(credentials=google_credentials, user=user)
+    service.gmail_service = mocker.Mock()
+    service.gmail_service.get_label.side_effect = CircuitOpenError(30)
+
+    # method call
+    response = service.retrieve_nr_of_unread_emails()
+
+    # assertions
+    assert response == {'gmail': 1}
+    assert service.stale is True
+    assert service.synced_at == user.sync_state.synced_at
+
+
+def test_email_service_serves_the_first_local_page_while_gmail_is_unavailable(mocker, user, email,
+                                                                              google_credentials):
+    # test setup and mocking
+    SyncState.objects.create(user=user, history_id='1234', synced_at=timezone.now())
+    service = EmailService(credentials=google_credentials, user=user)
+    service.gmail_service = mocker.Mock()
+    service.gmail_service.list_emails_page.side_effect = HttpError(httplib2.Response({'status': 503}), b'')
+
+    # method call
+    emails, next_page_token = service.retrieve_unread_emails_page(10)
+
+    # assertions
+    assert [e['google_id'] for e in emails] == [email.google_id]
+    assert next_page_token is None
+    assert service.stale is True
+    with pytest.raises(HttpError):
+        service.retrieve_unread_emails_page(10, 'gmail-page-2')
+
+
+def test_email_service_raises_unavailable_errors_without_local_emails(mocker, user, google_credentials):
+    # test setup and mocking
+    service = EmailService(credentials=google_credentials, user=user)
+    service.gmail_service = mocker.Mock()
+    service.gmail_service.get_label.side_effect = CircuitOpenError(30)
+
+    # method call
+    with pytest.raises(CircuitOpenError):
+        service.retrieve_nr_of_unread_emails()
+
+    # assertions
+    assert service.stale is False
+
+
+def test_google_api_service_fails_fast_while_the_circuit_is_open(mocker, google_credentials, circuit_breaker):
+    # test setup and mocking
+    mocker.patch.object(circuit_breaker, 'call', side_effect=CircuitOpenError(30))
+    mocker.patch('gcleaner.emails.services.get_rate_limiter')
+    google_api_service = GoogleAPIService(google_credentials)
+
+    # method call
+    with pytest.raises(CircuitOpenError):
+        google_api_service.get_label(LABEL_INBOX)
+
+    # assertions
+    circuit_breaker.call.assert_called_once()
+
+
+def test_email_service_full_sync_keeps_emails_older_than_a_capped_listing(mocker, user, all_labels, email,
+                                                                          sender, google_credentials):
+    # test setup and mocking
+    mocker.patch('gcleaner.emails.services.MAX_LISTED_EMAILS', 1)
+    older_email = Email.objects.create(user=user, google_id='o123', thread_id='o123', subject='', snippet='',
+                                       sender=sender, receiver='', delivered_to='',
+                                       date='2019-03-18 08:11:21+00:00')
+    newer_email = Email.objects.create(user=user, google_id='n123', thread_id='n123', subject='', snippet='',
+                                       sender=sender, receiver='', delivered_to='',
+                                       date='2019-03-20 08:11:21+00:00')
+    service = EmailService(credentials=google_credentials, user=user)
+    service.gmail_service = mocker.Mock()
+    service.gmail_service.get_profile.return_value = {'historyId': '1234'}
+    service.gmail_service.list_emails.return_value = [{'id': email.google_id}]
+    service.gmail_service.iter_emails_details.return_value = []
+
+    # method call
+    service.retrieve_unread_emails()
+
+    # assertions
+    assert set(user.emails.values_list('google_id', flat=True)) == {email.google_id, older_email.google_id}
+    assert not Email.objects.filter(pk=newer_email.pk).exists()
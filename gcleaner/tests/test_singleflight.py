@@ -0,0 +1,109 @@
+import threading
+
+import pytest
+from django.core.cache import cache
+
+from gcleaner.emails.services import GoogleAPIService
+from gcleaner.emails.singleflight import SingleFlight
+
+
+def test_single_flight_shares_the_call_in_flight_between_threads(mocker):
+    single_flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    func = mocker.Mock(side_effect=lambda: started.set() or release.wait() and ['a123'])
+    results = []
+
+    # method calls
+    leader = threading.Thread(target=lambda: results.append(single_flight.do('list', func)))
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=lambda: results.append(single_flight.do('list', func)))
+    follower.start()
+    release.set()
+    leader.join()
+    follower.join()
+
+    # assertions
+    assert func.call_count == 1
+    assert results == [['a123'], ['a123']]
+    assert single_flight.do('list', lambda: ['b123']) == ['b123']
+
+
+def test_single_flight_shares_the_exception_of_the_call_in_flight(mocker):
+    single_flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait()
+        raise ValueError()
+
+    errors = []
+
+    def call():
+        try:
+            single_flight.do('list', fail)
+        except ValueError as e:
+            errors.append(e)
+
+    # method calls
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=call)
+    follower.start()
+    release.set()
+    leader.join()
+    follower.join()
+
+    # assertions
+    assert len(errors) == 2
+    assert errors[0] is errors[1]
+
+
+def test_single_flight_waits_for_the_result_of_the_call_of_another_process(mocker):
+    result_key = SingleFlight.get_result_key('list', 'token')
+    single_flight = SingleFlight(sleep=lambda seconds: cache.set(result_key, ['a']))
+    cache.set('singleflight:list', 'token')
+    func = mocker.Mock()
+
+    # method call
+    result = single_flight.do('list', func)
+
+    # assertions
+    cache.delete_many(['singleflight:list', SingleFlight.get_result_key('list', 'token')])
+    func.assert_not_called()
+    assert result == ['a']
+
+
+def test_single_flight_calls_the_operation_once_the_call_of_another_process_failed(mocker):
+    single_flight = SingleFlight(sleep=lambda seconds: cache.delete('singleflight:list'))
+    cache.set('singleflight:list', 'token')
+    func = mocker.Mock(return_value=['b'])
+
+    # method call
+    result = single_flight.do('list', func)
+
+    # assertions
+    func.assert_called_once_with()
+    assert result == ['b']
+    assert cache.get('singleflight:list') is None
+
+
+@pytest.mark.parametrize('user_id, coalesced', [('1', True), (None, False)])
+def test_google_api_service_coalesces_listings_of_the_same_user(mocker, google_credentials, user_id,
+                                                                coalesced):
+    do = mocker.patch('gcleaner.emails.services.single_flight.do', side_effect=lambda key, func: func())
+    google_api_service = GoogleAPIService(google_credentials, user_id=user_id)
+    mocker.patch.object(google_api_service, '_list_emails', return_value=[{'id': 'a123'}])
+
+    # method call
+    emails = google_api_service.list_emails(['UNREAD'])
+
+    # assertions
+    assert emails == [{'id': 'a123'}]
+    assert do.called is coalesced
+    if coalesced:
+        assert do.call_args[0][0].startswith('emails:1:list:')
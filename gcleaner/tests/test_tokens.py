@@ -0,0 +1,142 @@
+import datetime
+
+import pytest
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from google.oauth2.credentials import Credentials
+
+from gcleaner.authentication.tokens import store_credentials, load_credentials, get_user_credentials, \
+    get_refresh_lock_key, refresh_credentials
+from gcleaner.users.models import GoogleToken
+
+
+def expires_in(seconds):
+    return (timezone.now() + datetime.timedelta(seconds=seconds)).replace(tzinfo=None)
+
+
+def test_store_credentials_encrypts_tokens_at_rest(user):
+    credentials = Credentials('access_token', refresh_token='refresh_token')
+    credentials.expiry = expires_in(3600)
+
+    # function calls
+    store_credentials(user, credentials)
+    stored_credentials = load_credentials(user)
+
+    # assertions
+    google_token = GoogleToken.objects.get(user=user)
+    assert 'access_token' not in google_token.access_token
+    assert 'refresh_token' not in google_token.refresh_token
+    assert stored_credentials.token == 'access_token'
+    assert stored_credentials.refresh_token == 'refresh_token'
+    microsecond = stored_credentials.expiry.microsecond
+    assert stored_credentials.expiry == credentials.expiry.replace(microsecond=microsecond)
+
+
+def test_get_user_credentials_reuses_stored_access_token_until_it_expires(mocker, user):
+    # test setup and mocking
+    credentials = Credentials('access_token', refresh_token='refresh_token')
+    credentials.expiry = expires_in(3600)
+    store_credentials(user, credentials)
+    refresh = mocker.patch.object(Credentials, 'refresh')
+
+    # function call
+    user_credentials = get_user_credentials(user, {'username': user.username})
+
+    # assertions
+    refresh.assert_not_called()
+    assert user_credentials.token == 'access_token'
+    assert user_credentials.valid
+
+
+# Refreshed tokens are committed on a connection of their own.
+@pytest.mark.django_db(transaction=True, databases=['default', 'tokens'])
+def test_get_user_credentials_refreshes_and_stores_expired_access_token(mocker, user):
+    # test setup and mocking
+    credentials = Credentials('expired_token', refresh_token='refresh_token')
+    credentials.expiry = expires_in(-60)
+    store_credentials(user, credentials)
+
+    def refresh(self, request):
+        self.token = 'refreshed_token'
+        self.expiry = expires_in(3600)
+
+    mocker.patch.object(Credentials, 'refresh', autospec=True, side_effect=refresh)
+
+    # function calls
+    user_credentials = get_user_credentials(user)
+    next_credentials = get_user_credentials(user)
+
+    # assertions
+    assert Credentials.refresh.call_count == 1
+    assert user_credentials.token == 'refreshed_token'
+    assert next_credentials.token == 'refreshed_token'
+    assert cache.get(get_refresh_lock_key(user)) is None
+
+
+def test_get_user_credentials_waits_for_the_concurrent_refresh_of_the_token(mocker, settings, user):
+    # test setup and mocking
+    settings.GOOGLE_AUTH_SETTINGS = dict(settings.GOOGLE_AUTH_SETTINGS, TOKEN_REFRESH_WAIT=1)
+    credentials = Credentials('expired_token', refresh_token='refresh_token')
+    credentials.expiry = expires_in(-60)
+    store_credentials(user, credentials)
+    cache.add(get_refresh_lock_key(user), 1)
+    refresh = mocker.patch.object(Credentials, 'refresh')
+
+    def refreshed_by_other_request(seconds):
+        refreshed_credentials = Credentials('refreshed_token', refresh_token='refresh_token')
+        refreshed_credentials.expiry = expires_in(3600)
+        store_credentials(user, refreshed_credentials)
+        cache.delete(get_refresh_lock_key(user))
+
+    mocker.patch('gcleaner.authentication.tokens.time.sleep', side_effect=refreshed_by_other_request)
+
+    # function call
+    user_credentials = get_user_credentials(user)
+
+    # assertions
+    refresh.assert_not_called()
+    assert user_credentials.token == 'refreshed_token'
+
+
+@pytest.mark.django_db(transaction=True, databases=['default', 'tokens'])
+def test_get_user_credentials_stores_tokens_carried_by_legacy_jwt(mocker, user):
+    # test setup and mocking
+    def refresh(self, request):
+        self.token = 'refreshed_token'
+        self.expiry = expires_in(3600)
+
+    mocker.patch.object(Credentials, 'refresh', autospec=True, side_effect=refresh)
+
+    # function calls
+    no_credentials = get_user_credentials(user, {'username': user.username})
+    user_credentials = get_user_credentials(user, {'access_token': 'access_token',
+                                                   'refresh_token': 'refresh_token'})
+
+    # assertions
+    assert no_credentials is None
+    assert user_credentials.token == 'refreshed_token'
+    assert load_credentials(user).refresh_token == 'refresh_token'
+
+
+@pytest.mark.django_db(transaction=True, databases=['default', 'tokens'])
+def test_refresh_credentials_keeps_the_token_when_the_request_is_rolled_back(mocker, user):
+    # test setup and mocking
+    credentials = Credentials('expired_token', refresh_token='refresh_token')
+    credentials.expiry = expires_in(-60)
+
+    def refresh(self, request):
+        self.token = 'refreshed_token'
+        self.expiry = expires_in(3600)
+
+    mocker.patch.object(Credentials, 'refresh', autospec=True, side_effect=refresh)
+
+    # function call
+    with transaction.atomic():
+        refresh_credentials(user, credentials)
+        lock = cache.get(get_refresh_lock_key(user))
+        transaction.set_rollback(True)
+
+    # assertions
+    assert lock is None
+    assert load_credentials(user).token == 'refreshed_token'
@@ -0,0 +1,67 @@
+import httplib2
+import pytest
+
+from gcleaner.emails.transport import HttpPool, HttpPoolExhausted, PooledHttp, get_http_pool
+
+
+def test_http_pool_reuses_released_connections():
+    pool = HttpPool(size=2, timeout=10)
+
+    # method calls
+    http_1 = pool.acquire()
+    pool.release(http_1)
+    http_2 = pool.acquire()
+
+    # assertions
+    assert isinstance(http_1, httplib2.Http)
+    assert http_1 is http_2
+    assert http_1.timeout == 10
+
+
+def test_http_pool_does_not_create_more_connections_than_its_size():
+    pool = HttpPool(size=1, acquire_timeout=0.01)
+    pool.acquire()
+
+    with pytest.raises(HttpPoolExhausted):
+        pool.acquire()
+
+
+def test_http_pool_closes_connection_on_failed_request(mocker):
+    pool = HttpPool(size=1)
+    http = pool.acquire()
+    http.close = mocker.Mock()
+    pool.release(http)
+
+    # method call
+    with pytest.raises(ValueError):
+        with pool.connection():
+            raise ValueError()
+
+    # assertions
+    http.close.assert_called_once_with()
+    assert pool.acquire() is http
+
+
+def test_pooled_http_sends_requests_through_a_pooled_connection(mocker):
+    pool = HttpPool(size=1)
+    http = pool.acquire()
+    http.request = mocker.Mock(return_value=('response', b'content'))
+    pool.release(http)
+    pooled_http = PooledHttp(pool)
+
+    # method call
+    response = pooled_http.request('https://www.googleapis.com/', method='POST', body='{}',
+                                   headers={'a': 'b'})
+
+    # assertions
+    assert response == ('response', b'content')
+    http.request.assert_called_once_with('https://www.googleapis.com/', method='POST', body='{}',
+                                         headers={'a': 'b'}, redirections=httplib2.DEFAULT_MAX_REDIRECTS,
+                                         connection_type=None)
+
+
+def test_get_http_pool_returns_process_wide_pool(settings):
+    pool = get_http_pool()
+
+    assert pool is get_http_pool()
+    assert pool.size == settings.GOOGLE_AUTH_SETTINGS['HTTP_POOL_SIZE']
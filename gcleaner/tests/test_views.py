@@ -1,10 +1,19 @@
+import datetime
+import json
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
 from rest_framework.test import APIClient
 
-from gcleaner.emails.constants import LABEL_INBOX, LABEL_TRASH
+from gcleaner.emails.constants import LABEL_INBOX, LABEL_TRASH, JOB_PENDING, ROLLUP_SENDER, ROLLUP_DOMAIN
 from gcleaner.emails.mixins import EmailMixin
 from gcleaner.emails.parsers import GMailEmailParser
 from gcleaner.emails.services import EmailService
-from gcleaner.emails.views import EmailModifyView, EmailListView, EmailStatsView, EmailLockView
+from gcleaner.emails.models import ModifyEmailsJob, SenderRollup
+from gcleaner.emails.views import EmailModifyView, EmailListView, EmailStatsView, EmailLockView, \
+    EmailCleanView
+from gcleaner.users.models import User
 
 
 def test_email_list_view_get_queryset_uses_email_service_to_retrieve_unread_emails(mocker, email, google_credentials, user, gmail_api_get_1_response, gmail_api_get_2_response, gmail_api_get_3_response):
@@ -17,6 +26,8 @@ def test_email_list_view_get_queryset_uses_email_service_to_retrieve_unread_emai
 
     email_service = mocker.Mock()
     email_service.retrieve_unread_emails.return_value = expected_emails
+    email_service.synced_at = None
+    email_service.refreshing = False
     EmailListView.get_service.return_value = email_service
 
     client = APIClient()
@@ -31,6 +42,94 @@ def test_email_list_view_get_queryset_uses_email_service_to_retrieve_unread_emai
     email_service.retrieve_unread_emails.assert_called_once_with()
 
 
+def test_email_list_view_streams_emails_as_ndjson(mocker, user):
+    # test setup and mocking
+    mocker.patch.object(EmailListView, 'get_service')
+    emails = [
+        {'google_id': 'a1', 'date': datetime.datetime(2019, 3, 19, 10, 31, 21, tzinfo=datetime.timezone.utc)},
+        {'google_id': 'a2', 'subject': 'Sujet numéro 2'}
+    ]
+    email_service = mocker.Mock()
+    email_service.iter_unread_emails.return_value = iter(emails)
+    email_service.synced_at = None
+    email_service.refreshing = False
+    EmailListView.get_service.return_value = email_service
+    client = APIClient()
+    client.force_authenticate(user)
+
+    # method call
+    response = client.get('/api/v1/messages/', HTTP_ACCEPT='application/x-ndjson')
+    lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+
+    # assertions
+    assert response.status_code == 200
+    assert response['Content-Type'] == 'application/x-ndjson'
+    assert [json.loads(line) for line in lines] == [
+        {'google_id': 'a1', 'date': '2019-03-19T10:31:21Z'},
+        {'google_id': 'a2', 'subject': 'Sujet numéro 2'}
+    ]
+    email_service.retrieve_unread_emails.assert_not_called()
+
+
+def test_email_list_view_paginates_emails_with_an_opaque_cursor(mocker, user):
+    # test setup and mocking
+    mocker.patch.object(EmailListView, 'get_service')
+    email_service = mocker.Mock()
+    email_service.retrieve_unread_emails_page.return_value = ([{'google_id': 'a1'}], 'gmail-page-3')
+    email_service.synced_at = None
+    email_service.refreshing = False
+    email_service.stale = False
+    EmailListView.get_service.return_value = email_service
+    client = APIClient()
+    client.force_authenticate(user)
+    cursor = EmailListView.encode_cursor('gmail-page-2')
+
+    # method call
+    response = client.get('/api/v1/messages/?page_size=1000&cursor=%s' % cursor)
+
+    # assertions
+    assert response.status_code == 200
+    assert response.data['results'] == [{'google_id': 'a1'}]
+    assert response.data['next'] == 'http://testserver/api/v1/messages/?cursor=%s&page_size=1000' % \
+        EmailListView.encode_cursor('gmail-page-3')
+    email_service.retrieve_unread_emails_page.assert_called_once_with(500, 'gmail-page-2')
+    email_service.retrieve_unread_emails.assert_not_called()
+
+
+def test_email_list_view_rejects_cursors_with_tampered_page_tokens(mocker, user):
+    # test setup and mocking
+    mocker.patch.object(EmailListView, 'get_service')
+    email_service = mocker.Mock()
+    email_service.retrieve_unread_emails_page.side_effect = HttpError(httplib2.Response({'status': 400}), b'')
+    EmailListView.get_service.return_value = email_service
+    client = APIClient()
+    client.force_authenticate(user)
+    cursor = EmailListView.encode_cursor('tampered-page-token')
+
+    # method call
+    response = client.get('/api/v1/messages/?cursor=%s' % cursor)
+
+    # assertions
+    assert response.status_code == 400
+    assert response.data == {'cursor': ['Invalid cursor.']}
+
+
+@pytest.mark.parametrize('cursor', ['%ff', '__4=', 'abc'])
+def test_email_list_view_rejects_malformed_cursors(mocker, user, cursor):
+    # test setup and mocking
+    mocker.patch.object(EmailListView, 'get_service')
+    client = APIClient()
+    client.force_authenticate(user)
+
+    # method call
+    response = client.get('/api/v1/messages/?cursor=%s' % cursor)
+
+    # assertions
+    assert response.status_code == 400
+    assert response.data == {'cursor': ['Invalid cursor.']}
+    EmailListView.get_service.return_value.retrieve_unread_emails_page.assert_not_called()
+
+
 def test_email_mixin_get_service(mocker, email, google_credentials, user):
     # test setup and mocking
     mixin = EmailMixin()
@@ -67,7 +166,7 @@ def test_email_modify_view(mocker, user, db):
         'addLabelIds': [LABEL_TRASH],
         'removeLabelIds': [LABEL_INBOX]
     }
-    email_service.modify_emails.return_value = None
+    email_service.modify_emails.return_value = {'modified_ids': ['a', 'c'], 'failed_ids': ['b'], 'retries': 4}
     client = APIClient()
     client.force_authenticate(user)
 
@@ -76,15 +175,141 @@ def test_email_modify_view(mocker, user, db):
 
     # assertions
     assert response.status_code == 200
-    assert response.data == ['a', 'b', 'c']
+    assert response.data == ['a', 'c']
     email_service.modify_emails.assert_called_once_with(payload)
 
 
+def test_email_modify_view_enqueues_a_job_in_async_mode(mocker, user, google_credentials):
+    # test setup and mocking
+    mocker.patch.object(EmailModifyView, 'get_service')
+    EmailModifyView.get_service.return_value = EmailService(credentials=google_credentials, user=user)
+    mocker.patch('gcleaner.emails.jobs.transaction.on_commit')
+    payload = {
+        'ids': ['a', 'b', 'c'],
+        'addLabelIds': [LABEL_TRASH],
+        'removeLabelIds': [LABEL_INBOX]
+    }
+    client = APIClient()
+    client.force_authenticate(user)
+
+    # method call
+    response = client.put('/api/v1/messages/modify/?async=true', data=payload, format='json')
+
+    # assertions
+    job = ModifyEmailsJob.objects.get(user=user)
+    assert response.status_code == 202
+    assert response.data['id'] == job.pk
+    assert response.data['status'] == JOB_PENDING
+    assert response.data['nr_of_emails'] == 3
+    assert json.loads(job.payload) == payload
+
+
+def test_email_clean_view_enqueues_a_job_for_the_emails_matching_the_search(mocker, user, google_credentials):
+    # test setup and mocking
+    mocker.patch.object(EmailCleanView, 'get_service')
+    EmailCleanView.get_service.return_value = EmailService(credentials=google_credentials, user=user)
+    mocker.patch('gcleaner.emails.jobs.transaction.on_commit')
+    client = APIClient()
+    client.force_authenticate(user)
+
+    # method call
+    response = client.post('/api/v1/messages/clean/',
+                           data={'domain': 'shop.com', 'addLabelIds': [LABEL_TRASH]},
+                           format='json')
+
+    # assertions
+    job = ModifyEmailsJob.objects.get(user=user)
+    assert response.status_code == 202
+    assert response.data['id'] == job.pk
+    assert json.loads(job.payload) == {'q': 'from:(@shop.com)',
+                                       'addLabelIds': [LABEL_TRASH],
+                                       'removeLabelIds': []}
+
+
+def test_email_clean_view_requires_a_search(mocker, user):
+    # test setup and mocking
+    mocker.patch.object(EmailCleanView, 'get_service')
+    client = APIClient()
+    client.force_authenticate(user)
+
+    # method call
+    response = client.post('/api/v1/messages/clean/', data={'addLabelIds': [LABEL_TRASH]}, format='json')
+
+    # assertions
+    assert response.status_code == 400
+    assert not ModifyEmailsJob.objects.filter(user=user).exists()
+    EmailCleanView.get_service.assert_not_called()
+
+
+def test_email_clean_view_requires_labels_to_modify(mocker, user):
+    # test setup and mocking
+    mocker.patch.object(EmailCleanView, 'get_service')
+    client = APIClient()
+    client.force_authenticate(user)
+
+    # method call
+    response = client.post('/api/v1/messages/clean/',
+                           data={'domain': 'shop.com', 'addLabelIds': [], 'removeLabelIds': []},
+                           format='json')
+
+    # assertions
+    assert response.status_code == 400
+    assert not ModifyEmailsJob.objects.filter(user=user).exists()
+    EmailCleanView.get_service.assert_not_called()
+
+def test_modify_emails_job_view_reports_the_progress_of_user_jobs_only(user):
+    # test setup and mocking
+    other_user = User.objects.create(username='other@email.com', email='other@email.com')
+    job = ModifyEmailsJob.objects.create(user=user, payload='{}', nr_of_emails=3, nr_of_modified_emails=1,
+                                         failed_ids=json.dumps(['c']), nr_of_retries=2)
+    client = APIClient()
+
+    # method calls
+    client.force_authenticate(user)
+    response = client.get('/api/v1/messages/modify/jobs/%s/' % job.pk)
+    client.force_authenticate(other_user)
+    other_response = client.get('/api/v1/messages/modify/jobs/%s/' % job.pk)
+
+    # assertions
+    assert response.status_code == 200
+    assert response.data['nr_of_modified_emails'] == 1
+    assert response.data['failed_ids'] == ['c']
+    assert response.data['nr_of_retries'] == 2
+    assert other_response.status_code == 404
+
+
+def test_sender_rollup_list_view_lists_the_most_prolific_senders_first(user):
+    # test setup and mocking
+    date = datetime.datetime(2019, 6, 1, tzinfo=datetime.timezone.utc)
+    SenderRollup.objects.create(user=user, kind=ROLLUP_SENDER, key='a@shop.com', nr_of_unread_emails=2,
+                                latest_date=date, sample_subjects=json.dumps(['Deals']))
+    SenderRollup.objects.create(user=user, kind=ROLLUP_SENDER, key='b@shop.com', nr_of_unread_emails=5,
+                                latest_date=date)
+    SenderRollup.objects.create(user=user, kind=ROLLUP_DOMAIN, key='shop.com', nr_of_unread_emails=7,
+                                latest_date=date)
+    client = APIClient()
+    client.force_authenticate(user)
+
+    # method calls
+    response = client.get('/api/v1/messages/senders/')
+    domain_response = client.get('/api/v1/messages/senders/', {'group': 'domain'})
+    invalid_response = client.get('/api/v1/messages/senders/', {'group': 'label'})
+
+    # assertions
+    assert [rollup['key'] for rollup in response.data] == ['b@shop.com', 'a@shop.com']
+    assert response.data[1]['sample_subjects'] == ['Deals']
+    assert [rollup['key'] for rollup in domain_response.data] == ['shop.com']
+    assert invalid_response.status_code == 400
+
+
 def test_email_stats_view(mocker, user, db):
     # test setup and mocking
     mocker.patch.object(EmailStatsView, 'get_service')
     email_service = mocker.Mock()
     email_service.retrieve_nr_of_unread_emails.return_value = {'gmail': 21}
+    email_service.synced_at = None
+    email_service.refreshing = False
+    email_service.stale = False
     EmailStatsView.get_service.return_value = email_service
     client = APIClient()
     client.force_authenticate(user)
@@ -95,6 +320,27 @@ def test_email_stats_view(mocker, user, db):
     # assertions
     assert response.status_code == 200
     assert response.data == {'unread': 21}
+    email_service.retrieve_nr_of_unread_emails.assert_called_once_with(exact=False)
+
+
+def test_email_stats_view_in_exact_mode(mocker, user, db):
+    # test setup and mocking
+    mocker.patch.object(EmailStatsView, 'get_service')
+    email_service = mocker.Mock()
+    email_service.retrieve_nr_of_unread_emails.return_value = {'gmail': 21}
+    email_service.synced_at = None
+    email_service.refreshing = False
+    email_service.stale = False
+    EmailStatsView.get_service.return_value = email_service
+    client = APIClient()
+    client.force_authenticate(user)
+
+    # method call
+    response = client.get('/api/v1/messages/stats/?exact=true')
+
+    # assertions
+    assert response.status_code == 200
+    email_service.retrieve_nr_of_unread_emails.assert_called_once_with(exact=True)
 
 
 def test_email_lock_view(mocker, user, db):
@@ -112,3 +358,45 @@ def test_email_lock_view(mocker, user, db):
     # assertions
     assert response.status_code == 200
     email_service.lock_email.assert_called_once_with(payload)
+
+
+def test_email_list_view_tells_how_fresh_the_emails_are(mocker, user):
+    # test setup and mocking
+    mocker.patch.object(EmailListView, 'get_service')
+    email_service = mocker.Mock()
+    email_service.retrieve_unread_emails.return_value = []
+    email_service.synced_at = datetime.datetime(2019, 3, 19, 10, 31, 21, tzinfo=datetime.timezone.utc)
+    email_service.refreshing = True
+    EmailListView.get_service.return_value = email_service
+    client = APIClient()
+    client.force_authenticate(user)
+
+    # method call
+    response = client.get('/api/v1/messages/')
+
+    # assertions
+    assert response.status_code == 200
+    assert response['Last-Modified'] == 'Tue, 19 Mar 2019 10:31:21 GMT'
+    assert response['X-Refreshing'] == 'true'
+
+
+def test_email_stats_view_flags_stale_counts(mocker, user):
+    # test setup and mocking
+    mocker.patch.object(EmailStatsView, 'get_service')
+    email_service = mocker.Mock()
+    email_service.retrieve_nr_of_unread_emails.return_value = {'gmail': 21}
+    email_service.synced_at = datetime.datetime(2019, 3, 19, 10, 31, 21, tzinfo=datetime.timezone.utc)
+    email_service.refreshing = False
+    email_service.stale = True
+    EmailStatsView.get_service.return_value = email_service
+    client = APIClient()
+    client.force_authenticate(user)
+
+    # method call
+    response = client.get('/api/v1/messages/stats/')
+
+    # assertions
+    assert response.status_code == 200
+    assert response.data == {'unread': 21}
+    assert response['Last-Modified'] == 'Tue, 19 Mar 2019 10:31:21 GMT'
+    assert response['X-Stale'] == 'true'
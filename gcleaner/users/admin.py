@@ -1,8 +1,18 @@
 from django.contrib import admin
 
-from gcleaner.users.models import User
+from gcleaner.users.models import User, GoogleToken
 
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
     pass
+
+
+@admin.register(GoogleToken)
+class GoogleTokenAdmin(admin.ModelAdmin):
+    list_display = [
+        'user',
+        'expiry',
+        'updated_at'
+    ]
+    exclude = ['access_token', 'refresh_token']
@@ -10,3 +10,23 @@ class User(AbstractUser):
 
     def __str__(self):
         return self.username
+
+
+class GoogleToken(models.Model):
+    """
+    The Google OAuth tokens of a User, encrypted at rest.
+
+    Tokens are kept server-side, so an access token refreshed by one request
+    is reused by the following ones until it expires.
+    """
+    # Relations
+    user = models.OneToOneField(User, related_name='google_token', on_delete=models.CASCADE)
+
+    # Attributes
+    access_token = models.TextField(help_text='Encrypted OAuth access token.')
+    refresh_token = models.TextField(blank=True, help_text='Encrypted OAuth refresh token.')
+    expiry = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "<GoogleToken %s until %s>" % (self.user, self.expiry)
@@ -1,10 +1,7 @@
-from django.conf import settings
-
-from google.oauth2.credentials import Credentials
 from rest_framework.authentication import get_authorization_header
 from rest_framework_jwt.utils import jwt_decode_handler
 
-from gcleaner.utils.readers import get_credentials_config_json
+from gcleaner.authentication.tokens import build_credentials, get_user_credentials
 
 
 class APIJWTDecoderMixin(object):
@@ -15,33 +12,33 @@ class APIJWTDecoderMixin(object):
     As this is a mixin for the protected endpoints, the assumption
     is that the JWT tokens are going to be valid as they will pass
     the validity checks within the REST framework, so no additional
-    validation of JWT token is needed within this mixin.
+    validation of JWT token is needed within this mixin. The payload
+    decoded by `gcleaner.authentication.backends.JSONWebTokenAuthentication`
+    is reused instead of decoding the token again.
     """
 
     def get_google_credentials(self, request):
         """
-        Build a `google.oauth2.credentials.Credentials` instance from JWT token.
+        Build a `google.oauth2.credentials.Credentials` instance for the user of the request.
 
-        JWT token along `GOOGLE_AUTH_SETTINGS` property within django settings
-        contain all the necessary info necessary to build a credentials instance.
+        Tokens of authenticated users are read from the server-side token
+        store, JWTs only carry them for requests without an authenticated user.
 
         :param {Request} request: The API request.
 
         :return: The Credentials instance.
         """
-        auth = get_authorization_header(request).split()
-        if not auth:
-            return None
+        payload = getattr(request, 'auth', None)
 
-        payload = jwt_decode_handler(auth[1])
+        if not isinstance(payload, dict):
+            auth = get_authorization_header(request).split()
+            if not auth:
+                return None
 
-        config = get_credentials_config_json()
+            payload = jwt_decode_handler(auth[1])
 
-        credentials = Credentials(payload.get('access_token'),
-                                  refresh_token=payload.get('refresh_token'),
-                                  token_uri=settings.GOOGLE_AUTH_SETTINGS['OAUTH2_TOKEN_ENDPOINT'],
-                                  client_id=config.get('client_id'),
-                                  client_secret=config.get('client_secret'),
-                                  scopes=settings.GOOGLE_AUTH_SETTINGS['SCOPES'])
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return get_user_credentials(user, payload)
 
-        return credentials
+        return build_credentials(payload.get('access_token'), refresh_token=payload.get('refresh_token'))
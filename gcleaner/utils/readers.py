@@ -1,18 +1,37 @@
 import json
+import os
+import threading
 
 from django.conf import settings
 
+_credentials_config = {}
+_credentials_config_lock = threading.Lock()
+
 
 def get_credentials_config_json():
     """
     Read the credentials.json file and return its contents as a dict.
 
+    The parsed content is cached for the lifetime of the process and read
+    again only once the modification time of the file changes, so requests
+    do not have to open and parse the file.
+
     :TODO: adjust this method to account for encrypted credentials.json file.
 
     :return: The credentials.json content
     :rtype: dict
     """
-    with open(settings.GOOGLE_AUTH_SETTINGS['CREDENTIALS'], 'r') as c:
-        config = json.load(c)['web']
+    path = str(settings.GOOGLE_AUTH_SETTINGS['CREDENTIALS'])
+    mtime = os.stat(path).st_mtime_ns
+
+    cached = _credentials_config.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with _credentials_config_lock:
+        with open(path, 'r') as c:
+            config = json.load(c)['web']
+
+        _credentials_config[path] = (mtime, config)
 
     return config